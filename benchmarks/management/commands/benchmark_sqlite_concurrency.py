@@ -0,0 +1,241 @@
+import json
+import random
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from benchmarks.scenarios import stubbed_services
+from benchmarks.seed import seed
+from books.models import Book
+from payments.models import CheckoutSession
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "BEGIN")
+
+
+class LockStats:
+    """Write statements that waited for the database lock, and lock errors."""
+
+    def __init__(self, threshold_ms: float):
+        self.threshold = threshold_ms / 1000
+        self.lock = threading.Lock()
+        self.waits = []
+        self.errors = 0
+
+    def timed_write(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as exc:
+            if "locked" in str(exc):
+                with self.lock:
+                    self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if elapsed > self.threshold:
+                with self.lock:
+                    self.waits.append(elapsed)
+
+    def install(self):
+        """Time the statements of the calling thread's connection."""
+        connection.execute_wrappers.append(self.timed_write)
+
+    def report(self) -> dict:
+        return {
+            "locked_errors": self.errors,
+            "waits": len(self.waits),
+            "wait_total_ms": round(sum(self.waits) * 1000, 1),
+            "wait_max_ms": round(max(self.waits, default=0) * 1000, 1),
+        }
+
+
+class Command(BaseCommand):
+    """
+    Django command to run borrow and return writes alongside list reads
+    from several threads on the SQLite database, reporting the latencies
+    and the waits on the database lock.
+
+    Compare a run with SQLITE_PROFILE=performance to one without it. The
+    synthetic rows are committed (the threads must see each other's
+    writes) and deleted at the end, so use a copy of the database.
+    """
+
+    help = "Benchmark concurrent writes and reads on SQLite"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument(
+            "--scale", type=int, default=10_000, help="borrowings to seed"
+        )
+        parser.add_argument(
+            "--lock-wait-ms",
+            type=float,
+            default=10,
+            help="write statements slower than this count as lock waits",
+        )
+        parser.add_argument("--output", help="write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark is for the SQLite backend.")
+        pragmas = {
+            name: connection.cursor().execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("journal_mode", "synchronous", "busy_timeout")
+        }
+        self.stdout.write(f"pragmas: {pragmas}")
+
+        data = seed(
+            users=max(options["scale"] // 10, options["writers"]),
+            books=max(options["scale"] // 10, 100),
+            borrowings=options["scale"],
+            inventory=(5, 10),
+            log=self.stdout.write,
+        )
+        admin = get_user_model().objects.create(
+            email=f"bench{data.run}_admin@example.com", password="!", is_staff=True
+        )
+        self.stats = LockStats(options["lock_wait_ms"])
+        self.latencies = {"borrow": [], "return": [], "list": []}
+        self.failures = {name: 0 for name in self.latencies}
+        self.results_lock = threading.Lock()
+        started_at = timezone.now()
+        deadline = time.monotonic() + options["seconds"]
+
+        try:
+            with stubbed_services(), override_settings(ALLOWED_HOSTS=["testserver"]):
+                threads = [
+                    threading.Thread(
+                        target=self.worker,
+                        args=(self.write, admin, data.user_ids[i], data, deadline),
+                    )
+                    for i in range(options["writers"])
+                ] + [
+                    threading.Thread(
+                        target=self.worker,
+                        args=(self.read, admin, None, data, deadline),
+                    )
+                    for _ in range(options["readers"])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            self.stdout.write("Deleting the synthetic rows...")
+            get_user_model().objects.filter(pk__in=[admin.pk, *data.user_ids]).delete()
+            Book.objects.filter(pk__in=data.book_ids).delete()
+            CheckoutSession.objects.filter(
+                Q(session_id__startswith=f"cs_bench_{data.run}_")
+                | Q(created_at__gte=started_at),
+                payments__isnull=True,
+            ).delete()
+
+        report = {
+            "pragmas": pragmas,
+            "threads": {"writers": options["writers"], "readers": options["readers"]},
+            "seconds": options["seconds"],
+            "operations": {
+                name: self.summary(durations, self.failures[name], options["seconds"])
+                for name, durations in self.latencies.items()
+            },
+            "locks": self.stats.report(),
+        }
+        for name, summary in report["operations"].items():
+            self.stdout.write(
+                f"{name:<8} {summary['ops_per_second']:>8.1f} ops/s  "
+                f"p50 {summary['p50_ms']:>8.1f} ms  p95 {summary['p95_ms']:>8.1f} ms  "
+                f"max {summary['max_ms']:>8.1f} ms  failed {summary['failed']}"
+            )
+        locks = report["locks"]
+        self.stdout.write(
+            f"lock waits: {locks['waits']} write statements over "
+            f"{options['lock_wait_ms']} ms, {locks['wait_total_ms']} ms in total, "
+            f"max {locks['wait_max_ms']} ms; "
+            f"'database is locked' errors: {locks['locked_errors']}"
+        )
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2) + "\n")
+
+    def worker(self, operation, admin, user_id, data, deadline):
+        client = APIClient()
+        client.force_authenticate(admin)
+        self.stats.install()
+        try:
+            while time.monotonic() < deadline:
+                operation(client, user_id, data)
+        finally:
+            connection.close()
+
+    def timed(self, name, call):
+        started = time.perf_counter()
+        try:
+            response = call()
+        except OperationalError:
+            response = None
+        elapsed = time.perf_counter() - started
+        with self.results_lock:
+            if response is None or response.status_code >= 400:
+                self.failures[name] += 1
+            else:
+                self.latencies[name].append(elapsed)
+        return response
+
+    def write(self, client, user_id, data):
+        response = self.timed(
+            "borrow",
+            lambda: client.post(
+                reverse("borrowings:borrowing-list"),
+                {
+                    "user": user_id,
+                    "book": data.random_book_id(),
+                    "expected_return_date": date.today() + timedelta(days=14),
+                },
+            ),
+        )
+        if response is not None and response.status_code == 201:
+            url = reverse(
+                "borrowings:borrowing-return-book", args=[response.data["id"]]
+            )
+            self.timed("return", lambda: client.post(url))
+
+    def read(self, client, user_id, data):
+        url = random.choice(
+            (reverse("borrowings:borrowing-list"), reverse("payments:payment-list"))
+        )
+        self.timed("list", lambda: client.get(url, {"user_id": data.random_user_id()}))
+
+    @staticmethod
+    def summary(durations, failed, seconds) -> dict:
+        durations = sorted(durations)
+        if not durations:
+            return {
+                "ops": 0,
+                "ops_per_second": 0,
+                "p50_ms": 0,
+                "p95_ms": 0,
+                "max_ms": 0,
+                "failed": failed,
+            }
+        return {
+            "ops": len(durations),
+            "ops_per_second": round(len(durations) / seconds, 1),
+            "p50_ms": round(statistics.median(durations) * 1000, 1),
+            "p95_ms": round(durations[int(0.95 * (len(durations) - 1))] * 1000, 1),
+            "max_ms": round(durations[-1] * 1000, 1),
+            "failed": failed,
+        }
@@ -0,0 +1,148 @@
+import json
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from benchmarks.scenarios import Scenarios, isolated_cache, stubbed_services
+from benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    """
+    Django command to time the API hot paths on synthetic data and write
+    the results as JSON, optionally comparing them with an earlier run.
+
+    Each scenario requests its endpoint through the test client with the
+    Stripe and Telegram calls stubbed out. The seeded rows are rolled back
+    afterwards and the responses they cached are written under a throwaway
+    key prefix, so the real data and its cache are left as they were.
+    """
+
+    help = "Run the API benchmark scenarios on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=10_000,
+            help="number of borrowings (and payments) to seed",
+        )
+        parser.add_argument("--users", type=int, help="default: scale / 10")
+        parser.add_argument("--books", type=int, help="default: scale / 10")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="scenarios",
+            help="run only this scenario (can be repeated)",
+        )
+        parser.add_argument("--output", help="write the results to this JSON file")
+        parser.add_argument("--compare", help="JSON results of an earlier run")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.2,
+            help="median ratio above which a scenario counts as a regression",
+        )
+
+    def handle(self, *args, **options):
+        scale = options["scale"]
+        users = options["users"] or max(scale // 10, 100)
+        books = options["books"] or max(scale // 10, 2 * (options["repeat"] + 1), 100)
+
+        with (
+            transaction.atomic(),
+            stubbed_services(),
+            isolated_cache(),
+            override_settings(ALLOWED_HOSTS=["testserver"]),
+        ):
+            data = seed(
+                users=users,
+                books=books,
+                borrowings=scale,
+                inventory=(1, 10),
+                log=self.stdout.write,
+            )
+            scenarios = Scenarios(data, options["repeat"])
+            available = scenarios.all()
+            selected = options["scenarios"] or list(available)
+            unknown = set(selected) - set(available)
+            if unknown:
+                raise CommandError(
+                    f"Unknown scenarios {sorted(unknown)}, "
+                    f"choose from {list(available)}"
+                )
+
+            results = {}
+            for name in selected:
+                results[name] = scenarios.measure(available[name])
+                self.stdout.write(
+                    f"{name:<22} {results[name]['median_ms']:>10.3f} ms median, "
+                    f"{results[name]['p95_ms']:>10.3f} ms p95, "
+                    f"{results[name]['queries']:>4} queries"
+                )
+
+            transaction.set_rollback(True)
+
+        report = {
+            "meta": {
+                "commit": self.git_commit(),
+                "date": datetime.now().isoformat(timespec="seconds"),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "scale": {"users": users, "books": books, "borrowings": scale},
+                "repeat": options["repeat"],
+            },
+            "scenarios": results,
+        }
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2) + "\n")
+            self.stdout.write(
+                self.style.SUCCESS(f"Results written to {options['output']}")
+            )
+        if options["compare"]:
+            self.compare(
+                json.loads(Path(options["compare"]).read_text()),
+                report,
+                options["threshold"],
+            )
+
+    def compare(self, before, after, threshold):
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"Median ms, {before['meta'].get('commit')} -> "
+                f"{after['meta'].get('commit')}"
+            )
+        )
+        for name, result in after["scenarios"].items():
+            previous = before["scenarios"].get(name)
+            if previous is None:
+                continue
+            ratio = result["median_ms"] / max(previous["median_ms"], 1e-6)
+            line = (
+                f"{name:<22} {previous['median_ms']:>10.3f} -> "
+                f"{result['median_ms']:>10.3f}  (x{ratio:.2f}), queries "
+                f"{previous['queries']} -> {result['queries']}"
+            )
+            if ratio > threshold or result["queries"] > previous["queries"]:
+                self.stdout.write(self.style.ERROR(f"{line}  REGRESSION"))
+            else:
+                self.stdout.write(line)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,225 @@
+"""
+Timed scenarios over the API hot paths.
+
+Each scenario is one request (or task run), issued through the DRF test
+client against the seeded data with Stripe and Telegram stubbed out.
+The callbacks a request registers with `transaction.on_commit` are run
+right after it and counted in its time, as they would at commit.
+Scenarios that need some state first (a borrowing to return, a warm
+cache) prepare it themselves before each run, outside of the timings,
+so that any of them can be run alone.
+"""
+
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from books.cache import CATALOGUE_VERSION_KEY, bump_catalogue_version
+from borrowing.tasks import daily_checking_borrowings
+from library_service.stats import STATS_CACHE_KEY
+from payments.stripe_stub import StubStripe
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+@contextmanager
+def stubbed_services():
+    async def send_messages(chat_id, texts, max_parallel):
+        pass
+
+    with mock.patch("payments.stripe_helper.stripe", StubStripe()), mock.patch(
+        "borrowing.views.notify_admin"
+    ), mock.patch("borrowing.tasks.send_messages", send_messages):
+        yield
+
+
+@contextmanager
+def isolated_cache():
+    """
+    Prefix the cache keys with one of their own for the block, so that a
+    run neither serves the cached responses of the real data nor leaves
+    its own behind for it. Its catalogue version, the one entry that does
+    not expire, is deleted at the end.
+    """
+    prefix = f"bench{time.time_ns()}"
+    caches = {
+        alias: {**config, "KEY_PREFIX": f"{prefix}:{config.get('KEY_PREFIX', '')}"}
+        for alias, config in settings.CACHES.items()
+    }
+    with override_settings(CACHES=caches):
+        try:
+            yield
+        finally:
+            cache.delete(CATALOGUE_VERSION_KEY)
+
+
+@contextmanager
+def running_on_commit():
+    """Run the on_commit callbacks registered inside the block at its end."""
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback, _ in callbacks:
+        callback()
+
+
+@contextmanager
+def counting_queries(queries: list):
+    """
+    Collect the SQL run inside the block.
+
+    CaptureQueriesContext would lose the queries of a request, as Django
+    resets the query log when one starts, and `connection.execute_wrapper`
+    pops the last wrapper on exit, which is the metrics one when the first
+    request installed it.
+    """
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    connection.execute_wrappers.append(count_query)
+    try:
+        yield
+    finally:
+        connection.execute_wrappers.remove(count_query)
+
+
+class Scenarios:
+    def __init__(self, data, repeat: int):
+        self.data = data
+        self.repeat = repeat
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create(
+                email=f"bench{data.run}_admin@example.com", password="!", is_staff=True
+            )
+        )
+        # borrowers without open borrowings and books, one per borrow run
+        # and one per return run
+        self.borrowers = iter(
+            User.objects.bulk_create(
+                User(email=f"bench{data.run}_borrower{i}@example.com", password="!")
+                for i in range(2 * (repeat + 1))
+            )
+        )
+        self.books = iter(data.book_ids)
+        self.borrowed = []
+
+    def call(self, method, url, data=None):
+        response = getattr(self.client, method)(url, data, format="json")
+        if response.status_code >= 400:
+            raise BenchmarkError(f"{method.upper()} {url}: {response.status_code}")
+        return response
+
+    def book_list(self):
+        bump_catalogue_version()
+        self.call("get", reverse("books:book-list"))
+
+    def book_list_cached(self):
+        self.call("get", reverse("books:book-list"))
+
+    def borrowing_list(self):
+        self.call("get", reverse("borrowing:borrowing-list"))
+
+    def borrowing_retrieve(self):
+        borrowing_id = random.choice(self.data.borrowing_ids)
+        self.call("get", reverse("borrowing:borrowing-detail", args=[borrowing_id]))
+
+    def borrow(self):
+        response = self.call(
+            "post",
+            reverse("borrowing:borrowing-list"),
+            {
+                "user": next(self.borrowers).pk,
+                "book": next(self.books),
+                "expected_return_date": "2100-01-01",
+            },
+        )
+        self.borrowed.append(response.data["id"])
+
+    def return_book(self):
+        borrowing_id = self.borrowed.pop()
+        self.call(
+            "post", reverse("borrowing:borrowing-return-book", args=[borrowing_id])
+        )
+
+    def payment_list(self):
+        self.call("get", reverse("payments:payment-list"))
+
+    def admin_stats(self):
+        cache.delete(STATS_CACHE_KEY.format(days=30, top=10))
+        self.call("get", reverse("stats"))
+
+    def admin_stats_cached(self):
+        self.call("get", reverse("stats"))
+
+    def preparations(self) -> dict:
+        """The untimed step run before each run of a scenario, if any."""
+        return {
+            self.book_list_cached: self.book_list_cached,
+            self.return_book: self.borrow,
+            self.admin_stats_cached: self.admin_stats_cached,
+        }
+
+    def daily_overdue_task(self):
+        daily_checking_borrowings()
+
+    def all(self):
+        return {
+            "book list": self.book_list,
+            "book list (cached)": self.book_list_cached,
+            "borrowing list": self.borrowing_list,
+            "borrowing retrieve": self.borrowing_retrieve,
+            "borrow": self.borrow,
+            "return": self.return_book,
+            "payment list": self.payment_list,
+            "admin stats": self.admin_stats,
+            "admin stats (cached)": self.admin_stats_cached,
+            "daily overdue task": self.daily_overdue_task,
+        }
+
+    def measure(self, run) -> dict:
+        """
+        One untimed run counting the queries (and warming the caches up),
+        then `repeat` timed runs.
+        """
+        prepare = self.preparations().get(run)
+        queries = []
+        if prepare:
+            with running_on_commit():
+                prepare()
+        with counting_queries(queries), running_on_commit():
+            run()
+        durations = []
+        for _ in range(self.repeat):
+            if prepare:
+                with running_on_commit():
+                    prepare()
+            started = time.perf_counter()
+            with running_on_commit():
+                run()
+            durations.append((time.perf_counter() - started) * 1000)
+        durations.sort()
+        return {
+            "runs": len(durations),
+            "queries": len(queries),
+            "min_ms": round(durations[0], 3),
+            "median_ms": round(statistics.median(durations), 3),
+            "p95_ms": round(durations[int(0.95 * (len(durations) - 1))], 3),
+            "mean_ms": round(statistics.fmean(durations), 3),
+        }
@@ -0,0 +1,139 @@
+"""
+Synthetic users, books, borrowings and payments for the benchmarks.
+
+Everything is written with bulk inserts in batches, so seeding ten
+million borrowings only keeps one batch, the user and book ids and a
+sample of the borrowing ids in memory.
+The benchmark commands seed inside a transaction they roll back, which
+leaves the database as it was.
+"""
+
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+
+from books.models import Book
+from borrowing.models import Borrowing
+from payments.models import CheckoutSession, Payment
+
+BATCH_SIZE = 10_000
+SAMPLE_PER_BATCH = 100
+WORDS = (
+    "war peace night day river stone house garden winter summer king queen "
+    "love death shadow light city island journey secret storm fire letter "
+    "dream silent golden lost last first long dark little great"
+).split()
+
+
+class SyntheticData:
+    """Ids of the seeded rows, for the scenarios to pick from."""
+
+    def __init__(self, run):
+        self.run = run
+        self.user_ids = []
+        self.book_ids = []
+        self.borrowing_ids = []
+
+    def random_user_id(self):
+        return random.choice(self.user_ids)
+
+    def random_book_id(self):
+        return random.choice(self.book_ids)
+
+
+def batches(count: int, batch_size: int = BATCH_SIZE):
+    for start in range(0, count, batch_size):
+        yield range(start, min(start + batch_size, count))
+
+
+def seed(
+    users: int,
+    books: int,
+    borrowings: int,
+    open_share: float = 0.05,
+    inventory=(0, 10),
+    log=None,
+) -> SyntheticData:
+    """
+    Create the rows and return their ids.
+
+    `open_share` of the borrowings are not returned yet (half of them
+    overdue), every borrowing has a payment, and book inventories are
+    drawn from the `inventory` range.
+    """
+    data = SyntheticData(run=random.randint(0, 10**9))
+    log = log or (lambda message: None)
+
+    log(f"Seeding {users} users...")
+    User = get_user_model()
+    for numbers in batches(users):
+        created = User.objects.bulk_create(
+            # "!" is an unusable password: no hashing for synthetic users
+            User(email=f"bench{data.run}_{i}@example.com", password="!")
+            for i in numbers
+        )
+        data.user_ids.extend(user.pk for user in created)
+
+    log(f"Seeding {books} books...")
+    for numbers in batches(books):
+        created = Book.objects.bulk_create(
+            Book(
+                # the number keeps (title, author) unique
+                title=" ".join(random.choices(WORDS, k=random.randint(2, 5))) + f" {i}",
+                author=f"{random.choice(WORDS).title()} Author{i % 5000}",
+                cover=random.choice(("HARD", "SOFT")),
+                inventory=random.randint(*inventory),
+                daily_fee=random.choice((0.5, 1, 1.5, 2)),
+            )
+            for i in numbers
+        )
+        data.book_ids.extend(book.pk for book in created)
+
+    log(f"Seeding {borrowings} borrowings and payments...")
+    today = date.today()
+    for numbers in batches(borrowings):
+        batch = []
+        for _ in numbers:
+            still_open = random.random() < open_share
+            if still_open and random.random() < 0.5:
+                # overdue
+                borrow_date = today - timedelta(days=random.randint(15, 60))
+            elif still_open:
+                borrow_date = today - timedelta(days=random.randint(0, 13))
+            else:
+                borrow_date = today - timedelta(days=random.randint(14, 1000))
+            expected_return_date = borrow_date + timedelta(days=14)
+            batch.append(
+                Borrowing(
+                    borrow_date=borrow_date,
+                    expected_return_date=expected_return_date,
+                    actual_return_date=None if still_open else expected_return_date,
+                    book_id=data.random_book_id(),
+                    user_id=data.random_user_id(),
+                )
+            )
+        created = Borrowing.objects.bulk_create(batch)
+        sessions = CheckoutSession.objects.bulk_create(
+            CheckoutSession(
+                session_id=f"cs_bench_{data.run}_{borrowing.pk}",
+                session_url="https://checkout.stripe.test/",
+            )
+            for borrowing in created
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                status="PENDING" if borrowing.actual_return_date is None else "PAID",
+                type_pay="PAYMENT",
+                borrowing_id=borrowing.pk,
+                checkout_session=session,
+                money_to_pay=14,
+            )
+            for borrowing, session in zip(created, sessions)
+        )
+        # a sample is enough to pick from and keeps 10M rows out of memory
+        data.borrowing_ids.extend(
+            borrowing.pk
+            for borrowing in random.sample(created, min(len(created), SAMPLE_PER_BATCH))
+        )
+    return data
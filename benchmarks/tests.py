@@ -0,0 +1,80 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from books.cache import get_catalogue_version
+from books.models import Book
+from borrowing.models import Borrowing
+from library_service.stats import STATS_CACHE_KEY
+
+
+class RunBenchmarksTest(TestCase):
+    def test_writes_results_and_rolls_the_data_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            call_command(
+                "run_benchmarks",
+                scale=200,
+                users=20,
+                books=20,
+                repeat=2,
+                output=str(output),
+                stdout=StringIO(),
+            )
+            results = json.loads(output.read_text())
+
+        self.assertEqual(results["meta"]["scale"]["borrowings"], 200)
+        self.assertIn("borrow", results["scenarios"])
+        self.assertEqual(results["scenarios"]["borrow"]["runs"], 2)
+        self.assertGreater(results["scenarios"]["borrowing list"]["queries"], 0)
+        self.assertFalse(Book.objects.exists())
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_scenarios_run_alone_and_leave_the_cache_alone(self):
+        version = get_catalogue_version()
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            call_command(
+                "run_benchmarks",
+                scale=50,
+                users=10,
+                books=10,
+                repeat=2,
+                scenarios=["return", "admin stats (cached)", "book list (cached)"],
+                output=str(output),
+                stdout=StringIO(),
+            )
+            results = json.loads(output.read_text())
+
+        self.assertEqual(results["scenarios"]["return"]["runs"], 2)
+        # the cached scenarios are warmed up before their query count
+        self.assertLess(results["scenarios"]["admin stats (cached)"]["queries"], 5)
+        self.assertEqual(get_catalogue_version(), version)
+        self.assertIsNone(cache.get(STATS_CACHE_KEY.format(days=30, top=10)))
+
+
+class SqliteConcurrencyBenchmarkTest(TransactionTestCase):
+    def test_reports_operations_and_lock_waits_and_cleans_up(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            call_command(
+                "benchmark_sqlite_concurrency",
+                scale=100,
+                writers=2,
+                readers=1,
+                seconds=1,
+                output=str(output),
+                stdout=StringIO(),
+            )
+            results = json.loads(output.read_text())
+
+        self.assertGreater(results["operations"]["borrow"]["ops"], 0)
+        self.assertGreater(results["operations"]["list"]["ops"], 0)
+        self.assertIn("locked_errors", results["locks"])
+        self.assertFalse(Book.objects.exists())
+        self.assertFalse(Borrowing.objects.exists())
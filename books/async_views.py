@@ -0,0 +1,49 @@
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404
+from rest_framework import status
+from rest_framework.settings import api_settings
+
+from books.cache import acached_data, is_not_modified
+from books.models import Book
+from books.permissions import IsAdminOrIfOthersReadOnly
+from books.serializers import BookSerializer
+from library_service.async_views import AsyncAPIView
+
+
+class CatalogueAsyncView(AsyncAPIView):
+    permission_classes = (IsAdminOrIfOthersReadOnly,)
+
+    async def cached_response(self, request, compute):
+        etag, data = await acached_data(request, compute)
+        if is_not_modified(request, etag):
+            response = self.response(status_code=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = self.response(data)
+        response["ETag"] = etag
+        return response
+
+
+class BookAsyncListView(CatalogueAsyncView):
+    """Async twin of GET /api/books/, sharing its cursor pagination."""
+
+    async def get(self, request):
+        async def compute():
+            paginator = api_settings.DEFAULT_PAGINATION_CLASS()
+            # DRF's paginator is sync, its page query runs in a thread
+            page = await sync_to_async(paginator.paginate_queryset)(
+                Book.objects.all(), request, self
+            )
+            data = BookSerializer(page, many=True).data
+            return paginator.get_paginated_response(data).data
+
+        return await self.cached_response(request, compute)
+
+
+class BookAsyncDetailView(CatalogueAsyncView):
+    """Async twin of GET /api/books/<id>/."""
+
+    async def get(self, request, pk):
+        async def compute():
+            return BookSerializer(await aget_object_or_404(Book, pk=pk)).data
+
+        return await self.cached_response(request, compute)
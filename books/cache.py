@@ -0,0 +1,128 @@
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from library_service.db_router import apinned_to_primary, read_from_replica
+
+CATALOGUE_VERSION_KEY = "books:catalogue-version"
+
+
+def get_catalogue_version() -> int:
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version() -> None:
+    # a fresh timestamp rather than incr(), so that a version evicted from
+    # the cache can never come back and revive stale responses
+    cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_catalogue() -> None:
+    """
+    Drop every cached catalogue response.
+
+    The version is bumped right away and once more after the current
+    transaction commits, so a response cached from not yet committed
+    data in between is dropped as well.
+    """
+    bump_catalogue_version()
+    transaction.on_commit(bump_catalogue_version)
+
+
+class CatalogueCacheMixin:
+    """
+    Serve list and retrieve responses from the cache.
+
+    Entries are keyed by the catalogue version and the full request path,
+    and carry an ETag so that clients revalidating with If-None-Match
+    get a 304 without a body.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, view, *args, **kwargs):
+        version = get_catalogue_version()
+        key = catalogue_key(
+            version, request.accepted_renderer.format, request.get_full_path()
+        )
+        cached = cache.get(key)
+        if cached is None:
+            cached = cache_entry(view(request, *args, **kwargs).data)
+            cache.set(key, cached, cache_timeout(version))
+
+        etag, data = cached
+        if is_not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(data, headers={"ETag": etag})
+
+
+def cache_timeout(version) -> int:
+    if (
+        read_from_replica.get()
+        and time.time_ns() - version < settings.REPLICA_PIN_SECONDS * 10**9
+    ):
+        # the replica may not have caught up yet with the write
+        # that bumped the version
+        return settings.REPLICA_PIN_SECONDS
+    return settings.CATALOGUE_CACHE_TIMEOUT
+
+
+def catalogue_key(version, renderer_format: str, path: str) -> str:
+    return f"books:{version}:{renderer_format}:{path}"
+
+
+def cache_entry(data) -> tuple:
+    etag = quote_etag(
+        hashlib.md5(
+            json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+        ).hexdigest()
+    )
+    return etag, data
+
+
+def is_not_modified(request, etag: str) -> bool:
+    if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+    return etag in if_none_match or "*" in if_none_match
+
+
+async def acached_data(request, compute) -> tuple:
+    """
+    The (etag, data) of a catalogue response for the async views,
+    awaiting `compute()` for the data on a cache miss.
+
+    Like `ReplicaReadMixin`, `compute()` reads from the replica unless
+    the user is pinned to the primary after a write.
+    """
+    version = await cache.aget(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = await sync_to_async(get_catalogue_version)()
+    key = catalogue_key(version, "json", request.get_full_path())
+    cached = await cache.aget(key)
+    if cached is None:
+        token = None
+        if settings.READ_REPLICA and not await apinned_to_primary(request.user):
+            token = read_from_replica.set(True)
+        try:
+            cached = cache_entry(await compute())
+            await cache.aset(key, cached, cache_timeout(version))
+        finally:
+            if token is not None:
+                read_from_replica.reset(token)
+    return cached
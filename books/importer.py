@@ -0,0 +1,178 @@
+"""
+Bulk import of the book catalogue from CSV or JSON files.
+
+Files are parsed as a stream of rows, validated in batches with
+`BookImportSerializer` and upserted with one INSERT ... ON CONFLICT per
+batch keyed on (title, author), so memory use does not depend on the
+size of the file.
+
+Each batch is committed on its own, with the copies it adds to books
+that readers wait for handed to their holds. A file that cannot be parsed past
+some row stops the import there: the rows before it stay imported and
+the report says where it stopped, so the fixed file can be imported
+again (the upsert makes that idempotent).
+"""
+
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import transaction
+from rest_framework import serializers
+
+from books.cache import invalidate_catalogue
+from books.models import Book
+from books.serializers import BookImportSerializer
+from borrowing.holds import hand_over_copies
+from borrowing.models import Hold
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+JSON_READ_SIZE = 64 * 1024
+UPDATE_FIELDS = ["cover", "inventory", "daily_fee"]
+
+
+def iter_csv_rows(stream):
+    yield from csv.DictReader(stream)
+
+
+def iter_json_rows(stream):
+    """
+    Yield the objects of a JSON array (or of newline delimited JSON)
+    without reading the whole stream.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    while True:
+        # skip the array brackets and the separators between the objects
+        while position < len(buffer) and buffer[position] in "[], \t\r\n":
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = stream.read(JSON_READ_SIZE), 0
+            eof = not buffer
+            continue
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = stream.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield row
+        position = end
+
+
+ROW_READERS = {
+    "csv": iter_csv_rows,
+    "json": iter_json_rows,
+}
+
+
+def validate_batch(batch, first_row: int, report: dict) -> list:
+    """
+    Validate the rows with one serializer for the whole batch, recording
+    the errors of the invalid ones in the report.
+    """
+    serializer = BookImportSerializer()
+    valid = []
+    for number, row in enumerate(batch, start=first_row):
+        try:
+            valid.append(serializer.run_validation(row))
+        except serializers.ValidationError as exc:
+            report["failed"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": number, "errors": exc.detail})
+    return valid
+
+
+def read_batch(rows, batch_size: int, report: dict) -> list:
+    """The next rows, up to the one the reader cannot parse, if any."""
+    batch = []
+    try:
+        for row in islice(rows, batch_size):
+            batch.append(row)
+    except (ValueError, csv.Error) as exc:
+        report["stopped_at"] = {
+            "row": report["rows"] + len(batch) + 1,
+            "error": f"Cannot parse the file: {exc}",
+        }
+    return batch
+
+
+def upsert_batch(books: dict) -> None:
+    """
+    Upsert the books keyed by (title, author). The copies an upsert adds
+    to a book with waiting holds go to the holds, as they would through
+    the API, instead of to the shelf.
+    """
+    waiting_holds = (
+        Hold.objects.filter(
+            status=Hold.WAITING,
+            book__title__in={title for title, _ in books},
+            book__author__in={author for _, author in books},
+        )
+        .values_list("book_id", "book__title", "book__author", "book__inventory")
+        .distinct()
+    )
+    with transaction.atomic():
+        waiting = list(waiting_holds)
+        Book.objects.bulk_create(
+            books.values(),
+            update_conflicts=True,
+            unique_fields=["title", "author"],
+            update_fields=UPDATE_FIELDS,
+        )
+        for book_id, title, author, inventory in waiting:
+            book = books.get((title, author))
+            added = book.inventory - inventory if book else 0
+            if added > 0 and Book.objects.remove_copies(book_id, added):
+                hand_over_copies(book_id, added)
+
+
+def with_throughput(report: dict, started: float) -> dict:
+    seconds = time.monotonic() - started
+    return {
+        **report,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(report["rows"] / seconds) if seconds else 0,
+    }
+
+
+def import_books(rows, batch_size: int = IMPORT_BATCH_SIZE, progress=None) -> dict:
+    """
+    Validate and upsert the rows batch by batch.
+
+    `progress` is called with the running report after every batch.
+    Returns the report: the number of rows read, imported, rejected and
+    overridden by a later row of the same book in their batch, the first
+    MAX_REPORTED_ERRORS row errors and the throughput, plus
+    `stopped_at` (the row number and the error) when the file could not
+    be parsed to its end.
+    """
+    started = time.monotonic()
+    report = {"rows": 0, "imported": 0, "failed": 0, "duplicates": 0, "errors": []}
+    rows = iter(rows)
+    while batch := read_batch(rows, batch_size, report):
+        valid = validate_batch(batch, report["rows"] + 1, report)
+        # one row per natural key: a statement cannot upsert the same row twice
+        books = {(data["title"], data["author"]): Book(**data) for data in valid}
+        if books:
+            upsert_batch(books)
+        report["rows"] += len(batch)
+        report["imported"] += len(books)
+        report["duplicates"] += len(valid) - len(books)
+        if progress:
+            progress(with_throughput(report, started))
+        if "stopped_at" in report:
+            break
+
+    if report["imported"]:
+        invalidate_catalogue()
+    return with_throughput(report, started)
@@ -0,0 +1,66 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from benchmarks.seed import WORDS, seed
+from books.models import Book
+from books.search import matching, ranked, facet_counts
+
+
+class Command(BaseCommand):
+    """
+    Django command to compare the full-text search index with plain
+    LIKE filters on a synthetic catalogue.
+
+    Search, autocomplete and facets each run once with icontains and
+    istartswith filters and once through the FTS5 table that the triggers
+    fill in as the books are seeded. Rolling back the seeded books at the
+    end removes their search rows too.
+    """
+
+    help = "Benchmark the book search index on a synthetic catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        with transaction.atomic():
+            seed(users=0, books=options["books"], borrowings=0, log=self.stdout.write)
+            terms = random.sample(WORDS, 2)
+            prefix = [random.choice(WORDS)[:3]]
+            books = Book.objects.all()
+            like = books
+            for term in terms:
+                like = like.filter(Q(title__icontains=term) | Q(author__icontains=term))
+
+            timings = {
+                "search (LIKE)": lambda: list(like.order_by("title", "id")[:20]),
+                "search (index)": lambda: ranked(books, terms),
+                "autocomplete (LIKE)": lambda: list(
+                    books.filter(title__istartswith=prefix[0])[:10]
+                ),
+                "autocomplete (index)": lambda: ranked(
+                    books, prefix, prefix=True, limit=10
+                ),
+                "facets (LIKE)": lambda: facet_counts(like),
+                "facets (index)": lambda: facet_counts(matching(books, terms)),
+            }
+            self.stdout.write(f"terms: {terms}, prefix: {prefix}")
+            for name, run in timings.items():
+                self.stdout.write(f"{name:<24} {self.median_ms(run):>10.3f} ms")
+
+            transaction.set_rollback(True)
+
+    def median_ms(self, run):
+        durations = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            run()
+            durations.append((time.perf_counter() - started) * 1000)
+        return statistics.median(durations)
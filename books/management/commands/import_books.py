@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.importer import IMPORT_BATCH_SIZE, ROW_READERS, import_books
+
+
+class Command(BaseCommand):
+    """
+    Django command to upsert books from a CSV file (with a header row) or
+    a JSON array / newline delimited JSON file of objects with the
+    title, author, cover, inventory and daily_fee fields.
+    """
+
+    help = "Import the book catalogue from a CSV or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format",
+            choices=list(ROW_READERS),
+            dest="file_format",
+            help="file format, guessed from the file extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["file_format"] or path.suffix.lstrip(".").lower()
+        if file_format == "ndjson":
+            file_format = "json"
+        if file_format not in ROW_READERS:
+            raise CommandError(
+                f"Cannot guess the format of {path}, use --format csv|json"
+            )
+
+        with path.open(encoding="utf-8-sig", newline="") as stream:
+            report = import_books(
+                ROW_READERS[file_format](stream),
+                batch_size=options["batch_size"],
+                progress=self.progress,
+            )
+
+        for error in report.pop("errors"):
+            self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{report['imported']} of {report['rows']} rows imported, "
+                f"{report['failed']} rejected, {report['duplicates']} overridden "
+                f"by a later row in {report['seconds']} s "
+                f"({report['rows_per_second']} rows/s)"
+            )
+        )
+        if "stopped_at" in report:
+            stopped_at = report["stopped_at"]
+            raise CommandError(
+                f"Stopped at row {stopped_at['row']}: {stopped_at['error']}"
+            )
+
+    def progress(self, report):
+        self.stdout.write(
+            f"{report['rows']} rows read, {report['imported']} imported, "
+            f"{report['failed']} rejected ({report['rows_per_second']} rows/s)"
+        )
@@ -0,0 +1,121 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+# the FTS5 triggers of 0002_book_search_index, which SQLite drops when
+# adding the constraint rebuilds the table
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_insert AFTER INSERT ON books_book BEGIN
+        INSERT INTO books_book_fts(rowid, title, author)
+        VALUES (new.id, new.title, new.author);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_delete AFTER DELETE ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_update AFTER UPDATE OF title, author
+    ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_book_fts(rowid, title, author)
+        VALUES (new.id, new.title, new.author);
+    END
+    """,
+]
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """
+    Fold the copies of a book entered more than once into the oldest row.
+
+    Only rows identical but for their inventory are merged: their
+    inventories are added up and every row pointing to the others is
+    repointed first. Duplicates differing in cover or daily fee stop the
+    migration, listing them for an operator to resolve by hand.
+    """
+    db_alias = schema_editor.connection.alias
+    Book = apps.get_model("books", "Book")
+    books = Book.objects.using(db_alias)
+    duplicates = list(
+        books.values("title", "author")
+        .annotate(
+            copies=Count("id"),
+            keep=Min("id"),
+            inventory=Sum("inventory"),
+            covers=Count("cover", distinct=True),
+            fees=Count("daily_fee", distinct=True),
+        )
+        .filter(copies__gt=1)
+        .order_by("title", "author")
+    )
+    conflicting = [
+        group for group in duplicates if group["covers"] > 1 or group["fees"] > 1
+    ]
+    if conflicting:
+        rows = "\n".join(
+            f"  id={book.id} title={book.title!r} author={book.author!r} "
+            f"cover={book.cover} daily_fee={book.daily_fee} "
+            f"inventory={book.inventory}"
+            for group in conflicting
+            for book in books.filter(
+                title=group["title"], author=group["author"]
+            ).order_by("id")
+        )
+        raise RuntimeError(
+            "Cannot add the unique (title, author) constraint: these books "
+            "share a title and author but differ in cover or daily fee. "
+            "Rename, merge or delete them, then migrate again.\n" + rows
+        )
+
+    relations = [
+        relation
+        for relation in Book._meta.related_objects
+        if relation.one_to_many or relation.one_to_one
+    ]
+    for group in duplicates:
+        others = list(
+            books.filter(title=group["title"], author=group["author"])
+            .exclude(pk=group["keep"])
+            .values_list("id", flat=True)
+        )
+        for relation in relations:
+            relation.related_model.objects.using(db_alias).filter(
+                **{f"{relation.field.name}__in": others}
+            ).update(**{relation.field.name: group["keep"]})
+        books.filter(pk__in=others).delete()
+        books.filter(pk=group["keep"]).update(inventory=group["inventory"])
+
+
+def create_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("books", "0002_book_search_index"),
+        ("borrowing", "0002_borrowing_open_indexes"),
+    ]
+
+    operations = [
+        # going back, removing the constraint rebuilds the table again
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        # the merged rows cannot be split again; going back only drops
+        # the constraint
+        migrations.RunPython(merge_duplicate_books, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="book",
+            constraint=models.UniqueConstraint(
+                fields=("title", "author"), name="book_title_author_unique"
+            ),
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop),
+    ]
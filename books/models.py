@@ -1,4 +1,55 @@
 from django.db import models
+from django.db.models import F
+
+from books.cache import invalidate_catalogue
+
+
+class BookQuerySet(models.QuerySet):
+    def reserve_copy(self, book_id) -> bool:
+        """
+        Take one copy of the book off the shelf.
+
+        The decrement is a single conditional UPDATE, so concurrent
+        borrowers can never drive the inventory below zero.
+        Returns False when there is no copy left.
+        """
+        reserved = self.filter(pk=book_id, inventory__gt=0).update(
+            inventory=F("inventory") - 1
+        )
+        if reserved:
+            invalidate_catalogue()
+        return bool(reserved)
+
+    def reserve_copies(self, book_ids) -> int:
+        """
+        Take one copy of each of the books off the shelf in one UPDATE.
+
+        Returns the number of books a copy was reserved of; when it is
+        less than len(book_ids) the caller is expected to roll back.
+        """
+        reserved = self.filter(pk__in=book_ids, inventory__gt=0).update(
+            inventory=F("inventory") - 1
+        )
+        if reserved:
+            invalidate_catalogue()
+        return reserved
+
+    def remove_copies(self, book_id, copies: int) -> bool:
+        """
+        Take copies out of the inventory for good, in one conditional
+        UPDATE. Returns False when fewer copies are on the shelf.
+        """
+        removed = self.filter(pk=book_id, inventory__gte=copies).update(
+            inventory=F("inventory") - copies
+        )
+        if removed:
+            invalidate_catalogue()
+        return bool(removed)
+
+    def release_copy(self, book_id, copies: int = 1) -> None:
+        """Put one copy (or `copies` copies) of the book back on the shelf."""
+        self.filter(pk=book_id).update(inventory=F("inventory") + copies)
+        invalidate_catalogue()
 
 
 class Book(models.Model):
@@ -12,5 +63,15 @@ class Book(models.Model):
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=5, decimal_places=2)
 
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        # natural key of the catalogue import
+        constraints = [
+            models.UniqueConstraint(
+                fields=["title", "author"], name="book_title_author_unique"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.title} ({self.inventory} pcs)"
@@ -0,0 +1,112 @@
+"""
+Full-text search over the book catalogue.
+
+On SQLite the titles and authors are indexed by the FTS5 table
+`books_book_fts`, on PostgreSQL by a GIN index over their tsvector (see
+migration 0002). Any other database falls back to case-insensitive
+LIKE filters without ranking.
+"""
+
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, Count, ExpressionWrapper, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "books_book_fts"
+SEARCH_CONFIG = "simple"
+GIN_INDEX_NAME = "books_book_search_idx"
+
+
+def search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    # must stay identical to the expression of the GIN index
+    return SearchVector("title", "author", config=SEARCH_CONFIG)
+
+
+def query_terms(text: str) -> list:
+    """Split the user input into words, dropping any query syntax."""
+    return re.findall(r"\w+", text.lower())
+
+
+def fts_query(terms: list, prefix: bool = False) -> str:
+    query = " ".join(f'"{term}"' for term in terms)
+    return query + "*" if prefix else query
+
+
+def tsquery(terms: list, prefix: bool = False) -> str:
+    words = [f"{term}:*" if prefix else term for term in terms]
+    return " & ".join(words)
+
+
+def matching(queryset, terms: list, prefix: bool = False):
+    """Filter the books matching all the terms, the last one as a prefix if asked."""
+    vendor = connections[queryset.db].vendor
+    if vendor == "sqlite":
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                (fts_query(terms, prefix),),
+            )
+        )
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery
+
+        query = SearchQuery(
+            tsquery(terms, prefix), config=SEARCH_CONFIG, search_type="raw"
+        )
+        return queryset.annotate(search=search_vector()).filter(search=query)
+
+    for term in terms:
+        queryset = queryset.filter(Q(title__icontains=term) | Q(author__icontains=term))
+    return queryset
+
+
+def ranked(queryset, terms: list, prefix: bool = False, limit: int = 20) -> list:
+    """Return the best `limit` books matching the terms, most relevant first."""
+    # the database the router picked for the queryset, the replica for reads
+    database = queryset.db
+    vendor = connections[database].vendor
+    if vendor == "sqlite":
+        with connections[database].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                "ORDER BY rank LIMIT %s",
+                (fts_query(terms, prefix), limit),
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        books = queryset.using(database).in_bulk(ids)
+        return [books[book_id] for book_id in ids if book_id in books]
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        query = SearchQuery(
+            tsquery(terms, prefix), config=SEARCH_CONFIG, search_type="raw"
+        )
+        return list(
+            matching(queryset, terms, prefix)
+            .annotate(rank=SearchRank(search_vector(), query))
+            .order_by("-rank", "id")[:limit]
+        )
+    return list(matching(queryset, terms, prefix).order_by("title", "id")[:limit])
+
+
+def facet_counts(queryset) -> dict:
+    """Count the books by cover and by availability with one GROUP BY."""
+    rows = (
+        queryset.order_by()
+        .annotate(
+            available=ExpressionWrapper(Q(inventory__gt=0), output_field=BooleanField())
+        )
+        .values("cover", "available")
+        .annotate(count=Count("id"))
+    )
+    facets = {"total": 0, "cover": {}, "available": {"true": 0, "false": 0}}
+    for row in rows:
+        facets["total"] += row["count"]
+        facets["cover"][row["cover"]] = (
+            facets["cover"].get(row["cover"], 0) + row["count"]
+        )
+        facets["available"]["true" if row["available"] else "false"] += row["count"]
+    return facets
@@ -1,6 +1,9 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 
 from books.models import Book
+from library_service.values_serializers import Column, ValuesSerializer, decimal_string
 
 
 class BookSerializer(serializers.ModelSerializer):
@@ -14,3 +17,72 @@ class BookSerializer(serializers.ModelSerializer):
             "inventory",
             "daily_fee",
         )
+
+
+class BookValuesSerializer(ValuesSerializer):
+    """BookSerializer over values() rows."""
+
+    fields = {
+        "id": Column("id"),
+        "title": Column("title"),
+        "author": Column("author"),
+        "cover": Column("cover"),
+        "inventory": Column("inventory"),
+        "daily_fee": Column("daily_fee", decimal_string(2)),
+    }
+
+
+class BookAutocompleteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Book
+        fields = (
+            "id",
+            "title",
+            "author",
+        )
+
+
+class BookAvailabilitySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    inventory = serializers.IntegerField()
+    available = serializers.BooleanField()
+    waiting_holds = serializers.IntegerField()
+    open_borrowings = serializers.IntegerField()
+    next_return_date = serializers.DateField(allow_null=True)
+    projected_free_date = serializers.DateField(
+        allow_null=True,
+        help_text="When a hold placed now would get a copy, if the copies out "
+        "come back on their expected return dates.",
+    )
+
+
+class BookImportSerializer(serializers.Serializer):
+    """
+    One catalogue row of an import file.
+
+    A plain Serializer: ModelSerializer would add a query per row for the
+    title/author unique constraint, which the import resolves by upserting.
+    """
+
+    title = serializers.CharField(max_length=150)
+    author = serializers.CharField(max_length=100)
+    cover = serializers.ChoiceField(choices=Book.COVER_CHOICES)
+    inventory = serializers.IntegerField(min_value=0)
+    daily_fee = serializers.DecimalField(
+        max_digits=5, decimal_places=2, min_value=Decimal(0)
+    )
+
+
+class BookImportFileSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    file_format = serializers.ChoiceField(choices=["csv", "json"], required=False)
+
+    def validate(self, attrs):
+        if "file_format" not in attrs:
+            extension = attrs["file"].name.rsplit(".", 1)[-1].lower()
+            if extension not in ("csv", "json", "ndjson"):
+                raise serializers.ValidationError(
+                    {"file_format": "Cannot guess the format from the file name."}
+                )
+            attrs["file_format"] = "csv" if extension == "csv" else "json"
+        return attrs
@@ -1,10 +1,21 @@
+import io
+import tempfile
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TestCase
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from books.importer import import_books
 from books.models import Book
+from books.views import BookViewSet
+from borrowing.models import Hold
+from library_service.pagination import LibraryCursorPagination
 
 BOOK_URL = reverse("books:book-list")
 
@@ -104,3 +115,339 @@ class AdminBookApiTest(TestCase):
         }
         response = self.client.patch(url, payload)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_keeps_copies_borrowed_meanwhile(self):
+        url = f"{BOOK_URL}{self.book.id}/"
+        get_object = BookViewSet.get_object
+
+        def get_object_then_borrow(view):
+            # a copy is borrowed after the book was read for the update
+            book = get_object(view)
+            Book.objects.reserve_copy(book.pk)
+            return book
+
+        with mock.patch.object(BookViewSet, "get_object", get_object_then_borrow):
+            response = self.client.patch(url, {"title": "Renamed"})
+            self.assertEqual(response.data["inventory"], 1)
+            # read 1, one borrowed meanwhile, two added
+            response = self.client.patch(url, {"inventory": 3})
+            self.assertEqual(response.data["inventory"], 2)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.title, self.book.inventory), ("Renamed", 2))
+        response = self.client.patch(url, {"inventory": 0})
+        self.assertEqual(response.data["inventory"], 0)
+
+
+class BookPaginationApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.books = [
+            Book.objects.create(
+                title=f"Book {i}",
+                author="Test Author",
+                inventory=1,
+                daily_fee=1.00,
+            )
+            for i in range(5)
+        ]
+
+    def test_list_is_cursor_paginated(self):
+        response = self.client.get(BOOK_URL, {"page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        self.assertIsNone(response.data["previous"])
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]],
+            [book.id for book in self.books[:2]],
+        )
+
+        seen = []
+        url = BOOK_URL + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            seen += [book["id"] for book in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, [book.id for book in self.books])
+
+    @mock.patch.object(LibraryCursorPagination, "max_page_size", 3)
+    def test_page_size_is_capped(self):
+        response = self.client.get(BOOK_URL, {"page_size": 1000})
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_count_is_opt_in(self):
+        response = self.client.get(BOOK_URL, {"with_count": "true", "page_size": 2})
+        self.assertEqual(response.data["count"], len(self.books))
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class BookCacheApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(
+            get_user_model().objects.create_user(
+                "admin@admin.com", "testpass", is_staff=True
+            )
+        )
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=2,
+            daily_fee=1.00,
+        )
+        self.detail_url = f"{BOOK_URL}{self.book.id}/"
+
+    def test_list_and_detail_are_served_from_cache(self):
+        for url in (BOOK_URL, self.detail_url):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(response.content)
+
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_and_delete_invalidate_cache(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        self.client.get(BOOK_URL)
+
+        self.admin_client.patch(self.detail_url, {"title": "New title"})
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["title"], "New title")
+        self.assertEqual(
+            self.client.get(BOOK_URL).data["results"][0]["title"], "New title"
+        )
+
+        self.admin_client.delete(self.detail_url)
+        self.assertEqual(self.client.get(BOOK_URL).data["results"], [])
+
+    def test_inventory_changes_invalidate_cache(self):
+        self.client.get(self.detail_url)
+        Book.objects.reserve_copy(self.book.id)
+        self.assertEqual(self.client.get(self.detail_url).data["inventory"], 1)
+        Book.objects.release_copy(self.book.id)
+        self.assertEqual(self.client.get(self.detail_url).data["inventory"], 2)
+
+
+class BookSearchApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.war = Book.objects.create(
+            title="War and Peace",
+            author="Leo Tolstoy",
+            cover="HARD",
+            inventory=1,
+            daily_fee=1.00,
+        )
+        self.peace = Book.objects.create(
+            title="Peace Talks",
+            author="Jim Butcher",
+            cover="SOFT",
+            inventory=0,
+            daily_fee=1.00,
+        )
+        Book.objects.create(
+            title="Anna Karenina",
+            author="Leo Tolstoy",
+            cover="SOFT",
+            inventory=3,
+            daily_fee=1.00,
+        )
+
+    def test_search_is_ranked_and_faceted(self):
+        response = self.client.get(BOOK_URL + "search/", {"q": "peace"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {book["id"] for book in response.data["results"]},
+            {self.war.id, self.peace.id},
+        )
+        self.assertEqual(
+            response.data["facets"],
+            {
+                "total": 2,
+                "cover": {"HARD": 1, "SOFT": 1},
+                "available": {"true": 1, "false": 1},
+            },
+        )
+
+        response = self.client.get(BOOK_URL + "search/", {"q": "leo war"})
+        self.assertEqual(
+            [book["id"] for book in response.data["results"]], [self.war.id]
+        )
+
+    def test_autocomplete_matches_prefixes(self):
+        response = self.client.get(BOOK_URL + "autocomplete/", {"q": "tols"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(set(response.data[0]), {"id", "title", "author"})
+
+    def test_index_follows_title_changes(self):
+        self.peace.title = "Calm Talks"
+        self.peace.save()
+        self.war.delete()
+
+        response = self.client.get(BOOK_URL + "search/", {"q": "peace"})
+        self.assertEqual(response.data["results"], [])
+        response = self.client.get(BOOK_URL + "search/", {"q": "calm"})
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_search_requires_query(self):
+        response = self.client.get(BOOK_URL + "search/", {"q": "  *"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncBookApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            cover="SOFT",
+            inventory=2,
+            daily_fee=1.50,
+        )
+
+    async def test_async_reads_match_the_sync_endpoints(self):
+        for path in ("", f"{self.book.id}/"):
+            response = await self.async_client.get(BOOK_URL + "async/" + path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            expected = await self.async_client.get(BOOK_URL + path)
+            self.assertEqual(response.json(), expected.json())
+
+        response = await self.async_client.get(
+            BOOK_URL + "async/", headers={"If-None-Match": response["ETag"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = (await self.async_client.get(BOOK_URL + "async/"))["ETag"]
+        response = await self.async_client.get(
+            BOOK_URL + "async/", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = await self.async_client.get(BOOK_URL + "async/0/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookImportTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(
+            title="Dune",
+            author="Frank Herbert",
+            cover="HARD",
+            inventory=1,
+            daily_fee=1.00,
+        )
+
+    def test_command_upserts_csv_rows_and_reports_errors(self):
+        content = (
+            "title,author,cover,inventory,daily_fee\n"
+            "Dune,Frank Herbert,SOFT,7,2.50\n"
+            "Emma,Jane Austen,HARD,3,1.00\n"
+            "Broken,Nobody,PAPER,-1,1.00\n"
+            "Emma,Jane Austen,HARD,4,1.00\n"
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as file:
+            file.write(content)
+            file.flush()
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command(
+                "import_books", file.name, batch_size=2, stdout=stdout, stderr=stderr
+            )
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.cover, self.book.inventory), ("SOFT", 7))
+        self.assertEqual(Book.objects.get(title="Emma").inventory, 4)
+        self.assertEqual(Book.objects.count(), 2)
+        self.assertIn(
+            "3 of 4 rows imported, 1 rejected, 0 overridden", stdout.getvalue()
+        )
+        self.assertIn("row 3:", stderr.getvalue())
+
+    def test_duplicates_count_once_and_added_copies_go_to_holds(self):
+        Book.objects.filter(pk=self.book.pk).update(inventory=0)
+        reader = get_user_model().objects.create_user("reader@test.com", "testpass")
+        hold = Hold.objects.create(user=reader, book=self.book)
+        rows = [
+            {
+                "title": "Dune",
+                "author": "Frank Herbert",
+                "cover": "HARD",
+                "inventory": 2,
+                "daily_fee": "1.00",
+            },
+            {
+                "title": "Dune",
+                "author": "Frank Herbert",
+                "cover": "HARD",
+                "inventory": 3,
+                "daily_fee": "1.00",
+            },
+        ]
+
+        report = import_books(rows)
+
+        self.assertEqual((report["imported"], report["duplicates"]), (1, 1))
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, Hold.READY)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 2)
+
+    def test_api_imports_json_for_admins_only(self):
+        upload = SimpleUploadedFile(
+            "books.json",
+            b'[{"title": "Emma", "author": "Jane Austen", "cover": "SOFT",'
+            b' "inventory": 2, "daily_fee": "1.20"}]',
+        )
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user("reader@test.com", "testpass")
+        )
+        response = client.post(BOOK_URL + "import/", {"file": upload})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        upload.seek(0)
+        client.force_authenticate(
+            get_user_model().objects.create_user(
+                "admin@admin.com", "testpass", is_staff=True
+            )
+        )
+        response = client.post(BOOK_URL + "import/", {"file": upload})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["imported"], 1)
+        self.assertTrue(Book.objects.filter(title="Emma", inventory=2).exists())
+
+    def test_api_reports_where_an_unparsable_file_stopped(self):
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user(
+                "admin@admin.com", "testpass", is_staff=True
+            )
+        )
+        upload = SimpleUploadedFile(
+            "books.json",
+            b'{"title": "Emma", "author": "Jane Austen", "cover": "SOFT",'
+            b' "inventory": 2, "daily_fee": "1.20"}\n'
+            b'{"title": "Persuasion", "author": "Jane Austen", "cover": "SOFT",'
+            b' "inventory": 1, "daily_fee": "1.20"}\n'
+            b'{"title": "Broken",\n',
+        )
+        response = client.post(BOOK_URL + "import/", {"file": upload})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(response.data["stopped_at"]["row"], 3)
+        self.assertIn("Cannot parse the file", response.data["stopped_at"]["error"])
+        self.assertTrue(Book.objects.filter(title="Persuasion").exists())
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
+from books.async_views import BookAsyncDetailView, BookAsyncListView
 from books.views import BookViewSet
 
 router = routers.DefaultRouter()
@@ -11,5 +12,7 @@ router.register("", BookViewSet)
 app_name = "books"
 
 urlpatterns = [
+    path("async/", BookAsyncListView.as_view(), name="book-async-list"),
+    path("async/<int:pk>/", BookAsyncDetailView.as_view(), name="book-async-detail"),
     path("", include(router.urls)),
 ]
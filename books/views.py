@@ -1,11 +1,161 @@
-from rest_framework import viewsets
+import io
 
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from django.db import transaction
+from django.http import Http404
+from rest_framework import viewsets, serializers, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from books.cache import CatalogueCacheMixin
+from books.importer import ROW_READERS, import_books
 from books.models import Book
 from books.permissions import IsAdminOrIfOthersReadOnly
-from books.serializers import BookSerializer
+from books.search import query_terms, matching, ranked, facet_counts
+from books.serializers import (
+    BookSerializer,
+    BookAutocompleteSerializer,
+    BookAvailabilitySerializer,
+    BookImportFileSerializer,
+)
+from borrowing.holds import book_availability, hand_over_copies
+from library_service.db_router import ReplicaReadMixin
+
+SEARCH_LIMIT = 20
+AUTOCOMPLETE_LIMIT = 10
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ReplicaReadMixin, CatalogueCacheMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = (IsAdminOrIfOthersReadOnly,)
+
+    def get_serializer_class(self):
+        if self.action == "autocomplete":
+            return BookAutocompleteSerializer
+        if self.action == "availability":
+            return BookAvailabilitySerializer
+        if self.action == "import_catalogue":
+            return BookImportFileSerializer
+        return BookSerializer
+
+    def perform_update(self, serializer):
+        """
+        Save the edited fields only, and apply a change of the inventory
+        as a delta from the value the admin saw: copies borrowed or
+        returned meanwhile are not overwritten. Added copies go to the
+        waiting holds of the book first, like copies coming back.
+        """
+        book = serializer.instance
+        data = dict(serializer.validated_data)
+        added = data.pop("inventory", book.inventory) - book.inventory
+        with transaction.atomic():
+            for field, value in data.items():
+                setattr(book, field, value)
+            if data:
+                book.save(update_fields=list(data))
+            if added > 0:
+                hand_over_copies(book.pk, added)
+            elif added < 0 and not Book.objects.remove_copies(book.pk, -added):
+                raise serializers.ValidationError(
+                    {"inventory": "Fewer copies are on the shelf now, reload the book."}
+                )
+        book.refresh_from_db(fields=["inventory"])
+
+    def get_search_terms(self, request):
+        terms = query_terms(request.query_params.get("q", ""))
+        if not terms:
+            raise serializers.ValidationError({"q": "This parameter is required."})
+        return terms
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                type={"type": "str"},
+                description="Words to look for in the title and author (ex. /?q=war peace)",
+            ),
+        ]
+    )
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        """
+        Ranked full-text search over titles and authors, with the number
+        of matching books by cover and by availability.
+        """
+        return self.cached_response(request, self.search_response)
+
+    def search_response(self, request):
+        terms = self.get_search_terms(request)
+        books = ranked(self.queryset, terms, limit=SEARCH_LIMIT)
+        return Response(
+            {
+                "facets": facet_counts(matching(self.queryset, terms)),
+                "results": self.get_serializer(books, many=True).data,
+            }
+        )
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "q",
+                type={"type": "str"},
+                description="Beginning of the title or author (ex. /?q=tol)",
+            ),
+        ]
+    )
+    @action(detail=False, methods=["get"])
+    def autocomplete(self, request):
+        """Suggest books whose title or author starts with the typed words."""
+        return self.cached_response(request, self.autocomplete_response)
+
+    def autocomplete_response(self, request):
+        terms = self.get_search_terms(request)
+        books = ranked(self.queryset, terms, prefix=True, limit=AUTOCOMPLETE_LIMIT)
+        return Response(self.get_serializer(books, many=True).data)
+
+    @action(detail=True, methods=["get"])
+    def availability(self, request, pk=None):
+        """
+        The copies on the shelf, the hold queue and the date a copy is
+        projected to be free for a new hold, from the expected return
+        dates of the open borrowings.
+        """
+        availability = book_availability(pk)
+        if availability is None:
+            raise Http404
+        return Response(self.get_serializer(availability).data)
+
+    @action(
+        detail=False,
+        methods=["post"],
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+        url_path="import",
+    )
+    def import_catalogue(self, request):
+        """
+        Upsert books from an uploaded CSV or JSON file, matching existing
+        books by title and author. Returns the numbers of imported and
+        rejected rows with the errors of the first rejected ones. A file
+        that cannot be parsed to its end is a 400 with the same report and
+        `stopped_at`: the row where the import stopped, the rows before it
+        being imported.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data["file"]
+        file_format = serializer.validated_data["file_format"]
+
+        # large uploads are spooled to a temporary file by Django,
+        # which is read back as a stream of rows
+        stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+        try:
+            report = import_books(ROW_READERS[file_format](stream))
+        finally:
+            stream.detach()
+        if "stopped_at" in report:
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.shortcuts import aget_object_or_404
+from rest_framework import serializers, status
+
+from books.models import Book
+from borrowing.models import Borrowing
+from borrowing.permissions import IsAdminOrIfAuthenticatedReadOnly
+from borrowing.serializers import BorrowingCreateSerializer
+from borrowing.services import (
+    ALREADY_BORROWED,
+    borrow_book,
+    new_borrowing_message,
+    return_borrowing,
+)
+from borrowing.tasks import anotify_admin
+from library_service.async_views import AsyncAPIView
+from payments.stripe_helper import (
+    attach_stripe_payment_session_async,
+    payment_urls,
+    record_pending_payment,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BorrowingAsyncCreateSerializer(serializers.Serializer):
+    """
+    The input of BorrowingCreateSerializer with plain ids: the user and
+    the book are then loaded with the async ORM.
+    """
+
+    user = serializers.IntegerField()
+    book = serializers.IntegerField()
+    expected_return_date = serializers.DateField()
+
+
+async def aget_or_invalid(model, field: str, pk):
+    try:
+        return await model.objects.aget(pk=pk)
+    except model.DoesNotExist:
+        message = serializers.PrimaryKeyRelatedField.default_error_messages[
+            "does_not_exist"
+        ]
+        raise serializers.ValidationError({field: [message.format(pk_value=pk)]})
+
+
+class BorrowingAsyncCreateView(AsyncAPIView):
+    """
+    Async twin of POST /api/borrowings/.
+
+    The database work runs in one transaction as in the sync view; once
+    it has committed the Stripe checkout session is created while the
+    admin message is queued, so a slow Stripe only keeps a coroutine
+    waiting, not a worker thread. Neither can fail the request any more
+    by then.
+    """
+
+    permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+
+    async def post(self, request):
+        serializer = BorrowingAsyncCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        user = await aget_or_invalid(get_user_model(), "user", validated_data["user"])
+        book = await aget_or_invalid(Book, "book", validated_data["book"])
+
+        if await Borrowing.objects.filter(
+            user=user, book=book, actual_return_date__isnull=True
+        ).aexists():
+            raise serializers.ValidationError(ALREADY_BORROWED)
+
+        borrowing, payment = await sync_to_async(self.borrow)(
+            user, book, validated_data["expected_return_date"]
+        )
+        # the borrowing is committed: a failed side effect is logged, the
+        # payment is left without a session, as after a Stripe error
+        results = await asyncio.gather(
+            attach_stripe_payment_session_async([payment.id], *payment_urls(request)),
+            anotify_admin(new_borrowing_message(borrowing)),
+            return_exceptions=True,
+        )
+        for error in results:
+            if isinstance(error, Exception):
+                logger.error(
+                    "Borrowing %s created, but a follow-up failed",
+                    borrowing.id,
+                    exc_info=error,
+                )
+        return self.response(
+            BorrowingCreateSerializer(borrowing).data, status.HTTP_201_CREATED
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def borrow(user, book, expected_return_date):
+        borrowing = borrow_book(user, book, expected_return_date)
+        return borrowing, record_pending_payment(borrowing, "PAYMENT")
+
+
+class BorrowingAsyncReturnView(AsyncAPIView):
+    """Async twin of POST /api/borrowings/<id>/return/."""
+
+    permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+
+    async def post(self, request, pk):
+        borrowing = await aget_object_or_404(
+            Borrowing.objects.select_related("book"), pk=pk
+        )
+        if borrowing.actual_return_date is not None:
+            raise serializers.ValidationError(
+                f"This book already has returned at {borrowing.actual_return_date}."
+            )
+        fine = await sync_to_async(self.return_book)(borrowing)
+        if fine is not None:
+            await attach_stripe_payment_session_async([fine.id], *payment_urls(request))
+        return self.response()
+
+    @staticmethod
+    @transaction.atomic
+    def return_book(borrowing):
+        return_borrowing(borrowing)
+        if borrowing.actual_return_date > borrowing.expected_return_date:
+            return record_pending_payment(borrowing, "FINE", settings.FINE_MULTIPLIER)
+        return None
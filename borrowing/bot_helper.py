@@ -1,13 +1,80 @@
+import asyncio
+import atexit
 import os
+
 from dotenv import load_dotenv
 from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from library_service.metrics import external_call
 
 load_dotenv()
 
 TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("CHAT_ID")
+CONNECTION_POOL_SIZE = int(os.getenv("BOT_CONNECTION_POOL_SIZE", 8))
+# Telegram allows about 20 messages per minute into one group chat
+RATE_LIMIT = os.getenv("BOT_RATE_LIMIT", "20/m")
+
+_loop = None
+_bot = None
+
+
+def get_bot() -> Bot:
+    """
+    Return the bot of this process.
+
+    Every message is sent through `run_async`, so the bot (and its pool of
+    HTTP connections) is bound to that one long-lived event loop, reused
+    by every following message and shut down with the loop at exit.
+    """
+    global _bot
+    if _bot is None:
+        _bot = Bot(
+            token=TOKEN,
+            request=HTTPXRequest(connection_pool_size=CONNECTION_POOL_SIZE),
+        )
+    return _bot
 
 
 async def send_message(chat_id, text):
-    bot = Bot(token=TOKEN)
-    await bot.send_message(chat_id=chat_id, text=text)
+    with external_call("telegram"):
+        await get_bot().send_message(chat_id=chat_id, text=text)
+
+
+async def send_messages(chat_id, texts, max_parallel: int):
+    """
+    Send the texts concurrently, with at most `max_parallel` requests
+    in flight. A rate limited message is sent again after the delay
+    Telegram asks for.
+    """
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def send(text):
+        async with semaphore:
+            while True:
+                try:
+                    return await send_message(chat_id, text)
+                except RetryAfter as exc:
+                    await asyncio.sleep(int(exc.retry_after))
+
+    await asyncio.gather(*(send(text) for text in texts))
+
+
+def run_async(coroutine):
+    """Run a coroutine on the long-lived event loop of this process."""
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        atexit.register(close_loop)
+    return _loop.run_until_complete(coroutine)
+
+
+def close_loop():
+    global _bot, _loop
+    if _bot is not None:
+        _loop.run_until_complete(_bot.shutdown())
+        _bot = None
+    _loop.close()
+    _loop = None
@@ -0,0 +1,169 @@
+"""
+The hold queue of the books with no copy on the shelf.
+
+Instead of polling the borrow endpoint until a copy is back, a reader
+places a hold. `return_borrowing` hands the returned copy to the oldest
+waiting hold in the same transaction (`Hold.objects.hand_over_copy`)
+and the admin is told that it is ready to be picked up. A READY hold
+that is not borrowed within HOLD_PICKUP_DAYS expires, and its copy
+moves on to the next hold.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from books.models import Book
+from borrowing.models import Borrowing, Hold
+from borrowing.tasks import notify_admin
+
+
+def count_of(queryset):
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values("book_id")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def book_availability(book_id) -> dict | None:
+    """
+    The inventory, the queue and the projected free date of the book,
+    read with one query.
+
+    The projected free date is when a hold placed now would get a copy,
+    if the open borrowings come back on their expected return dates:
+    the return of rank (waiting holds + 1). It is None when the queue
+    is longer than the copies out.
+    """
+    open_borrowings = Borrowing.objects.filter(
+        book_id=OuterRef("pk"), actual_return_date__isnull=True
+    )
+    returns_in_order = (
+        Borrowing.objects.filter(
+            book_id=OuterRef("pk"), actual_return_date__isnull=True
+        )
+        .annotate(
+            rank=Window(
+                RowNumber(),
+                order_by=[F("expected_return_date").asc(), F("id").asc()],
+            ),
+            queue=count_of(
+                Hold.objects.filter(book_id=OuterRef("book_id"), status=Hold.WAITING)
+            ),
+        )
+        .filter(rank=F("queue") + 1)
+        .values("expected_return_date")
+    )
+    availability = (
+        Book.objects.filter(pk=book_id)
+        .values("id", "inventory")
+        .annotate(
+            waiting_holds=count_of(
+                Hold.objects.filter(book_id=OuterRef("pk"), status=Hold.WAITING)
+            ),
+            open_borrowings=count_of(open_borrowings),
+            next_return_date=Subquery(
+                open_borrowings.order_by("expected_return_date").values(
+                    "expected_return_date"
+                )[:1]
+            ),
+            projected_free_date=Subquery(returns_in_order[:1]),
+        )
+        .first()
+    )
+    if availability is None:
+        return None
+
+    today = date.today()
+    availability["available"] = (
+        availability["inventory"] > 0 and not availability["waiting_holds"]
+    )
+    if availability["available"]:
+        availability["projected_free_date"] = today
+    elif availability["projected_free_date"] is not None:
+        # overdue copies are expected back any day now
+        availability["projected_free_date"] = max(
+            availability["projected_free_date"], today
+        )
+    return availability
+
+
+def hold_ready_message(hold) -> str:
+    pick_up_by = (hold.ready_at + timedelta(days=settings.HOLD_PICKUP_DAYS)).strftime(
+        "%d-%m-%Y"
+    )
+    return (
+        f"{hold.ready_at.strftime('%d-%m-%Y  %H:%M')} HOLD ready \n"
+        "----------------------------------------\n"
+        f"BOOK: ** {hold.book.title} **  \n"
+        f"is kept for {hold.user.email}\n"
+        f"until {pick_up_by}.\n"
+    )
+
+
+def hand_over_copy(book_id) -> Hold | None:
+    """
+    `Hold.objects.hand_over_copy` announcing the hold that got the copy.
+    Must run inside the transaction that freed the copy.
+    """
+    hold = Hold.objects.hand_over_copy(book_id)
+    if hold is not None:
+        notify_admin(hold_ready_message(hold))
+    return hold
+
+
+def hand_over_copies(book_id, copies: int) -> None:
+    """
+    `hand_over_copy` for each of the copies added to the inventory of
+    the book, the ones nobody waits for going back on the shelf in one
+    UPDATE. Must run inside a transaction.
+    """
+    for placed in range(copies):
+        if not Hold.objects.filter(book_id=book_id, status=Hold.WAITING).exists():
+            Book.objects.release_copy(book_id, copies - placed)
+            return
+        hand_over_copy(book_id)
+
+
+def cancel_hold(hold) -> bool:
+    """
+    Cancel an active hold, passing its copy on if one was kept for it.
+    Returns False when the hold is no longer active.
+    """
+    with transaction.atomic():
+        if Hold.objects.filter(pk=hold.pk, status=Hold.READY).update(
+            status=Hold.CANCELLED
+        ):
+            hand_over_copy(hold.book_id)
+            return True
+        return bool(
+            Hold.objects.filter(pk=hold.pk, status=Hold.WAITING).update(
+                status=Hold.CANCELLED
+            )
+        )
+
+
+def expire_holds(now=None) -> int:
+    """Expire the READY holds not picked up in time; returns their number."""
+    now = now or timezone.now()
+    deadline = now - timedelta(days=settings.HOLD_PICKUP_DAYS)
+    expired = 0
+    for hold in Hold.objects.filter(status=Hold.READY, ready_at__lt=deadline).only(
+        "id", "book_id"
+    ):
+        with transaction.atomic():
+            if Hold.objects.filter(pk=hold.pk, status=Hold.READY).update(
+                status=Hold.EXPIRED
+            ):
+                hand_over_copy(hold.book_id)
+                expired += 1
+    return expired
@@ -0,0 +1,113 @@
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from benchmarks.seed import seed
+from borrowing.models import Borrowing
+from payments.models import Payment
+
+
+class Command(BaseCommand):
+    """
+    Django command to compare the query plans and timings of the hot
+    borrowing and payment filters without and with their indexes.
+
+    The indexes declared on Borrowing and Payment are dropped for the first
+    run and created again for the second, with ANALYZE before each. Both
+    the seeded rows and the index changes are rolled back at the end.
+    """
+
+    help = "Benchmark the borrowing and payment indexes on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--books", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.repeat = options["repeat"]
+        with transaction.atomic():
+            self.data = seed(
+                users=options["users"],
+                books=options["books"],
+                borrowings=options["rows"],
+                log=self.stdout.write,
+            )
+            queries = self.hot_queries()
+
+            self.drop_indexes()
+            self.analyze()
+            self.stdout.write(self.style.MIGRATE_HEADING("Without indexes"))
+            before = self.run_queries(queries)
+
+            self.create_indexes()
+            self.analyze()
+            self.stdout.write(self.style.MIGRATE_HEADING("With indexes"))
+            after = self.run_queries(queries)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Summary (median ms)"))
+        for name in queries:
+            self.stdout.write(
+                f"{name:<24} {before[name]:>10.3f} -> {after[name]:>10.3f}"
+                f"  (x{before[name] / max(after[name], 1e-6):.1f})"
+            )
+
+    def hot_queries(self):
+        user_id = self.data.random_user_id()
+        book_id = self.data.random_book_id()
+        open_borrowings = Borrowing.objects.filter(actual_return_date__isnull=True)
+        return {
+            "duplicate borrow check": open_borrowings.filter(
+                user_id=user_id, book_id=book_id
+            ),
+            "overdue digest": open_borrowings.filter(
+                expected_return_date__lt=date.today()
+            )
+            .order_by("expected_return_date", "id")
+            .values_list("id", "expected_return_date")[:1000],
+            "active list page": open_borrowings.order_by("id")[:20],
+        }
+
+    def run_queries(self, queries):
+        timings = {}
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.SUCCESS(name))
+            self.stdout.write(queryset.explain())
+            durations = []
+            for _ in range(self.repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                durations.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(durations)
+            self.stdout.write(f"median: {timings[name]:.3f} ms\n")
+        return timings
+
+    def index_statements(self, action):
+        # plain SQL rather than schema_editor.add_index()/remove_index(),
+        # which cannot be entered inside a transaction on SQLite
+        schema_editor = connection.schema_editor()
+        schema_editor.deferred_sql = []
+        for index in Borrowing._meta.indexes:
+            yield getattr(index, action)(Borrowing, schema_editor)
+        for index in Payment._meta.indexes:
+            yield getattr(index, action)(Payment, schema_editor)
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for statement in self.index_statements("remove_sql"):
+                cursor.execute(str(statement))
+
+    def create_indexes(self):
+        with connection.cursor() as cursor:
+            for statement in self.index_statements("create_sql"):
+                cursor.execute(str(statement))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
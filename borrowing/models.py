@@ -3,6 +3,7 @@ from datetime import datetime
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 from books.models import Book
 
@@ -16,6 +17,36 @@ class Borrowing(models.Model):
         get_user_model(), on_delete=models.CASCADE, related_name="borrowings"
     )
 
+    class Meta:
+        indexes = [
+            # "already borrowed this book" check on create
+            models.Index(
+                fields=["user", "book"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_open_user_book_idx",
+            ),
+            # daily overdue digest
+            models.Index(
+                fields=["expected_return_date"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_open_due_idx",
+            ),
+            # ?is_active=true list, paginated by id
+            models.Index(
+                fields=["id"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_open_idx",
+            ),
+            # admin stats: borrowings per day
+            models.Index(fields=["borrow_date"], name="borrowing_borrow_date_idx"),
+            # admin stats: copies out per book
+            models.Index(
+                fields=["book"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_open_book_idx",
+            ),
+        ]
+
     def clean(self):
         if self.borrow_date is None:
             self.borrow_date = datetime.today().date()
@@ -29,3 +60,113 @@ class Borrowing(models.Model):
 
     def __str__(self):
         return f"{self.user.email} borrowing {self.book}"
+
+
+class HoldQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(status__in=(Hold.WAITING, Hold.READY))
+
+    def with_queue_position(self):
+        """Annotate the place of WAITING holds in their book's queue (1 = next)."""
+        ahead = (
+            Hold.objects.filter(
+                book_id=models.OuterRef("book_id"),
+                status=Hold.WAITING,
+                id__lte=models.OuterRef("id"),
+            )
+            .order_by()
+            .values("book_id")
+            .annotate(position=models.Count("id"))
+            .values("position")
+        )
+        return self.annotate(
+            queue_position=models.Case(
+                models.When(status=Hold.WAITING, then=models.Subquery(ahead)),
+                default=None,
+            )
+        )
+
+    def hand_over_copy(self, book_id):
+        """
+        Give a copy of the book that came back to the oldest waiting hold,
+        or put it back on the shelf when nobody is waiting.
+
+        The hold is taken with a conditional UPDATE, so two copies coming
+        back at the same time never go to the same hold.
+        Returns the hold now READY, or None.
+        """
+        while True:
+            hold = (
+                self.select_related("book", "user")
+                .filter(book_id=book_id, status=Hold.WAITING)
+                .order_by("id")
+                .first()
+            )
+            if hold is None:
+                Book.objects.release_copy(book_id)
+                return None
+            ready_at = timezone.now()
+            if self.filter(pk=hold.pk, status=Hold.WAITING).update(
+                status=Hold.READY, ready_at=ready_at
+            ):
+                hold.status = Hold.READY
+                hold.ready_at = ready_at
+                return hold
+
+
+class Hold(models.Model):
+    """
+    A place in the queue for a book with no copy on the shelf.
+
+    A copy that comes back goes to the oldest WAITING hold, which becomes
+    READY: the copy is kept aside (it does not count in the inventory)
+    until the holder borrows it, cancels, or the hold expires.
+    """
+
+    WAITING = "WAITING"
+    READY = "READY"
+    FULFILLED = "FULFILLED"
+    CANCELLED = "CANCELLED"
+    EXPIRED = "EXPIRED"
+    STATUS_CHOICES = (
+        (WAITING, "waiting"),
+        (READY, "ready"),
+        (FULFILLED, "fulfilled"),
+        (CANCELLED, "cancelled"),
+        (EXPIRED, "expired"),
+    )
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    user = models.ForeignKey(
+        get_user_model(), on_delete=models.CASCADE, related_name="holds"
+    )
+    status = models.CharField(max_length=9, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(blank=True, null=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "book"],
+                condition=models.Q(status__in=("WAITING", "READY")),
+                name="hold_active_user_book_unique",
+            ),
+        ]
+        indexes = [
+            # the queue of a book, oldest first
+            models.Index(
+                fields=["book", "id"],
+                condition=models.Q(status="WAITING"),
+                name="hold_waiting_queue_idx",
+            ),
+            # holds not picked up in time
+            models.Index(
+                fields=["ready_at"],
+                condition=models.Q(status="READY"),
+                name="hold_ready_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} holds {self.book} ({self.status})"
@@ -1,14 +1,36 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
 from books.models import Book
-from books.serializers import BookSerializer
-from borrowing.models import Borrowing
+from books.serializers import BookSerializer, BookValuesSerializer
+from borrowing.models import Borrowing, Hold
+from library_service.values_serializers import (
+    Column,
+    Nested,
+    Related,
+    ValuesSerializer,
+    decimal_string,
+    iso_date,
+)
+from payments.models import Payment
+from payments.serializers import (
+    PaymentInBorrowingListSerializer,
+    PaymentInBorrowingListValuesSerializer,
+    PaymentInBorrowingRetrieveSerializer,
+)
 
 
 class BorrowingSerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
-    payments = serializers.SerializerMethodField()
+    payments = PaymentInBorrowingListSerializer(many=True, read_only=True)
+    accrued_fine = serializers.DecimalField(
+        source="fine_accrual.amount",
+        max_digits=9,
+        decimal_places=2,
+        read_only=True,
+        allow_null=True,
+    )
 
     class Meta:
         model = Borrowing
@@ -20,19 +42,30 @@ class BorrowingSerializer(serializers.ModelSerializer):
             "book",
             "user",
             "payments",
+            "accrued_fine",
         )
 
-    def get_payments(self, obj) -> list[dict]:
-        from payments.serializers import PaymentInBorrowingListSerializer
-        from payments.models import Payment
 
-        payments = Payment.objects.filter(borrowing=obj)
-        return PaymentInBorrowingListSerializer(payments, many=True).data
+class BorrowingListSerializer(ValuesSerializer):
+    """BorrowingSerializer over values() rows, for the list endpoint."""
+
+    fields = {
+        "id": Column("id"),
+        "borrow_date": Column("borrow_date", iso_date),
+        "expected_return_date": Column("expected_return_date", iso_date),
+        "actual_return_date": Column("actual_return_date", iso_date),
+        "book": Nested(BookValuesSerializer, "book"),
+        "user": Column("user_id"),
+        "payments": Related(
+            PaymentInBorrowingListValuesSerializer, Payment, "borrowing_id"
+        ),
+        "accrued_fine": Column("fine_accrual__amount", decimal_string(2)),
+    }
 
 
 class BorrowingRetrieveSerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
-    payments = serializers.SerializerMethodField()
+    payments = PaymentInBorrowingRetrieveSerializer(many=True, read_only=True)
 
     class Meta:
         model = Borrowing
@@ -46,13 +79,6 @@ class BorrowingRetrieveSerializer(serializers.ModelSerializer):
             "payments",
         )
 
-    def get_payments(self, obj) -> list[dict]:
-        from payments.serializers import PaymentInBorrowingRetrieveSerializer
-        from payments.models import Payment
-
-        payments = Payment.objects.filter(borrowing=obj)
-        return PaymentInBorrowingRetrieveSerializer(payments, many=True).data
-
 
 class BorrowingCreateSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all())
@@ -78,16 +104,46 @@ class BorrowingReturnSerializer(serializers.ModelSerializer):
         )
 
 
-class BorrowingInPaymentRetrieveSerializer(serializers.ModelSerializer):
+class BorrowingBulkCreateSerializer(serializers.Serializer):
+    user = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all())
+    expected_return_date = serializers.DateField()
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_BORROWING_MAX_BOOKS,
+    )
+
+    def validate_books(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Each book can be borrowed only once.")
+        return value
+
+
+class HoldSerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
+    queue_position = serializers.IntegerField(read_only=True, allow_null=True)
 
     class Meta:
-        model = Borrowing
+        model = Hold
         fields = (
             "id",
-            "borrow_date",
-            "expected_return_date",
-            "actual_return_date",
             "book",
             "user",
+            "status",
+            "queue_position",
+            "created_at",
+            "ready_at",
+        )
+
+
+class HoldCreateSerializer(serializers.ModelSerializer):
+    user = serializers.PrimaryKeyRelatedField(queryset=get_user_model().objects.all())
+    book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
+
+    class Meta:
+        model = Hold
+        fields = (
+            "id",
+            "user",
+            "book",
         )
@@ -0,0 +1,86 @@
+"""
+The borrowing and return of a book, shared by the sync and async views
+and the tasks that close borrowings: each runs inside the caller's
+transaction, which also holds the payment.
+"""
+
+from datetime import datetime
+
+from rest_framework import serializers
+
+from books.models import Book
+from borrowing.holds import hand_over_copy
+from borrowing.models import Borrowing, Hold
+from payments.models import FineAccrual
+from user.summary import adjust_summary
+
+ALREADY_BORROWED = (
+    "You already have one copy of this book, you cannot borrow another one."
+)
+
+
+def borrow_book(user, book, expected_return_date) -> Borrowing:
+    """
+    Take a copy of the book off the shelf, or the copy kept for the
+    user's ready hold, and record the borrowing.
+
+    Must run inside a transaction, which also holds the payment of the
+    borrowing. `book.inventory` is refreshed to the copies left.
+    """
+    if not Hold.objects.filter(user=user, book=book, status=Hold.READY).update(
+        status=Hold.FULFILLED
+    ):
+        if not Book.objects.reserve_copy(book.id):
+            raise serializers.ValidationError(
+                "This book is currently unavailable, "
+                "place a hold to get the next copy returned."
+            )
+        Hold.objects.filter(user=user, book=book, status=Hold.WAITING).update(
+            status=Hold.FULFILLED
+        )
+    book.refresh_from_db(fields=["inventory"])
+    borrowing = Borrowing.objects.create(
+        borrow_date=datetime.today().date(),
+        expected_return_date=expected_return_date,
+        book=book,
+        user=user,
+    )
+    adjust_summary(user.id, active_borrowings=1)
+    return borrowing
+
+
+def new_borrowing_message(borrowing) -> str:
+    formatted_date = datetime.today().strftime("%d-%m-%Y  %H:%M")
+    expected_return_date = borrowing.expected_return_date.strftime("%d-%m-%Y")
+    return (
+        f"{formatted_date} NEW borrowing \n"
+        "----------------------------------------\n"
+        f"BOOK: ** {borrowing.book.title} **  \n"
+        f"has been borrowed by {borrowing.user.email}\n"
+        f"expected return date: {expected_return_date}.\n"
+        f"now in stock: ** {borrowing.book.inventory} **\n"
+    )
+
+
+def return_borrowing(borrowing) -> None:
+    """
+    Close the borrowing and put its copy back on the shelf, or aside
+    for the oldest waiting hold of the book.
+
+    Must run inside a transaction; the fine of a late return is left
+    to the caller.
+    """
+    actual_return_date = datetime.today().date()
+    returned = Borrowing.objects.filter(
+        pk=borrowing.pk, actual_return_date__isnull=True
+    ).update(actual_return_date=actual_return_date)
+    if not returned:
+        raise serializers.ValidationError("This book has already been returned.")
+    borrowing.actual_return_date = actual_return_date
+    hand_over_copy(borrowing.book_id)
+    FineAccrual.objects.filter(borrowing=borrowing).delete()
+    adjust_summary(
+        borrowing.user_id,
+        active_borrowings=-1,
+        overdue_borrowings=-int(borrowing.expected_return_date < actual_return_date),
+    )
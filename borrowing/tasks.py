@@ -1,38 +1,168 @@
+import logging
+import time
 from datetime import datetime
+from functools import partial
 
+from asgiref.sync import sync_to_async
 from celery import shared_task
+from django.db import transaction
+from telegram.error import NetworkError, RetryAfter
 
 from borrowing.models import Borrowing
-from borrowing.bot_helper import send_message, ADMIN_CHAT_ID
-import asyncio
+from borrowing.bot_helper import (
+    send_message,
+    send_messages,
+    run_async,
+    ADMIN_CHAT_ID,
+    RATE_LIMIT,
+    TOKEN,
+)
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def daily_checking_borrowings():
-    borrowings = Borrowing.objects.filter(
-        actual_return_date=None, expected_return_date__lt=datetime.now()
+TELEGRAM_MESSAGE_LIMIT = 4096
+DIGEST_CHUNK_SIZE = 2000
+DIGEST_SEND_BATCH = 20
+DIGEST_MAX_PARALLEL = 4
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(NetworkError,),
+    retry_backoff=True,
+    max_retries=5,
+    rate_limit=RATE_LIMIT,
+    ignore_result=True,
+)
+def send_telegram_message(self, chat_id, text):
+    try:
+        run_async(send_message(chat_id, text))
+    except RetryAfter as exc:
+        raise self.retry(exc=exc, countdown=int(exc.retry_after))
+
+
+def notify_admin(text: str) -> None:
+    """
+    Queue a message to the admin chat.
+
+    The message is handed to the Celery worker only once the current
+    transaction commits, so the request never waits on Telegram and
+    rolled back changes are never announced.
+    """
+    if not TOKEN or not ADMIN_CHAT_ID:
+        logger.debug("Telegram bot is not configured, message dropped: %s", text)
+        return
+    transaction.on_commit(
+        partial(send_telegram_message.delay, ADMIN_CHAT_ID, text), robust=True
     )
-    len_ = len(borrowings)
-    if len_ == 0:
-        asyncio.run(
-            send_message(ADMIN_CHAT_ID, "** Hello! No borrowings overdue today! **")
-        )
+
+
+async def anotify_admin(text: str) -> None:
+    """
+    Queue a message to the admin chat from an async view, after its
+    transaction has committed.
+
+    Like `notify_admin` it goes through `send_telegram_message`, so the
+    messages of the async views count in the same BOT_RATE_LIMIT and are
+    retried by the Celery worker.
+    """
+    if not TOKEN or not ADMIN_CHAT_ID:
+        logger.debug("Telegram bot is not configured, message dropped: %s", text)
+        return
+    await sync_to_async(send_telegram_message.delay)(ADMIN_CHAT_ID, text)
+
+
+@shared_task(ignore_result=True)
+def expire_holds():
+    """Pass on the copies of the holds not picked up in time."""
+    # borrowing.holds queues its messages with notify_admin
+    from borrowing.holds import expire_holds as expire
+
+    expired = expire()
+    if expired:
+        logger.info("%s hold(s) expired", expired)
+
+
+def pack_messages(lines, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """Concatenate lines into as few messages as possible of at most `limit` chars."""
+    message = ""
+    for line in lines:
+        line = line[:limit]
+        if message and len(message) + len(line) > limit:
+            yield message
+            message = ""
+        message += line
+    if message:
+        yield message
+
+
+@shared_task(bind=True)
+def daily_checking_borrowings(self):
+    """
+    Send the daily digest of overdue borrowings to the admin chat.
+
+    Overdue borrowings are streamed from one joined query, packed into
+    messages of at most 4096 characters and sent in batches of concurrent
+    requests. Progress is reported through the task state and the timings
+    are returned as the task result.
+    """
+    started = time.monotonic()
+    send_seconds = 0
+    date_today = datetime.today().date()
+    overdue = Borrowing.objects.filter(
+        actual_return_date=None, expected_return_date__lt=date_today
+    )
+    total = overdue.count()
+
+    def send(texts):
+        nonlocal send_seconds
+        send_started = time.monotonic()
+        run_async(send_messages(ADMIN_CHAT_ID, texts, DIGEST_MAX_PARALLEL))
+        send_seconds += time.monotonic() - send_started
+
+    processed = 0
+    messages = 1
+    if total == 0:
+        send(["** Hello! No borrowings overdue today! **"])
     else:
-        asyncio.run(
-            send_message(
-                ADMIN_CHAT_ID,
-                f"** Hello! Here {len_} overdue borrowing(s) today: **",
-            )
+        send([f"** Hello! Here {total} overdue borrowing(s) today: **"])
+
+    def lines():
+        nonlocal processed
+        rows = (
+            overdue.order_by("expected_return_date", "id")
+            .values_list("id", "user__email", "book__title", "expected_return_date")
+            .iterator(chunk_size=DIGEST_CHUNK_SIZE)
         )
-        date_today = datetime.today().date()
-
-        for i, borrowing in enumerate(borrowings):
-            expected_return_date = borrowing.expected_return_date
-            print(borrowing)
-            content = (
-                f"{i + 1}: borrowing_id = {borrowing.id}, user: {borrowing.user} \n"
-                f"BOOK: {borrowing.book.title} \n"
+        for borrowing_id, email, title, expected_return_date in rows:
+            processed += 1
+            yield (
+                f"{processed}: borrowing_id = {borrowing_id}, user: {email} \n"
+                f"BOOK: {title} \n"
                 f"expected return date: {expected_return_date} \n"
                 f" ** {(date_today - expected_return_date).days} ** day(s) overdue\n"
             )
-            asyncio.run(send_message(ADMIN_CHAT_ID, content))
+
+    batch = []
+    for message in pack_messages(lines() if total else ()):
+        batch.append(message)
+        if len(batch) == DIGEST_SEND_BATCH:
+            send(batch)
+            messages += len(batch)
+            batch = []
+            if not self.request.called_directly:
+                self.update_state(
+                    state="PROGRESS", meta={"processed": processed, "total": total}
+                )
+    if batch:
+        send(batch)
+        messages += len(batch)
+
+    metrics = {
+        "overdue": processed,
+        "messages": messages,
+        "send_seconds": round(send_seconds, 3),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("Overdue digest sent: %s", metrics)
+    return metrics
@@ -1,14 +1,35 @@
+import asyncio
+import json
+import threading
+import time
 from datetime import datetime, timedelta
+from unittest import mock
 
+from celery.exceptions import Retry
 from django.contrib.auth import get_user_model
-
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from telegram.error import RetryAfter
 
 from books.models import Book
-from borrowing.models import Borrowing
+from borrowing.holds import expire_holds
+from borrowing.models import Borrowing, Hold
+from borrowing.serializers import BorrowingSerializer
+from borrowing.tasks import (
+    daily_checking_borrowings,
+    notify_admin,
+    pack_messages,
+    send_telegram_message,
+)
+from payments.models import CheckoutSession, FineAccrual, Payment
+from payments.stripe_stub import StubStripe
 
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
@@ -62,8 +83,8 @@ class AuthenticatedBorrowingApiTest(TestCase):
 
         response = self.client.get(BORROWING_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["id"], self.borrowing.id)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["id"], self.borrowing.id)
 
         url = f"{BORROWING_URL}{other_borrowing.id}/"
         response = self.client.get(url)
@@ -76,8 +97,8 @@ class AuthenticatedBorrowingApiTest(TestCase):
     def test_list_borrowing_has_info_about_book(self):
         response = self.client.get(BORROWING_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data[0]["book"]["id"], self.book.id)
-        self.assertEqual(response.data[0]["book"]["title"], self.book.title)
+        self.assertEqual(response.data["results"][0]["book"]["id"], self.book.id)
+        self.assertEqual(response.data["results"][0]["book"]["title"], self.book.title)
 
     def test_create_borrowing_forbidden(self):
         payload = {
@@ -92,6 +113,11 @@ class AuthenticatedBorrowingApiTest(TestCase):
 
 class AdminBorrowingApiTest(TestCase):
     def setUp(self):
+        self.stripe = StubStripe()
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
         self.client = APIClient()
         self.user = get_user_model().objects.create_user(
             "admin@admin.com", "testpass", is_staff=True
@@ -128,14 +154,14 @@ class AdminBorrowingApiTest(TestCase):
         response = self.client.get(BORROWING_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(Borrowing.objects.all()), 2)
-        self.assertEqual(len(Borrowing.objects.all()), len(response.data))
-        self.assertEqual(other_borrowing.id, response.data[1]["id"])
+        self.assertEqual(len(Borrowing.objects.all()), len(response.data["results"]))
+        self.assertEqual(other_borrowing.id, response.data["results"][1]["id"])
 
         url = f"{BORROWING_URL}?user_id={other_user.id}"
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["user"], other_user.id)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["user"], other_user.id)
 
     def test_borrowing_list_filtering_by_is_active(self):
         borrowing2 = Borrowing.objects.create(
@@ -146,20 +172,20 @@ class AdminBorrowingApiTest(TestCase):
         )
         response = self.client.get(BORROWING_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
         url = f"{BORROWING_URL}?is_active=true"
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
         borrowing2.actual_return_date = datetime.today().date() + timedelta(days=1)
         borrowing2.save()
 
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertNotEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]["id"], self.borrowing.id)
+        self.assertNotEqual(len(response.data["results"]), 2)
+        self.assertEqual(response.data["results"][0]["id"], self.borrowing.id)
 
         borrowing2.delete()
 
@@ -188,6 +214,32 @@ class AdminBorrowingApiTest(TestCase):
             else:
                 self.assertEqual(payload[key], getattr(new_borrowing, key))
 
+    def test_create_borrowing_attaches_stripe_session_after_commit(self):
+        payload = {
+            "expected_return_date": datetime.today().date() + timedelta(days=4),
+            "book": self.book.id,
+            "user": self.user.id,
+        }
+        self.borrowing.actual_return_date = datetime.today().date()
+        self.borrowing.save()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(BORROWING_URL, payload)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        payment = Payment.objects.get(borrowing_id=response.data["id"])
+        self.assertEqual(payment.status, "PENDING")
+        self.assertEqual(payment.money_to_pay, 4)
+        self.assertIsNone(payment.checkout_session)
+        self.assertEqual(self.stripe.calls, [])
+
+        for callback in callbacks:
+            callback()
+        payment.refresh_from_db()
+        session = payment.checkout_session
+        self.assertTrue(session.session_id.startswith("cs_test_"))
+        self.assertIn(session.session_id, session.session_url)
+
     def test_delete_borrowing_not_allowed(self):
         borrowing = self.borrowing
         url = BORROWING_URL + f"{borrowing.id}/"
@@ -206,3 +258,792 @@ class AdminBorrowingApiTest(TestCase):
         self.book.refresh_from_db()
         new_inventory_book = self.book.inventory
         self.assertLess(prev_inventory_book, new_inventory_book)
+
+    def test_list_renders_the_same_bytes_as_the_model_serializer(self):
+        returned = Borrowing.objects.create(
+            borrow_date=datetime.today().date() - timedelta(days=10),
+            expected_return_date=datetime.today().date() - timedelta(days=3),
+            actual_return_date=datetime.today().date(),
+            book=self.book,
+            user=self.user,
+        )
+        for borrowing, money_to_pay in ((self.borrowing, 5), (returned, 2.5)):
+            Payment.objects.create(
+                status="PENDING",
+                type_pay="PAYMENT",
+                borrowing=borrowing,
+                checkout_session=CheckoutSession.objects.create(
+                    session_id=f"session_{borrowing.id}",
+                    session_url="https://example.com",
+                ),
+                money_to_pay=money_to_pay,
+            )
+        FineAccrual.objects.create(
+            borrowing=self.borrowing,
+            overdue_days=1,
+            amount=3,
+            updated_at=timezone.now(),
+        )
+
+        response = self.client.get(BORROWING_URL)
+        expected = BorrowingSerializer(Borrowing.objects.order_by("id"), many=True).data
+
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"]),
+            JSONRenderer().render(expected),
+        )
+
+    def test_list_sparse_fieldset(self):
+        response = self.client.get(BORROWING_URL, {"fields": "book,id"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data["results"][0]), ["id", "book"])
+        self.assertEqual(response.data["results"][0]["book"]["daily_fee"], "1.00")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(BORROWING_URL, {"fields": "user,actual_return_date"})
+        self.assertNotIn("books_book", queries[-1]["sql"])
+        self.assertNotIn("payments_payment", queries[-1]["sql"])
+
+        response = self.client.get(BORROWING_URL, {"fields": "id,password"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(BORROWING_URL)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        Payment.objects.create(
+            status="PENDING",
+            type_pay="PAYMENT",
+            borrowing=self.borrowing,
+            checkout_session=CheckoutSession.objects.create(
+                session_id="session_0", session_url="https://example.com"
+            ),
+            money_to_pay=5.00,
+        )
+        queries_for_one_row = list_queries()
+
+        for i in range(1, 10):
+            book = Book.objects.create(
+                title=f"Book {i}",
+                author="Test Author",
+                inventory=1,
+                daily_fee=1.00,
+            )
+            borrowing = Borrowing.objects.create(
+                borrow_date=datetime.today().date(),
+                expected_return_date=datetime.today().date() + timedelta(days=5),
+                book=book,
+                user=self.user,
+            )
+            Payment.objects.create(
+                status="PENDING",
+                type_pay="PAYMENT",
+                borrowing=borrowing,
+                checkout_session=CheckoutSession.objects.create(
+                    session_id=f"session_{i}", session_url="https://example.com"
+                ),
+                money_to_pay=5.00,
+            )
+
+        self.assertEqual(list_queries(), queries_for_one_row)
+
+
+class BulkBorrowingApiTest(TestCase):
+    def setUp(self):
+        self.stripe = StubStripe()
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.user)
+        self.books = [
+            Book.objects.create(
+                title=f"Bulk Book {i}",
+                author="Test Author",
+                inventory=1,
+                daily_fee=i + 1,
+            )
+            for i in range(3)
+        ]
+
+    def checkout(self, book_ids):
+        payload = {
+            "user": self.user.id,
+            "expected_return_date": datetime.today().date() + timedelta(days=2),
+            "books": book_ids,
+        }
+        return self.client.post(BORROWING_URL + "bulk/", payload, format="json")
+
+    def test_bulk_checkout_creates_one_stripe_session(self):
+        book_ids = [book.id for book in self.books]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout(book_ids)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row["book"] for row in response.data], book_ids)
+
+        self.assertFalse(Book.objects.filter(inventory__gt=0).exists())
+        self.assertEqual(len(self.stripe.calls), 1)
+        line_items = self.stripe.calls[0]["kwargs"]["line_items"]
+        self.assertEqual(
+            [item["price_data"]["unit_amount"] for item in line_items],
+            [200, 400, 600],
+        )
+        payments = Payment.objects.filter(borrowing__book_id__in=book_ids)
+        self.assertEqual(payments.count(), 3)
+        self.assertEqual(payments.values("checkout_session").distinct().count(), 1)
+
+    def test_bulk_checkout_splits_a_long_admin_message(self):
+        books = Book.objects.bulk_create(
+            Book(
+                title=f"A rather long title for a bulk checkout book {i:03}",
+                author="Test Author",
+                inventory=1,
+                daily_fee=1,
+            )
+            for i in range(150)
+        )
+        with mock.patch("borrowing.views.notify_admin") as notify:
+            response = self.checkout([book.id for book in books])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        messages = [call.args[0] for call in notify.call_args_list]
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(message) <= 4096 for message in messages))
+        self.assertIn("150 BOOK(S)", messages[0])
+        self.assertIn(books[-1].title, messages[-1])
+
+    def test_bulk_checkout_is_all_or_nothing(self):
+        self.books[1].inventory = 0
+        self.books[1].save()
+
+        response = self.checkout([book.id for book in self.books])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.books[1].id), str(response.data["books"]))
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertEqual(Book.objects.filter(inventory=1).count(), 2)
+        self.assertEqual(self.stripe.calls, [])
+
+    def test_bulk_checkout_rejects_duplicate_and_borrowed_books(self):
+        response = self.checkout([self.books[0].id, self.books[0].id])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        Borrowing.objects.create(
+            borrow_date=datetime.today().date(),
+            expected_return_date=datetime.today().date() + timedelta(days=5),
+            book=self.books[2],
+            user=self.user,
+        )
+        response = self.checkout([self.books[0].id, self.books[2].id])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+
+class HoldApiTest(TestCase):
+    def setUp(self):
+        self.stripe = StubStripe()
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.readers = [
+            get_user_model().objects.create_user(f"reader{i}@test.com", "testpass")
+            for i in range(2)
+        ]
+        self.book = Book.objects.create(
+            title="Held Book", author="Test Author", inventory=0, daily_fee=1
+        )
+        today = datetime.today().date()
+        self.borrowings = [
+            Borrowing.objects.create(
+                borrow_date=today,
+                expected_return_date=today + timedelta(days=days),
+                book=self.book,
+                user=self.admin,
+            )
+            for days in (8, 3)
+        ]
+
+    def place_hold(self, user):
+        return self.client.post(
+            reverse("borrowing:hold-list"), {"user": user.id, "book": self.book.id}
+        )
+
+    def return_url(self, borrowing):
+        return reverse("borrowing:borrowing-return-book", args=[borrowing.id])
+
+    def test_hold_queue_positions(self):
+        first = self.place_hold(self.readers[0])
+        second = self.place_hold(self.readers[1])
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data["status"], Hold.WAITING)
+        self.assertEqual(first.data["queue_position"], 1)
+        self.assertEqual(second.data["queue_position"], 2)
+        self.assertEqual(
+            self.place_hold(self.readers[0]).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_concurrent_duplicate_hold_is_rejected(self):
+        def place_competing_hold():
+            # the other request inserts its hold between the checks and the insert
+            Hold.objects.create(user=self.readers[0], book=self.book)
+            return Hold.objects.none()
+
+        with mock.patch.object(Hold.objects, "active", place_competing_hold):
+            response = self.place_hold(self.readers[0])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Hold.objects.count(), 1)
+
+    def test_hold_rejected_when_book_available(self):
+        Book.objects.filter(pk=self.book.pk).update(inventory=1)
+
+        response = self.place_hold(self.readers[0])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reader_sees_only_own_holds(self):
+        self.place_hold(self.readers[0])
+        self.place_hold(self.readers[1])
+        reader_client = APIClient()
+        reader_client.force_authenticate(self.readers[1])
+
+        response = reader_client.get(reverse("borrowing:hold-list"))
+
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["user"], self.readers[1].id)
+
+    def test_return_hands_copy_to_oldest_hold(self):
+        self.place_hold(self.readers[0])
+        self.place_hold(self.readers[1])
+
+        self.client.post(self.return_url(self.borrowings[0]))
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        holds = Hold.objects.order_by("id")
+        self.assertEqual(holds[0].status, Hold.READY)
+        self.assertIsNotNone(holds[0].ready_at)
+        self.assertEqual(holds[1].status, Hold.WAITING)
+
+        # the copy is kept for the hold, not for the next borrower
+        response = self.client.post(
+            BORROWING_URL,
+            {
+                "user": self.readers[1].id,
+                "book": self.book.id,
+                "expected_return_date": datetime.today().date() + timedelta(days=5),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            BORROWING_URL,
+            {
+                "user": self.readers[0].id,
+                "book": self.book.id,
+                "expected_return_date": datetime.today().date() + timedelta(days=5),
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Hold.objects.get(pk=holds[0].pk).status, Hold.FULFILLED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+
+    def test_cancel_ready_hold_passes_copy_on(self):
+        first = self.place_hold(self.readers[0]).data["id"]
+        second = self.place_hold(self.readers[1]).data["id"]
+        self.client.post(self.return_url(self.borrowings[0]))
+
+        response = self.client.post(reverse("borrowing:hold-cancel", args=[first]))
+
+        self.assertEqual(response.data["status"], Hold.CANCELLED)
+        self.assertEqual(Hold.objects.get(pk=second).status, Hold.READY)
+        response = self.client.post(reverse("borrowing:hold-cancel", args=[first]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_hold_passes_copy_on(self):
+        first = self.place_hold(self.readers[0]).data["id"]
+        self.client.post(self.return_url(self.borrowings[0]))
+        Hold.objects.filter(pk=first).update(
+            ready_at=timezone.now() - timedelta(days=4)
+        )
+
+        self.assertEqual(expire_holds(), 1)
+
+        self.assertEqual(Hold.objects.get(pk=first).status, Hold.EXPIRED)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+    def test_bulk_checkout_takes_ready_and_fulfils_waiting_holds(self):
+        other = Book.objects.create(
+            title="Other Book", author="Test Author", inventory=1, daily_fee=1
+        )
+        ready = self.place_hold(self.readers[0]).data["id"]
+        self.client.post(self.return_url(self.borrowings[0]))
+        waiting = Hold.objects.create(user=self.readers[0], book=other).id
+
+        response = self.client.post(
+            BORROWING_URL + "bulk/",
+            {
+                "user": self.readers[0].id,
+                "expected_return_date": datetime.today().date() + timedelta(days=2),
+                "books": [self.book.id, other.id],
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Hold.objects.get(pk=ready).status, Hold.FULFILLED)
+        self.assertEqual(Hold.objects.get(pk=waiting).status, Hold.FULFILLED)
+        self.assertEqual(
+            list(Book.objects.order_by("id").values_list("inventory", flat=True)),
+            [0, 0],
+        )
+
+    def test_added_inventory_goes_to_waiting_holds_first(self):
+        first = self.place_hold(self.readers[0]).data["id"]
+        second = self.place_hold(self.readers[1]).data["id"]
+
+        response = self.client.patch(
+            reverse("books:book-detail", args=[self.book.id]), {"inventory": 3}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["inventory"], 1)
+        self.assertEqual(Hold.objects.get(pk=first).status, Hold.READY)
+        self.assertEqual(Hold.objects.get(pk=second).status, Hold.READY)
+        response = self.client.get(
+            reverse("books:book-availability", args=[self.book.id])
+        )
+        self.assertTrue(response.data["available"])
+
+    def test_availability_projects_free_date(self):
+        url = reverse("books:book-availability", args=[self.book.id])
+        today = datetime.today().date()
+
+        response = self.client.get(url)
+        self.assertFalse(response.data["available"])
+        self.assertEqual(response.data["open_borrowings"], 2)
+        self.assertEqual(
+            response.data["next_return_date"], str(today + timedelta(days=3))
+        )
+        self.assertEqual(
+            response.data["projected_free_date"], str(today + timedelta(days=3))
+        )
+
+        # the first return goes to the waiting hold
+        self.place_hold(self.readers[0])
+        response = self.client.get(url)
+        self.assertEqual(response.data["waiting_holds"], 1)
+        self.assertEqual(
+            response.data["projected_free_date"], str(today + timedelta(days=8))
+        )
+
+        self.place_hold(self.readers[1])
+        response = self.client.get(url)
+        self.assertIsNone(response.data["projected_free_date"])
+
+
+class AsyncBorrowingApiTest(TestCase):
+    def setUp(self):
+        self.stripe = StubStripe(latency=0.2)
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.headers = {"Authorize": f"Bearer {AccessToken.for_user(self.admin)}"}
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=1,
+            daily_fee=1.00,
+        )
+        self.payload = {
+            "user": self.admin.id,
+            "book": self.book.id,
+            "expected_return_date": (
+                datetime.today().date() + timedelta(days=5)
+            ).isoformat(),
+        }
+
+    async def borrow(self):
+        return await self.async_client.post(
+            BORROWING_URL + "async/",
+            self.payload,
+            content_type="application/json",
+            headers=self.headers,
+        )
+
+    async def test_borrow_and_return(self):
+        response = await self.borrow()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()["book"], self.book.id)
+        payment = await Payment.objects.select_related("checkout_session").aget(
+            borrowing_id=response.json()["id"]
+        )
+        self.assertTrue(payment.checkout_session.session_id.startswith("cs_test_"))
+
+        response = await self.borrow()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = f"{BORROWING_URL}async/{payment.borrowing_id}/return/"
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        book = await Book.objects.aget(pk=self.book.id)
+        self.assertEqual(book.inventory, 1)
+
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_admin_message_goes_through_the_rate_limited_task(self):
+        with mock.patch(
+            "borrowing.tasks.send_telegram_message.delay"
+        ) as delay, mock.patch.multiple(
+            "borrowing.tasks", TOKEN="token", ADMIN_CHAT_ID="1"
+        ):
+            response = await self.borrow()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.stripe.calls), 1)
+        delay.assert_called_once()
+        chat_id, text = delay.call_args.args
+        self.assertEqual(chat_id, "1")
+        self.assertIn(self.book.title, text)
+
+    async def test_failed_follow_up_does_not_fail_the_borrowing(self):
+        with mock.patch(
+            "borrowing.async_views.attach_stripe_payment_session_async",
+            side_effect=ConnectionError("network down"),
+        ), self.assertLogs("borrowing.async_views", "ERROR"):
+            response = await self.borrow()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        payment = await Payment.objects.aget(borrowing_id=response.json()["id"])
+        self.assertIsNone(payment.checkout_session_id)
+
+    async def test_requires_authentication_and_valid_ids(self):
+        response = await self.async_client.post(
+            BORROWING_URL + "async/", self.payload, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.payload["book"] = 0
+        response = await self.borrow()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("book", response.json())
+
+
+class BorrowingExportApiTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        book = Book.objects.create(
+            title="Test, Book", author="Test Author", inventory=2, daily_fee=1.00
+        )
+        today = datetime.today().date()
+        self.old, self.active = (
+            Borrowing.objects.create(
+                borrow_date=borrow_date,
+                expected_return_date=borrow_date + timedelta(days=5),
+                actual_return_date=returned,
+                book=book,
+                user=self.admin,
+            )
+            for borrow_date, returned in (
+                (today - timedelta(days=20), today),
+                (today, None),
+            )
+        )
+        self.url = BORROWING_URL + "export/"
+
+    def test_export_csv_is_streamed_with_filters(self):
+        response = self.client.get(self.url, {"is_active": "true"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:2], ["id", "borrow_date"])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"Test, Book"', lines[1])
+
+    def test_export_ndjson_by_date_range(self):
+        response = self.client.get(
+            self.url,
+            {
+                "file_format": "ndjson",
+                "date_to": datetime.today().date() - timedelta(days=10),
+            },
+        )
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual([row["id"] for row in rows], [self.old.id])
+        self.assertEqual(rows[0]["user__email"], "admin@admin.com")
+
+    def test_export_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user("reader@test.com", "testpass")
+        )
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@mock.patch("payments.stripe_helper.stripe", StubStripe())
+class ConcurrentBorrowingTest(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.users = [
+            get_user_model().objects.create_user(email=f"user{i}@test.com")
+            for i in range(self.THREADS * 2)
+        ]
+        self.book = Book.objects.create(
+            title="Popular Book",
+            author="Test Author",
+            inventory=self.THREADS,
+            daily_fee=1.00,
+        )
+
+    def run_in_threads(self, calls):
+        barrier = threading.Barrier(len(calls))
+        responses = []
+
+        def worker(call):
+            client = APIClient()
+            client.force_authenticate(self.admin)
+            barrier.wait()
+            try:
+                responses.append(call(client))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def borrow(self, user):
+        return lambda client: client.post(
+            BORROWING_URL,
+            {
+                "user": user.id,
+                "book": self.book.id,
+                "expected_return_date": datetime.today().date() + timedelta(days=3),
+            },
+        )
+
+    def test_parallel_borrowing_never_oversells(self):
+        responses = self.run_in_threads([self.borrow(user) for user in self.users])
+
+        created = [r for r in responses if r.status_code == status.HTTP_201_CREATED]
+        rejected = [
+            r for r in responses if r.status_code == status.HTTP_400_BAD_REQUEST
+        ]
+        self.assertEqual(len(created), self.THREADS)
+        self.assertEqual(len(rejected), len(self.users) - self.THREADS)
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(Borrowing.objects.filter(book=self.book).count(), self.THREADS)
+
+    def test_parallel_borrow_and_return_keeps_inventory_consistent(self):
+        borrowed = self.run_in_threads(
+            [self.borrow(user) for user in self.users[: self.THREADS]]
+        )
+        borrowing_ids = [response.data["id"] for response in borrowed]
+
+        returns = [
+            lambda client, pk=pk: client.post(f"{BORROWING_URL}{pk}/return/")
+            for pk in borrowing_ids
+        ]
+        # the same borrowing returned twice must only be counted once
+        returns += [
+            lambda client, pk=pk: client.post(f"{BORROWING_URL}{pk}/return/")
+            for pk in borrowing_ids[:2]
+        ]
+        borrows = [self.borrow(user) for user in self.users[self.THREADS :]]
+        self.run_in_threads(returns + borrows)
+
+        self.book.refresh_from_db()
+        active = Borrowing.objects.filter(
+            book=self.book, actual_return_date__isnull=True
+        ).count()
+        self.assertEqual(self.book.inventory + active, self.THREADS)
+
+
+class StripeOutsideTransactionTest(TransactionTestCase):
+    STRIPE_LATENCY = 0.3
+
+    def setUp(self):
+        self.stripe = StubStripe(latency=self.STRIPE_LATENCY)
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=2,
+            daily_fee=1.00,
+        )
+
+    def measure_transaction_hold_time(self, call):
+        """Time between the first and the last query run inside a transaction."""
+        timestamps = []
+
+        def record(execute, sql, params, many, context):
+            if connection.in_atomic_block:
+                timestamps.append(time.monotonic())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = call()
+        return response, timestamps[-1] - timestamps[0]
+
+    def test_borrow_and_return_do_not_hold_transaction_during_stripe_call(self):
+        response, hold_time = self.measure_transaction_hold_time(
+            lambda: self.client.post(
+                BORROWING_URL,
+                {
+                    "user": self.user.id,
+                    "book": self.book.id,
+                    "expected_return_date": datetime.today().date() + timedelta(days=3),
+                },
+            )
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertLess(hold_time, self.STRIPE_LATENCY)
+
+        borrowing = Borrowing.objects.get(pk=response.data["id"])
+        borrowing.expected_return_date = datetime.today().date() - timedelta(days=2)
+        borrowing.borrow_date = datetime.today().date() - timedelta(days=5)
+        borrowing.save()
+        response, hold_time = self.measure_transaction_hold_time(
+            lambda: self.client.post(f"{BORROWING_URL}{borrowing.id}/return/")
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(hold_time, self.STRIPE_LATENCY)
+
+        self.assertEqual(len(self.stripe.calls), 2)
+        self.assertFalse(any(call["in_atomic_block"] for call in self.stripe.calls))
+        self.assertEqual(
+            set(
+                Payment.objects.filter(borrowing=borrowing).values_list(
+                    "type_pay", "money_to_pay"
+                )
+            ),
+            {("PAYMENT", 3), ("FINE", 4)},
+        )
+        self.assertFalse(Payment.objects.filter(checkout_session__isnull=True).exists())
+
+
+class NotifyAdminTest(TestCase):
+    @mock.patch("borrowing.tasks.send_telegram_message.delay")
+    @mock.patch.multiple("borrowing.tasks", TOKEN="token", ADMIN_CHAT_ID="42")
+    def test_message_is_queued_after_commit(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_admin("hello")
+            delay.assert_not_called()
+        delay.assert_called_once_with("42", "hello")
+
+    @mock.patch("borrowing.tasks.send_telegram_message.delay")
+    @mock.patch.multiple("borrowing.tasks", TOKEN=None, ADMIN_CHAT_ID="42")
+    def test_message_is_dropped_without_bot_token(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify_admin("hello")
+        delay.assert_not_called()
+
+    @mock.patch("borrowing.tasks.send_message", new_callable=mock.AsyncMock)
+    def test_task_retries_when_rate_limited(self, send):
+        send.side_effect = RetryAfter(3)
+        with mock.patch.object(
+            send_telegram_message, "retry", side_effect=Retry()
+        ) as retry:
+            with self.assertRaises(Retry):
+                send_telegram_message("42", "hello")
+        self.assertEqual(retry.call_args.kwargs["countdown"], 3)
+
+
+@mock.patch("borrowing.tasks.send_messages", new_callable=mock.AsyncMock)
+class DailyCheckingBorrowingsTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="test@test.com")
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=2,
+            daily_fee=1.00,
+        )
+
+    def borrow(self, days_overdue):
+        return Borrowing.objects.create(
+            borrow_date=datetime.today().date() - timedelta(days=30),
+            expected_return_date=datetime.today().date() - timedelta(days_overdue),
+            book=self.book,
+            user=self.user,
+        )
+
+    def sent_texts(self, send):
+        return [text for call in send.call_args_list for text in call.args[1]]
+
+    def test_no_overdue_borrowings(self, send):
+        self.borrow(days_overdue=-1)
+        metrics = daily_checking_borrowings()
+        self.assertEqual(metrics["overdue"], 0)
+        self.assertEqual(
+            self.sent_texts(send), ["** Hello! No borrowings overdue today! **"]
+        )
+
+    def test_digest_is_packed_into_few_messages(self, send):
+        for _ in range(300):
+            self.borrow(days_overdue=2)
+        self.borrow(days_overdue=-1)
+
+        with self.assertNumQueries(2):
+            metrics = daily_checking_borrowings()
+
+        texts = self.sent_texts(send)
+        self.assertEqual(texts[0], "** Hello! Here 300 overdue borrowing(s) today: **")
+        self.assertEqual(metrics["overdue"], 300)
+        self.assertEqual(metrics["messages"], len(texts))
+        self.assertLess(len(texts), 30)
+        self.assertTrue(all(len(text) <= 4096 for text in texts))
+        self.assertEqual("".join(texts[1:]).count("** 2 ** day(s) overdue"), 300)
+
+    def test_pack_messages(self, send):
+        lines = ["a" * 40 + "\n"] * 10
+        messages = list(pack_messages(lines, limit=100))
+        self.assertEqual([len(message) for message in messages], [82, 82, 82, 82, 82])
+        self.assertEqual(list(pack_messages(["a" * 150], limit=100)), ["a" * 100])
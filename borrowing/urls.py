@@ -1,13 +1,21 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from borrowing.views import BorrowingView
+from borrowing.async_views import BorrowingAsyncCreateView, BorrowingAsyncReturnView
+from borrowing.views import BorrowingView, HoldView
 
 router = routers.DefaultRouter()
+router.register("holds", HoldView)
 router.register("", BorrowingView)
 
 
 urlpatterns = [
+    path("async/", BorrowingAsyncCreateView.as_view(), name="borrowing-async-create"),
+    path(
+        "async/<int:pk>/return/",
+        BorrowingAsyncReturnView.as_view(),
+        name="borrowing-async-return",
+    ),
     path("", include(router.urls)),
 ]
 
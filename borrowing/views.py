@@ -1,38 +1,74 @@
-import asyncio
 from datetime import datetime
+from itertools import chain
 
-from django.db import transaction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import mixins, viewsets, serializers, status
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
-from borrowing.bot_helper import send_message, ADMIN_CHAT_ID
-from borrowing.models import Borrowing
+from books.models import Book
+from library_service.db_router import ReplicaReadMixin
+from library_service.exports import ExportParamsSerializer, export_response
+from library_service.values_serializers import ValuesListMixin
+from borrowing.holds import cancel_hold
+from borrowing.models import Borrowing, Hold
 from borrowing.serializers import (
     BorrowingSerializer,
+    BorrowingListSerializer,
     BorrowingCreateSerializer,
     BorrowingRetrieveSerializer,
     BorrowingReturnSerializer,
+    BorrowingBulkCreateSerializer,
+    HoldSerializer,
+    HoldCreateSerializer,
+)
+from borrowing.services import (
+    ALREADY_BORROWED,
+    borrow_book,
+    new_borrowing_message,
+    return_borrowing,
 )
 from payments.models import Payment
-from payments.stripe_helper import create_stripe_payment_session
+from payments.stripe_helper import create_pending_payment, create_pending_payments
 from borrowing.permissions import IsAdminOrIfAuthenticatedReadOnly
+from borrowing.tasks import notify_admin, pack_messages
+from user.summary import adjust_summary
 
-
-FINE_MULTIPLIER = 2
+EXPORT_COLUMNS = (
+    "id",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+    "user_id",
+    "user__email",
+    "book_id",
+    "book__title",
+    "book__author",
+    "fine_accrual__amount",
+)
 
 
 class BorrowingView(
+    ReplicaReadMixin,
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet,
 ):
-    queryset = Borrowing.objects.select_related("book", "user").prefetch_related(
-        "payments"
+    queryset = Borrowing.objects.select_related(
+        "book", "user", "fine_accrual"
+    ).prefetch_related(
+        Prefetch(
+            "payments", queryset=Payment.objects.select_related("checkout_session")
+        )
     )
     serializer_class = BorrowingSerializer
+    values_serializer_class = BorrowingListSerializer
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
 
     def get_queryset(self):
@@ -58,6 +94,8 @@ class BorrowingView(
             return BorrowingCreateSerializer
         if self.action == "return_book":
             return BorrowingReturnSerializer
+        if self.action == "bulk_checkout":
+            return BorrowingBulkCreateSerializer
         return BorrowingSerializer
 
     def create(self, request, *args, **kwargs):
@@ -68,63 +106,121 @@ class BorrowingView(
         user = validated_data.get("user")
         expected_return_date = validated_data.get("expected_return_date")
         book = validated_data.get("book")
-        borrow_date = datetime.today().date()
-
-        if book.inventory == 0:
-            raise serializers.ValidationError(
-                "This book is currently unavailable, please try another time."
-            )
 
         if Borrowing.objects.filter(
             user=user, book=book, actual_return_date__isnull=True
         ).exists():
+            raise serializers.ValidationError(ALREADY_BORROWED)
+
+        with transaction.atomic():
+            borrowing = borrow_book(user, book, expected_return_date)
+            create_pending_payment(request, borrowing, "PAYMENT")
+            notify_admin(new_borrowing_message(borrowing))
+
+        serializer = self.get_serializer(borrowing)
+
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @extend_schema(responses={201: BorrowingCreateSerializer(many=True)})
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_checkout(self, request):
+        """
+        Check out many books for one user in a single request.
+
+        All books are validated with set-based queries and reserved in one
+        transaction: either every book is borrowed or none is. Like a
+        single borrowing, the copy kept for a ready hold of the user is
+        taken and the user's holds on the books are fulfilled. The user
+        pays for all of them with one Stripe checkout session.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        validated_data = serializer.validated_data
+        user = validated_data["user"]
+        expected_return_date = validated_data["expected_return_date"]
+        book_ids = validated_data["books"]
+        borrow_date = datetime.today().date()
+
+        books = Book.objects.in_bulk(book_ids)
+        missing = [book_id for book_id in book_ids if book_id not in books]
+        if missing:
             raise serializers.ValidationError(
-                "You already have one copy of this book, you cannot borrow another one."
+                {"books": f"Books with these ids do not exist: {missing}."}
+            )
+        already_borrowed = list(
+            Borrowing.objects.filter(
+                user=user, book_id__in=book_ids, actual_return_date__isnull=True
+            ).values_list("book_id", flat=True)
+        )
+        if already_borrowed:
+            raise serializers.ValidationError(
+                {
+                    "books": "You already have one copy of these books, "
+                    f"you cannot borrow another one: {sorted(already_borrowed)}."
+                }
             )
 
         with transaction.atomic():
-            book.inventory -= 1
-            book.save()
-            borrowing = Borrowing.objects.create(
-                borrow_date=borrow_date,
-                expected_return_date=expected_return_date,
-                book=book,
-                user=user,
+            # the copies kept for the user's ready holds are off the shelf
+            # already, only the other books need a copy reserved
+            ready = Hold.objects.filter(
+                user=user, book_id__in=book_ids, status=Hold.READY
             )
+            held = set(ready.values_list("book_id", flat=True))
+            claimed = ready.filter(book_id__in=held).update(status=Hold.FULFILLED)
+            to_reserve = [book_id for book_id in book_ids if book_id not in held]
+            reserved = claimed + Book.objects.reserve_copies(to_reserve)
+            if reserved < len(book_ids):
+                transaction.set_rollback(True)
+            else:
+                borrowings = Borrowing.objects.bulk_create(
+                    Borrowing(
+                        borrow_date=borrow_date,
+                        expected_return_date=expected_return_date,
+                        book=books[book_id],
+                        user=user,
+                    )
+                    for book_id in book_ids
+                )
+                Hold.objects.filter(
+                    user=user, book_id__in=to_reserve, status=Hold.WAITING
+                ).update(status=Hold.FULFILLED)
+                adjust_summary(user.id, active_borrowings=len(borrowings))
+                create_pending_payments(request, borrowings, "PAYMENT")
 
-            session_id, session_url, money_to_pay = create_stripe_payment_session(
-                request,
-                borrowing,
-            )
+                formatted_date = datetime.today().strftime("%d-%m-%Y  %H:%M")
+                header = (
+                    f"{formatted_date} NEW bulk borrowing \n"
+                    "----------------------------------------\n"
+                    f"{len(book_ids)} BOOK(S) have been borrowed by {user.email}\n"
+                    f"expected return date: "
+                    f"{expected_return_date.strftime('%d-%m-%Y')}.\n"
+                )
+                titles = (f"** {books[book_id].title} **\n" for book_id in book_ids)
+                # up to BULK_BORROWING_MAX_BOOKS titles do not fit in one
+                # Telegram message
+                for message in pack_messages(chain([header], titles)):
+                    notify_admin(message)
 
-            formatted_date = datetime.today().strftime("%d-%m-%Y  %H:%M")
-            expected_return_date = expected_return_date.strftime("%d-%m-%Y")
-            message = (
-                f"{formatted_date} NEW borrowing \n"
-                "----------------------------------------\n"
-                f"BOOK: ** {borrowing.book.title} **  \n"
-                f"has been borrowed by {borrowing.user.email}\n"
-                f"expected return date: {expected_return_date}.\n"
-                f"now in stock: ** {book.inventory} **\n"
+        if reserved < len(book_ids):
+            unavailable = sorted(
+                Book.objects.filter(pk__in=to_reserve, inventory=0).values_list(
+                    "id", flat=True
+                )
             )
-            asyncio.run(send_message(ADMIN_CHAT_ID, message))
-
-        if session_id:
-            payment = Payment.objects.create(
-                status="PENDING",
-                type_pay="PAYMENT",
-                borrowing=borrowing,
-                session_id=session_id,
-                session_url=session_url,
-                money_to_pay=money_to_pay,
+            raise serializers.ValidationError(
+                {
+                    "books": "These books are currently unavailable, "
+                    f"please try another time: {unavailable}."
+                }
             )
 
-        serializer = self.get_serializer(borrowing)
-
-        return Response(
-            serializer.data,
-            status=status.HTTP_201_CREATED,
-        )
+        serializer = BorrowingCreateSerializer(borrowings, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(
         detail=True,
@@ -139,30 +235,54 @@ class BorrowingView(
                 f"This book already has returned at {borrowing.actual_return_date}."
             )
         with transaction.atomic():
-            borrowing.actual_return_date = datetime.today().date()
-            borrowing.save()
-            book = borrowing.book
-            book.inventory += 1
-            book.save()
-
+            return_borrowing(borrowing)
             if borrowing.actual_return_date > borrowing.expected_return_date:
-                session_id, session_url, money_to_pay = create_stripe_payment_session(
-                    request, borrowing, FINE_MULTIPLIER
-                )
-            else:
-                session_id = None
-            if session_id:
-                payment = Payment.objects.create(
-                    status="PENDING",
-                    type_pay="FINE",
-                    borrowing=borrowing,
-                    session_id=session_id,
-                    session_url=session_url,
-                    money_to_pay=money_to_pay,
+                create_pending_payment(
+                    request, borrowing, "FINE", settings.FINE_MULTIPLIER
                 )
 
         return Response(status=status.HTTP_200_OK)
 
+    @extend_schema(
+        parameters=[
+            ExportParamsSerializer,
+            OpenApiParameter(
+                "user_id",
+                type={"type": "int"},
+                description="Export the borrowings of one user (ex. /?user_id=1)",
+            ),
+            OpenApiParameter(
+                "is_active",
+                type={"type": "bool"},
+                description="Export only the borrowings not returned (ex. /?is_active=true)",
+            ),
+        ],
+        responses={(200, "text/csv"): bytes, (200, "application/x-ndjson"): bytes},
+    )
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Stream the borrowings as CSV or NDJSON (?file_format=ndjson),
+        filtered by borrow date with ?date_from= and ?date_to=.
+        """
+        params = ExportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = self.get_queryset().select_related(None).prefetch_related(None)
+        if "date_from" in params.validated_data:
+            queryset = queryset.filter(
+                borrow_date__gte=params.validated_data["date_from"]
+            )
+        if "date_to" in params.validated_data:
+            queryset = queryset.filter(
+                borrow_date__lte=params.validated_data["date_to"]
+            )
+        return export_response(
+            queryset.order_by("id"),
+            EXPORT_COLUMNS,
+            params.validated_data["file_format"],
+            "borrowings",
+        )
+
     @extend_schema(
         parameters=[
             OpenApiParameter(
@@ -175,6 +295,11 @@ class BorrowingView(
                 type={"type": "bool"},
                 description="Filter by active borrowings (not returned) (ex. /?is_active=true)",
             ),
+            OpenApiParameter(
+                "fields",
+                type={"type": "string"},
+                description="Return only these fields (ex. /?fields=id,book,payments)",
+            ),
         ]
     )
     def list(self, request, *args, **kwargs):
@@ -182,3 +307,91 @@ class BorrowingView(
         Get list of borrowings
         """
         return super().list(request, *args, **kwargs)
+
+
+class HoldView(
+    ReplicaReadMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.CreateModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    The holds on books with no copy left. A returned copy goes to the
+    oldest waiting hold of its book, which becomes READY until it is
+    borrowed, cancelled or expires after HOLD_PICKUP_DAYS.
+    """
+
+    queryset = Hold.objects.select_related("book").with_queue_position()
+    serializer_class = HoldSerializer
+    permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
+
+    def get_queryset(self):
+        queryset = self.queryset
+        user = self.request.user
+        if not user.is_staff:
+            queryset = queryset.filter(user=user)
+        if self.action == "list" and self.request.query_params.get("status"):
+            queryset = queryset.filter(
+                status=self.request.query_params["status"].upper()
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == "create":
+            return HoldCreateSerializer
+        return HoldSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data["user"]
+        book = serializer.validated_data["book"]
+
+        if Borrowing.objects.filter(
+            user=user, book=book, actual_return_date__isnull=True
+        ).exists():
+            raise serializers.ValidationError(ALREADY_BORROWED)
+        if Hold.objects.active().filter(user=user, book=book).exists():
+            raise serializers.ValidationError("You already hold this book.")
+        if book.inventory > 0:
+            raise serializers.ValidationError(
+                "This book is available, borrow it instead."
+            )
+
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(user=user, book=book)
+        except IntegrityError:
+            # a concurrent request placed the same hold after the check above
+            raise serializers.ValidationError("You already hold this book.")
+        return Response(
+            HoldSerializer(self.get_queryset().get(pk=hold.pk)).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @extend_schema(request=None, responses={200: HoldSerializer})
+    @action(detail=True, methods=["post"])
+    def cancel(self, request, pk=None):
+        """Cancel the hold; a copy kept for it goes to the next hold."""
+        hold = self.get_object()
+        if not cancel_hold(hold):
+            raise serializers.ValidationError(
+                f"This hold is already {hold.status.lower()}."
+            )
+        return Response(HoldSerializer(self.get_queryset().get(pk=hold.pk)).data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "status",
+                type={"type": "string"},
+                description="Filter holds by status (ex. /?status=waiting)",
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        """
+        Get list of holds
+        """
+        return super().list(request, *args, **kwargs)
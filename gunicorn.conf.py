@@ -0,0 +1,42 @@
+"""
+Gunicorn configuration of the production serving profile.
+
+    gunicorn -c gunicorn.conf.py
+
+SERVER_MODE=wsgi (the default) serves library_service.wsgi on threaded
+workers, SERVER_MODE=asgi serves library_service.asgi on uvicorn workers.
+The workers add up their request metrics through the files of METRICS_DIR.
+"""
+
+import multiprocessing
+import os
+from pathlib import Path
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+if os.getenv("SERVER_MODE", "wsgi") == "asgi":
+    wsgi_app = "library_service.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "library_service.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+# recycle workers now and then to bound memory growth
+max_requests = 1000
+max_requests_jitter = 100
+accesslog = "-"
+
+# the workers inherit it from the master
+metrics_dir = Path(os.environ.setdefault("METRICS_DIR", "/tmp/library_metrics"))
+
+
+def on_starting(server):
+    # the counts of an earlier run of the server must not add up with ours
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    for path in metrics_dir.glob("*.json"):
+        path.unlink(missing_ok=True)
@@ -0,0 +1,92 @@
+"""
+Async JSON views for the ASGI stack.
+
+DRF views are sync only, so the async endpoints are plain Django views.
+`AsyncAPIView` keeps the DRF conventions they need: JWT authentication,
+permission classes, `request.data` / `request.query_params` and the
+error responses of DRF's exception handler, and the pinning of writers
+to the primary of `ReplicaReadMixin`. Only the authentication (which
+loads the user) runs in a thread; the handlers use the async ORM and
+await the external services.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from library_service.db_router import apin_to_primary
+
+
+class AsyncAPIView(View):
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    renderer = JSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # authenticated by token, like DRF's APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[JSONParser()],
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            # loads the user, the only sync database access of the request
+            await sync_to_async(lambda: request.user)()
+            self.check_permissions(request)
+            if request.method not in SAFE_METHODS:
+                await apin_to_primary(request.user)
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404 as exc:
+            return self.handle_exception(request, exceptions.NotFound(*exc.args))
+        except exceptions.APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def check_permissions(self, request):
+        for permission in (permission() for permission in self.permission_classes):
+            if permission.has_permission(request, self):
+                continue
+            if request.authenticators and not request.successful_authenticator:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(
+                getattr(permission, "message", None),
+                getattr(permission, "code", None),
+            )
+
+    def handle_exception(self, request, exc):
+        headers = {}
+        if isinstance(
+            exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)
+        ):
+            header = request.authenticators[0].authenticate_header(request)
+            if header:
+                headers["WWW-Authenticate"] = header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {"detail": exc.detail}
+        response = self.response(data, exc.status_code)
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def response(self, data=None, status_code=status.HTTP_200_OK):
+        if data is None:
+            return HttpResponse(status=status_code)
+        return HttpResponse(
+            self.renderer.render(data),
+            status=status_code,
+            content_type="application/json",
+        )
@@ -0,0 +1,82 @@
+"""
+Routing of the API reads to the read replica.
+
+`ReplicaReadMixin` flags the safe (read) requests of a viewset in the
+`read_from_replica` context variable (as `books.cache.acached_data`
+does for the async catalogue views), and `ReplicaRouter` sends the
+queries run under the flag to the READ_REPLICA database. Everything
+else (writes, Celery tasks, the admin) stays on the primary.
+
+After a write the user is pinned to the primary for REPLICA_PIN_SECONDS,
+longer than the replication lag, so they always read their own writes.
+Every write path pins through `pin_to_primary` (or `apin_to_primary` in
+async views): the mixin for the viewsets, `AsyncAPIView` for the async
+endpoints.
+"""
+
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+read_from_replica = ContextVar("read_from_replica", default=False)
+
+
+def pin_key(user) -> str:
+    return f"db:pinned:{user.pk}"
+
+
+def pin_to_primary(user) -> None:
+    """Read from the primary for the next REPLICA_PIN_SECONDS for `user`."""
+    if settings.READ_REPLICA and user.is_authenticated:
+        cache.set(pin_key(user), True, settings.REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user) -> None:
+    if settings.READ_REPLICA and user.is_authenticated:
+        await cache.aset(pin_key(user), True, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned_to_primary(user) -> bool:
+    return user.is_authenticated and bool(cache.get(pin_key(user)))
+
+
+async def apinned_to_primary(user) -> bool:
+    return user.is_authenticated and bool(await cache.aget(pin_key(user)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if settings.READ_REPLICA and read_from_replica.get():
+            return settings.READ_REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        # also for instances that were read from the replica
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """Serve the read actions of a viewset from the read replica."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.READ_REPLICA:
+            return
+        user = request.user
+        if request.method not in SAFE_METHODS:
+            pin_to_primary(user)
+        elif not pinned_to_primary(user):
+            self.replica_token = read_from_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "replica_token", None)
+        if token is not None:
+            read_from_replica.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,341 @@
+"""
+In-process request metrics exposed in the Prometheus text format.
+
+`InstrumentationMiddleware` opens a `RequestSpan` for every sampled
+request. While it is active the database queries, the serializer work
+and the calls to external services (`external_call`) are timed into it.
+Spans live in a context variable, so they follow the request into
+`sync_to_async` threads.
+
+Every worker process observes into its own histograms. With METRICS_DIR
+set (gunicorn.conf.py does it for the multi-worker profile), each process
+also writes them to a file of its own in that directory, at most every
+FLUSH_INTERVAL seconds, and a scrape adds up the files of all the
+processes: whichever worker answers, /metrics reports the totals, and
+the observations of the workers that were recycled are kept.
+"""
+
+import atexit
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.serializers import BaseSerializer
+
+from library_service.values_serializers import ValuesSerializer
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1.0
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+
+
+class Histogram:
+    """Cumulative Prometheus histogram, safe to observe from several threads."""
+
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+        store.changed()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {labels: list(values) for labels, values in self.series.items()}
+
+    def collect(self, series: dict):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, values in sorted(series.items()):
+            label_text = format_labels(self.labelnames, labels)
+            for bound, count in zip(self.buckets, values):
+                yield f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{label_text},le="+Inf"}} {values[-2]}'
+            yield f"{self.name}_count{{{label_text}}} {values[-2]}"
+            yield f"{self.name}_sum{{{label_text}}} {values[-1]:.6f}"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Wall time of the requests.",
+    ("view", "method", "status"),
+)
+DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Database queries per sampled request.",
+    ("view",),
+    QUERY_COUNT_BUCKETS,
+)
+DB_DURATION = Histogram(
+    "http_request_db_duration_seconds",
+    "Database time per sampled request.",
+    ("view",),
+)
+SERIALIZER_DURATION = Histogram(
+    "http_request_serializer_duration_seconds",
+    "Serializer time per sampled request.",
+    ("view",),
+)
+EXTERNAL_DURATION = Histogram(
+    "external_call_duration_seconds",
+    "Duration of the calls to external services.",
+    ("service",),
+)
+HISTOGRAMS = (
+    REQUEST_DURATION,
+    DB_QUERIES,
+    DB_DURATION,
+    SERIALIZER_DURATION,
+    EXTERNAL_DURATION,
+)
+
+
+class SharedStore:
+    """
+    The histograms of all the processes writing to METRICS_DIR.
+
+    A process writes its own series to `<pid>-<random>.json` (replaced
+    atomically, so readers never see a partial file) from a background
+    thread, once it has observed something new. The files of processes
+    that are gone stay and keep counting; the directory is emptied when
+    the server starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.path = None
+        self.dirty = threading.Event()
+
+    def changed(self):
+        if self.pid != os.getpid():
+            self.start()
+        if self.path is not None:
+            self.dirty.set()
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            directory = settings.METRICS_DIR
+            if not directory:
+                return
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self.path = Path(directory) / f"{self.pid}-{uuid.uuid4().hex}.json"
+            self.dirty = threading.Event()
+            threading.Thread(
+                target=self.flush_periodically, name="metrics-flush", daemon=True
+            ).start()
+            atexit.register(self.flush)
+
+    def flush_periodically(self):
+        while True:
+            self.dirty.wait()
+            self.dirty.clear()
+            self.flush()
+            time.sleep(FLUSH_INTERVAL)
+
+    def flush(self):
+        """Write the series of this process to its file."""
+        path = self.path
+        if path is None or self.pid != os.getpid():
+            return
+        data = {
+            histogram.name: [
+                [list(labels), values]
+                for labels, values in histogram.snapshot().items()
+            ]
+            for histogram in HISTOGRAMS
+        }
+        with self.lock:
+            temporary = path.with_suffix(".tmp")
+            try:
+                temporary.write_text(json.dumps(data))
+                os.replace(temporary, path)
+            except OSError:
+                logger.warning("Cannot write the metrics to %s", path, exc_info=True)
+
+    def collect(self) -> dict:
+        """The series of every process, summed by labels."""
+        totals = {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+        for path in Path(settings.METRICS_DIR).glob("*.json"):
+            if path == self.path:
+                # this process is counted from memory, which is up to date
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                # removed or replaced since the directory was listed
+                continue
+            for name, rows in data.items():
+                series = totals.setdefault(name, {})
+                for labels, values in rows:
+                    labels = tuple(labels)
+                    total = series.get(labels)
+                    if total is None:
+                        series[labels] = values
+                    else:
+                        series[labels] = [a + b for a, b in zip(total, values)]
+        return totals
+
+    def after_fork(self):
+        # a forked child starts with its own, empty series (and fresh locks,
+        # as another thread of the parent may have held one)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.path = None
+        for histogram in HISTOGRAMS:
+            histogram.lock = threading.Lock()
+            histogram.series = {}
+
+
+store = SharedStore()
+os.register_at_fork(after_in_child=store.after_fork)
+
+
+class RequestSpan:
+    __slots__ = (
+        "queries",
+        "db_time",
+        "serializer_time",
+        "serializer_depth",
+        "external",
+    )
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.external = {}
+
+
+current_span = ContextVar("current_span", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    span = current_span.get()
+    if span is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        span.queries += 1
+        span.db_time += time.perf_counter() - started
+
+
+@contextmanager
+def external_call(service: str):
+    """Time a call to an external service such as Stripe or Telegram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_DURATION.observe(elapsed, service)
+        span = current_span.get()
+        if span is not None:
+            span.external[service] = span.external.get(service, 0.0) + elapsed
+
+
+def timed_serializer_data(data):
+    def wrapper(self):
+        span = current_span.get()
+        # nested serializers are timed as part of the outermost one
+        if span is None or span.serializer_depth:
+            return data(self)
+        span.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            span.serializer_time += time.perf_counter() - started
+            span.serializer_depth -= 1
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def add_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install() -> None:
+    """Hook the query and serializer timers in; safe to call more than once."""
+    connection_created.connect(add_query_wrapper, dispatch_uid="metrics-queries")
+    for connection in connections.all(initialized_only=True):
+        add_query_wrapper(None, connection)
+    for serializer_class in (BaseSerializer, ValuesSerializer):
+        data = serializer_class.data.fget
+        if not getattr(data, "instrumented", False):
+            serializer_class.data = property(timed_serializer_data(data))
+
+
+def render_metrics() -> str:
+    if settings.METRICS_DIR:
+        totals = store.collect()
+    else:
+        totals = {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.collect(totals.get(histogram.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+def can_read_metrics(request) -> bool:
+    """
+    The scraper's METRICS_TOKEN bearer token or, for a look from the
+    browser, a staff session. Without a token only the latter works.
+    """
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, see `can_read_metrics`."""
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
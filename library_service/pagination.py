@@ -0,0 +1,60 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class LibraryCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key.
+
+    Every page is fetched with `WHERE id > <cursor> ORDER BY id LIMIT n`,
+    so the cost of a request does not depend on how deep the client pages.
+    The total number of rows is only counted when asked for
+    with `?with_count=true`.
+    """
+
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
+    count_query_param = "with_count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, "").lower() == "true":
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"] = {
+            "count": {
+                "type": "integer",
+                "example": 123,
+                "description": f"Only present with ?{self.count_query_param}=true",
+            },
+            **response_schema["properties"],
+        }
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append(
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Include the total number of results (costs an extra COUNT query)",
+                "schema": {"type": "boolean"},
+            }
+        )
+        return parameters
@@ -14,6 +14,7 @@ import os
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
+from celery.schedules import crontab
 
 load_dotenv()
 
@@ -31,7 +32,7 @@ SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", "SECRET_KEY")
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG")
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv("ALLOWED_HOSTS", "").split(",") if host]
 
 
 # Application definition
@@ -50,11 +51,13 @@ INSTALLED_APPS = [
     "user",
     "borrowing",
     "payments",
+    "benchmarks",
     "drf_spectacular",
 ]
 AUTH_USER_MODEL = "user.User"
 
 MIDDLEWARE = [
+    "library_service.middleware.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -88,12 +91,110 @@ WSGI_APPLICATION = "library_service.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+
+def postgres_database(host: str) -> dict:
+    return {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.getenv("POSTGRES_DB"),
+        "USER": os.getenv("POSTGRES_USER"),
+        "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
+        "HOST": host,
+        "PORT": os.getenv("POSTGRES_PORT", 5432),
+        # connections come from a psycopg pool per process, which replaces
+        # persistent connections (Django requires CONN_MAX_AGE=0 with it)
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {
+            "pool": {
+                "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+                "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+            },
+        },
+    }
+
+
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {"default": postgres_database(os.getenv("POSTGRES_HOST", "localhost"))}
+    if os.getenv("POSTGRES_REPLICA_HOST"):
+        DATABASES["replica"] = {
+            **postgres_database(os.getenv("POSTGRES_REPLICA_HOST")),
+            "TEST": {"MIRROR": "default"},
+        }
+else:
+    SQLITE_OPTIONS = {}
+    if os.getenv("SQLITE_PROFILE", "").lower() == "performance":
+        # single-node deployments where the web, Celery worker and beat
+        # processes share the file: with WAL readers never block the writer,
+        # and BEGIN IMMEDIATE takes the write lock up front, so that a
+        # transaction waits for it (busy_timeout) instead of failing with
+        # "database is locked" when it upgrades from a read
+        busy_timeout_ms = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+        SQLITE_OPTIONS = {
+            "init_command": ";".join(
+                (
+                    "PRAGMA journal_mode=WAL",
+                    "PRAGMA synchronous=NORMAL",
+                    f"PRAGMA busy_timeout={busy_timeout_ms}",
+                    f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 2**20))}",
+                    # negative: in KiB rather than in pages
+                    f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_SIZE_KB', 64000))}",
+                )
+            ),
+            "transaction_mode": "IMMEDIATE",
+            "timeout": busy_timeout_ms / 1000,
+        }
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": SQLITE_OPTIONS,
+            # a file rather than the shared in-memory database, so that
+            # concurrent test threads get real (waiting) database locks
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+            # keep connections open between requests, checking them before reuse
+            "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+        },
+        # a second connection to the same file, not read from unless
+        # READ_REPLICA is set; the tests give it a database of its own
+        # to check the routing
+        "replica": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": SQLITE_OPTIONS,
+            "TEST": {"NAME": BASE_DIR / "test_replica_db.sqlite3"},
+        },
+    }
+
+DATABASE_ROUTERS = ["library_service.db_router.ReplicaRouter"]
+# alias of the database the API read requests go to, empty for the primary
+READ_REPLICA = os.getenv(
+    "READ_REPLICA", "replica" if os.getenv("POSTGRES_REPLICA_HOST") else ""
+)
+# after a write, the user reads from the primary for this long (> replica lag)
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.getenv("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("CACHE_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
     }
-}
+
+# seconds a book list/detail response stays in the cache
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv("CATALOGUE_CACHE_TIMEOUT", 300))
 
 
 # Password validation
@@ -120,7 +221,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 LANGUAGE_CODE = "en-us"
 
-TIME_ZONE = os.getenv("TIME_ZONE")
+TIME_ZONE = os.getenv("TIME_ZONE", "UTC")
 
 USE_I18N = True
 
@@ -142,8 +243,47 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_PAGINATION_CLASS": "library_service.pagination.LibraryCursorPagination",
+    "PAGE_SIZE": int(os.getenv("PAGE_SIZE", 20)),
 }
 
+# upper bound for the ?page_size= query parameter
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
+# request instrumentation (library_service.middleware), exported on /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# share of the requests whose queries, serializers and external calls are timed
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0.1))
+# the "Authorization: Bearer <token>" header of the Prometheus scraper on
+# /metrics; unset, /metrics is only served to staff sessions
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# directory where the worker processes share their metrics (set by
+# gunicorn.conf.py); unset, /metrics reports the serving process only
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+# rows fetched per round-trip by the streaming CSV / NDJSON exports
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+
+# fine for an overdue borrowing, as a multiple of the book's daily fee
+FINE_MULTIPLIER = int(os.getenv("FINE_MULTIPLIER", 2))
+
+# upper bound for the number of books checked out with one bulk request
+BULK_BORROWING_MAX_BOOKS = int(os.getenv("BULK_BORROWING_MAX_BOOKS", 500))
+
+# days a copy returned for a hold is kept before the hold expires
+HOLD_PICKUP_DAYS = int(os.getenv("HOLD_PICKUP_DAYS", 3))
+
+# seconds the admin statistics are cached
+STATS_CACHE_TIMEOUT = int(os.getenv("STATS_CACHE_TIMEOUT", 60))
+
+# PENDING payments older than this are checked with Stripe and expired;
+# checkout sessions expire after 24 hours
+PENDING_PAYMENT_EXPIRY_HOURS = int(os.getenv("PENDING_PAYMENT_EXPIRY_HOURS", 25))
+# close the borrowings whose payment expired unpaid, freeing their copies
+EXPIRED_PAYMENT_RELEASES_BOOK = (
+    os.getenv("EXPIRED_PAYMENT_RELEASES_BOOK", "false").lower() == "true"
+)
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=120),  # 5 min
     "REFRESH_TOKEN_LIFETIME": timedelta(days=10),  # 1 day
@@ -152,12 +292,48 @@ SIMPLE_JWT = {
 
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
-CELERY_TIMEZONE = os.getenv("TIME_ZONE")
+CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# tasks are short, so every worker process takes one at a time and
+# acknowledges it only when done, so a crashed worker does not lose it
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(
+    os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", 1)
+)
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(
+    os.getenv("CELERY_WORKER_MAX_TASKS_PER_CHILD", 1000)
+)
+CELERY_BEAT_SCHEDULE = {
+    # safety net for webhook events whose scheduled run was lost
+    "apply-stripe-events": {
+        "task": "payments.tasks.apply_stripe_events",
+        "schedule": 60,
+    },
+    "accrue-fines": {
+        "task": "payments.tasks.accrue_fines",
+        "schedule": crontab(minute=10),
+    },
+    # borrowings become overdue at midnight without any write
+    "refresh-overdue-summaries": {
+        "task": "user.tasks.refresh_overdue_summaries",
+        "schedule": crontab(hour=0, minute=5),
+    },
+    "expire-pending-payments": {
+        "task": "payments.tasks.expire_pending_payments",
+        "schedule": crontab(minute=40),
+    },
+    "expire-holds": {
+        "task": "borrowing.tasks.expire_holds",
+        "schedule": crontab(minute=20),
+    },
+}
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# seconds webhook events are collected before they are applied in one batch
+STRIPE_WEBHOOK_BATCH_DELAY = int(os.getenv("STRIPE_WEBHOOK_BATCH_DELAY", 5))
 
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library Service API",
@@ -0,0 +1,174 @@
+"""
+Statistics for the admin dashboard.
+
+Each metric is one GROUP BY (or aggregate) query computed by the
+database, so the cost does not grow with Python loops over the rows.
+The whole response is cached for STATS_CACHE_TIMEOUT seconds per
+set of parameters, and read from the replica when there is one.
+"""
+
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from drf_spectacular.utils import extend_schema
+from rest_framework import serializers
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from books.models import Book
+from borrowing.models import Borrowing
+from library_service.db_router import ReplicaReadMixin
+from payments.models import Payment
+
+STATS_CACHE_KEY = "stats:{days}:{top}"
+
+
+class StatsParamsSerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=30)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class BorrowingsPerDaySerializer(serializers.Serializer):
+    date = serializers.DateField(source="borrow_date")
+    borrowings = serializers.IntegerField()
+
+
+class BorrowingCountsSerializer(serializers.Serializer):
+    active = serializers.IntegerField()
+    overdue = serializers.IntegerField()
+    overdue_rate = serializers.FloatField()
+
+
+class TopBookSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source="book_id")
+    title = serializers.CharField(source="book__title")
+    author = serializers.CharField(source="book__author")
+    borrowings = serializers.IntegerField()
+
+
+class RevenueSerializer(serializers.Serializer):
+    type_pay = serializers.CharField()
+    status = serializers.CharField()
+    payments = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CoverUtilizationSerializer(serializers.Serializer):
+    cover = serializers.CharField()
+    borrowed = serializers.IntegerField()
+    on_shelf = serializers.IntegerField()
+    utilization = serializers.FloatField()
+
+
+class StatsSerializer(serializers.Serializer):
+    generated_at = serializers.DateTimeField()
+    borrowings_per_day = BorrowingsPerDaySerializer(many=True)
+    borrowings = BorrowingCountsSerializer()
+    top_books = TopBookSerializer(many=True)
+    revenue = RevenueSerializer(many=True)
+    cover_utilization = CoverUtilizationSerializer(many=True)
+
+
+def ratio(part, whole) -> float:
+    return round(part / whole, 4) if whole else 0.0
+
+
+def borrowings_per_day(since: date):
+    return (
+        Borrowing.objects.filter(borrow_date__gte=since)
+        .values("borrow_date")
+        .annotate(borrowings=Count("id"))
+        .order_by("borrow_date")
+    )
+
+
+def borrowing_counts(today: date) -> dict:
+    counts = Borrowing.objects.filter(actual_return_date__isnull=True).aggregate(
+        active=Count("id"),
+        overdue=Count("id", filter=Q(expected_return_date__lt=today)),
+    )
+    counts["overdue_rate"] = ratio(counts["overdue"], counts["active"])
+    return counts
+
+
+def top_books(limit: int):
+    return (
+        Borrowing.objects.values("book_id", "book__title", "book__author")
+        .annotate(borrowings=Count("id"))
+        .order_by("-borrowings", "book_id")[:limit]
+    )
+
+
+def revenue():
+    return (
+        Payment.objects.values("type_pay", "status")
+        .annotate(payments=Count("id"), amount=Sum("money_to_pay"))
+        .order_by("type_pay", "status")
+    )
+
+
+def cover_utilization() -> list:
+    """
+    The copies out and on the shelf by cover. `Book.inventory` counts
+    the copies left, so utilization is borrowed / (borrowed + on shelf).
+    """
+    open_borrowings = Coalesce(
+        Subquery(
+            Borrowing.objects.filter(
+                book_id=OuterRef("pk"), actual_return_date__isnull=True
+            )
+            .order_by()
+            .values("book_id")
+            .annotate(count=Count("id"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+    rows = list(
+        Book.objects.order_by()
+        .annotate(open_borrowings=open_borrowings)
+        .values("cover")
+        .annotate(borrowed=Sum("open_borrowings"), on_shelf=Sum("inventory"))
+        .order_by("cover")
+    )
+    for row in rows:
+        row["utilization"] = ratio(row["borrowed"], row["borrowed"] + row["on_shelf"])
+    return rows
+
+
+def compute_stats(days: int, top: int) -> dict:
+    today = date.today()
+    return {
+        "generated_at": timezone.now(),
+        "borrowings_per_day": borrowings_per_day(today - timedelta(days=days - 1)),
+        "borrowings": borrowing_counts(today),
+        "top_books": top_books(top),
+        "revenue": revenue(),
+        "cover_utilization": cover_utilization(),
+    }
+
+
+class StatsView(ReplicaReadMixin, APIView):
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(parameters=[StatsParamsSerializer], responses=StatsSerializer)
+    def get(self, request):
+        """
+        Borrowings per day over the last ?days=, active and overdue
+        borrowings, the ?top= most borrowed books, payments by type and
+        status, and the utilization of the copies by cover.
+        """
+        params = StatsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        key = STATS_CACHE_KEY.format(**params.validated_data)
+        data = cache.get(key)
+        if data is None:
+            data = StatsSerializer(compute_stats(**params.validated_data)).data
+            cache.set(key, data, settings.STATS_CACHE_TIMEOUT)
+        return Response(data)
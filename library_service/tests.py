@@ -0,0 +1,339 @@
+import multiprocessing
+import re
+import tempfile
+from datetime import date, timedelta
+from unittest import skipIf
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from books.cache import bump_catalogue_version
+from books.models import Book
+from borrowing.models import Borrowing
+from library_service import metrics
+from library_service.metrics import external_call
+from payments.models import Payment
+
+BOOK_URL = reverse("books:book-list")
+BORROWING_URL = reverse("borrowings:borrowing-list")
+METRICS_URL = reverse("metrics")
+STATS_URL = reverse("stats")
+
+
+class InstrumentationMiddlewareTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(3):
+            Book.objects.create(
+                title=f"Book {i}", author="Test Author", inventory=1, daily_fee=1
+            )
+
+    @override_settings(METRICS_SAMPLE_RATE=1.0)
+    def test_sampled_request_reports_server_timing(self):
+        response = self.client.get(BOOK_URL, {"page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response["Server-Timing"]
+        self.assertIn("app;dur=", timing)
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertIn("serializer;dur=", timing)
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_request_only_reports_wall_time(self):
+        response = self.client.get(BOOK_URL)
+        self.assertRegex(response["Server-Timing"], r"^app;dur=[\d.]+$")
+
+    @override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_TOKEN="secret")
+    def test_metrics_endpoint_exposes_histograms(self):
+        self.client.get(BOOK_URL)
+        with external_call("stripe"):
+            pass
+
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn('view="books:book-list",method="GET",status="200"', body)
+        self.assertIn('http_request_db_queries_count{view="books:book-list"}', body)
+        self.assertIn('service="stripe"', body)
+
+    def test_metrics_add_up_the_worker_processes(self):
+        # two worker processes observe a call each, a third one is scraped
+        def worker():
+            with external_call("telegram"):
+                pass
+            metrics.store.flush()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            METRICS_DIR=directory
+        ):
+            before = metrics.render_metrics()
+            for _ in range(2):
+                process = multiprocessing.get_context("fork").Process(target=worker)
+                process.start()
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+            after = metrics.render_metrics()
+
+        count = re.compile(
+            r'external_call_duration_seconds_count\{service="telegram"\} (\d+)'
+        )
+        counted = [
+            int(m.group(1)) if (m := count.search(body)) else 0
+            for body in (before, after)
+        ]
+        self.assertEqual(counted[1] - counted[0], 2)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_endpoint_checks_token(self):
+        self.assertEqual(
+            self.client.get(METRICS_URL).status_code, status.HTTP_403_FORBIDDEN
+        )
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_metrics_endpoint_without_token_is_for_staff_only(self):
+        self.assertEqual(
+            self.client.get(METRICS_URL).status_code, status.HTTP_403_FORBIDDEN
+        )
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(
+            get_user_model().objects.create_user(
+                "admin@admin.com", "testpass", is_staff=True
+            )
+        )
+        self.assertEqual(self.client.get(METRICS_URL).status_code, status.HTTP_200_OK)
+
+
+@skipIf(
+    settings.DATABASES.get("replica", {}).get("TEST", {}).get("MIRROR"),
+    "the replica mirrors the primary in the tests",
+)
+@override_settings(READ_REPLICA="replica")
+class ReplicaRouterTest(TestCase):
+    """Both databases are separate in the tests, which shows where a query went."""
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        Book.objects.using("replica").create(
+            title="Replica Book", author="Test Author", inventory=1, daily_fee=1
+        )
+
+    def titles(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book["title"] for book in response.data["results"]]
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.titles(self.client.get(BOOK_URL)), ["Replica Book"])
+
+        response = self.client.post(
+            BOOK_URL,
+            {
+                "title": "Primary Book",
+                "author": "Test Author",
+                "cover": "HARD",
+                "inventory": 1,
+                "daily_fee": 1,
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Book.objects.using("default").filter(title="Primary Book"))
+        self.assertFalse(Book.objects.using("replica").filter(title="Primary Book"))
+
+        # read-after-write: the writer is pinned to the primary
+        self.assertEqual(self.titles(self.client.get(BOOK_URL)), ["Primary Book"])
+
+        cache.delete(f"db:pinned:{self.admin.pk}")
+        reader = (
+            get_user_model()
+            .objects.db_manager("replica")
+            .create_user("reader@test.com", "testpass")
+        )
+        Borrowing.objects.using("replica").create(
+            borrow_date=date.today(),
+            expected_return_date=date.today() + timedelta(days=5),
+            book=Book.objects.using("replica").get(),
+            user=reader,
+        )
+        response = self.client.get(BORROWING_URL)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_search_reads_the_replica_index(self):
+        response = self.client.get(BOOK_URL + "search/", {"q": "replica"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [book["title"] for book in response.data["results"]], ["Replica Book"]
+        )
+
+    async def test_async_writes_pin_the_writer(self):
+        book = await Book.objects.acreate(
+            title="Primary Book", author="Test Author", inventory=0, daily_fee=1
+        )
+        borrowing = await Borrowing.objects.acreate(
+            borrow_date=date.today(),
+            expected_return_date=date.today() + timedelta(days=5),
+            book=book,
+            user=self.admin,
+        )
+
+        response = await self.async_client.post(
+            f"{BORROWING_URL}async/{borrowing.id}/return/",
+            headers={"Authorize": f"Bearer {AccessToken.for_user(self.admin)}"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(await cache.aget(f"db:pinned:{self.admin.pk}"))
+
+    async def test_async_catalogue_reads_the_replica_unless_pinned(self):
+        await Book.objects.acreate(
+            title="Primary Book", author="Test Author", inventory=1, daily_fee=1
+        )
+        headers = {"Authorize": f"Bearer {AccessToken.for_user(self.admin)}"}
+
+        response = await self.async_client.get(BOOK_URL + "async/", headers=headers)
+        self.assertEqual(
+            [book["title"] for book in response.json()["results"]], ["Replica Book"]
+        )
+
+        await cache.aset(f"db:pinned:{self.admin.pk}", True)
+        await sync_to_async(bump_catalogue_version)()
+        response = await self.async_client.get(BOOK_URL + "async/", headers=headers)
+        self.assertEqual(
+            [book["title"] for book in response.json()["results"]], ["Primary Book"]
+        )
+
+    def test_without_replica_everything_reads_the_primary(self):
+        with override_settings(READ_REPLICA=""):
+            self.assertEqual(self.titles(self.client.get(BOOK_URL)), [])
+
+
+class StatsApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        self.client.force_authenticate(self.admin)
+        self.hard = Book.objects.create(
+            title="Hard Book",
+            author="Test Author",
+            cover="HARD",
+            inventory=1,
+            daily_fee=1,
+        )
+        self.soft = Book.objects.create(
+            title="Soft Book",
+            author="Test Author",
+            cover="SOFT",
+            inventory=3,
+            daily_fee=1,
+        )
+        today = date.today()
+        self.today = today
+        for book, borrowed_days_ago, due_in, returned in (
+            (self.hard, 0, 5, False),
+            (self.hard, 10, -2, False),
+            (self.hard, 20, -5, True),
+            (self.soft, 0, 3, False),
+        ):
+            borrowing = Borrowing.objects.create(
+                borrow_date=today - timedelta(days=borrowed_days_ago),
+                expected_return_date=today + timedelta(days=due_in),
+                actual_return_date=today if returned else None,
+                book=book,
+                user=self.admin,
+            )
+            Payment.objects.create(
+                status="PAID" if returned else "PENDING",
+                type_pay="PAYMENT",
+                borrowing=borrowing,
+                money_to_pay=2.5,
+            )
+
+    def test_stats_for_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(
+            get_user_model().objects.create_user("reader@test.com", "testpass")
+        )
+
+        self.assertEqual(client.get(STATS_URL).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stats_are_aggregated_per_metric(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(STATS_URL, {"days": 15, "top": 1})
+
+        self.assertEqual(
+            response.data["borrowings_per_day"],
+            [
+                {"date": str(self.today - timedelta(days=10)), "borrowings": 1},
+                {"date": str(self.today), "borrowings": 2},
+            ],
+        )
+        self.assertEqual(
+            response.data["borrowings"],
+            {"active": 3, "overdue": 1, "overdue_rate": 0.3333},
+        )
+        self.assertEqual(
+            response.data["top_books"],
+            [
+                {
+                    "id": self.hard.id,
+                    "title": "Hard Book",
+                    "author": "Test Author",
+                    "borrowings": 3,
+                }
+            ],
+        )
+        self.assertEqual(
+            response.data["revenue"],
+            [
+                {
+                    "type_pay": "PAYMENT",
+                    "status": "PAID",
+                    "payments": 1,
+                    "amount": "2.50",
+                },
+                {
+                    "type_pay": "PAYMENT",
+                    "status": "PENDING",
+                    "payments": 3,
+                    "amount": "7.50",
+                },
+            ],
+        )
+        self.assertEqual(
+            response.data["cover_utilization"],
+            [
+                {"cover": "HARD", "borrowed": 2, "on_shelf": 1, "utilization": 0.6667},
+                {"cover": "SOFT", "borrowed": 1, "on_shelf": 3, "utilization": 0.25},
+            ],
+        )
+
+    def test_stats_are_cached(self):
+        self.client.get(STATS_URL)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(STATS_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.client.get(STATS_URL, {"days": 0}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
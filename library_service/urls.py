@@ -19,6 +19,8 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.contrib import admin
 from django.urls import path, include
 
+from library_service.metrics import metrics_view
+from library_service.stats import StatsView
 from payments.views import payment_success, payment_cancel
 
 urlpatterns = [
@@ -27,8 +29,10 @@ urlpatterns = [
     path("api/users/", include("user.urls", namespace="user")),
     path("api/borrowings/", include("borrowing.urls", namespace="borrowings")),
     path("api/payments/", include("payments.urls", namespace="payments")),
+    path("api/stats/", StatsView.as_view(), name="stats"),
     path("success/", payment_success, name="payment_success"),
     path("cancel/", payment_cancel, name="payment_cancel"),
+    path("metrics", metrics_view, name="metrics"),
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path(
         "api/doc/swagger/",
@@ -0,0 +1,214 @@
+"""
+Read-only serializers over `.values()` rows for the large list endpoints.
+
+A `ValuesSerializer` declares its output as columns of the queryset
+instead of model fields. The selected fields are compiled once into
+plain functions from a row dict to the output value, so a page is
+rendered with no field binding, validation machinery or model
+instances. The output matches the ModelSerializer it stands in for:
+dates in ISO 8601 and decimals as quantized strings.
+
+`?fields=` selects the top-level fields of a list (a sparse fieldset);
+only the columns and related queries those fields need are run.
+"""
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+
+def as_is(value):
+    return value
+
+
+def iso_date(value):
+    return None if value is None else value.isoformat()
+
+
+def decimal_string(decimal_places: int):
+    """Format like a DRF DecimalField with COERCE_DECIMAL_TO_STRING."""
+    quantum = Decimal(1).scaleb(-decimal_places)
+
+    def to_representation(value):
+        if value is None:
+            return None
+        return "{:f}".format(Decimal(value).quantize(quantum, rounding=ROUND_HALF_UP))
+
+    return to_representation
+
+
+class Column:
+    """One column of the row, `source` being a values() lookup."""
+
+    def __init__(self, source: str, to_representation=as_is):
+        self.source = source
+        self.to_representation = to_representation
+
+    def compile(self, prefix: str):
+        key = prefix + self.source
+        to_representation = self.to_representation
+        if to_representation is as_is:
+            return [key], lambda row: row[key]
+        return [key], lambda row: to_representation(row[key])
+
+
+class Nested:
+    """An object whose columns are joined in through the `source` relation."""
+
+    def __init__(self, serializer_class, source: str):
+        self.serializer_class = serializer_class
+        self.source = source
+
+    def compile(self, prefix: str):
+        compiled = self.serializer_class.compile(
+            tuple(self.serializer_class.fields), prefix=f"{prefix}{self.source}__"
+        )
+        getters = compiled.getters
+        return compiled.columns, lambda row: {
+            name: getter(row) for name, getter in getters
+        }
+
+
+class Related:
+    """
+    The rows pointing at this one through the `related` foreign key,
+    read with one extra query per page and ordered by id.
+    """
+
+    def __init__(self, serializer_class, model, related: str):
+        self.serializer_class = serializer_class
+        self.model = model
+        self.related = related
+
+    def compile(self, prefix: str):
+        return ["id"], None
+
+
+class Compiled:
+    def __init__(self, columns, getters, related):
+        self.columns = columns
+        self.getters = getters
+        self.related = related
+
+
+class ValuesSerializer:
+    """
+    Base class: subclasses declare `fields`, a dict of output name to
+    Column, Nested or Related, in output order.
+    """
+
+    fields = {}
+
+    def __init__(self, instance, fields=None):
+        self.instance = instance
+        self.field_names = fields or tuple(self.fields)
+
+    @classmethod
+    def parse_fields(cls, value: str | None):
+        """Validate a `?fields=a,b` parameter; None selects every field."""
+        if not value:
+            return None
+        names = tuple(name.strip() for name in value.split(",") if name.strip())
+        unknown = [name for name in names if name not in cls.fields]
+        if unknown or not names:
+            raise serializers.ValidationError(
+                {
+                    "fields": f"Unknown fields: {unknown}, "
+                    f"choose from {list(cls.fields)}."
+                }
+            )
+        # keep the declared order, as the full representation does
+        return tuple(name for name in cls.fields if name in names)
+
+    @classmethod
+    def columns(cls, fields=None):
+        """The values() columns to select for these fields."""
+        return cls.compile(fields or tuple(cls.fields)).columns
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def compile(cls, fields: tuple, prefix: str = "") -> Compiled:
+        columns = {}
+        getters = []
+        related = []
+        for name in fields:
+            field = cls.fields[name]
+            field_columns, getter = field.compile(prefix)
+            columns.update(dict.fromkeys(field_columns))
+            if isinstance(field, Related):
+                related.append((name, field))
+            else:
+                getters.append((name, getter))
+        return Compiled(list(columns), getters, related)
+
+    def related_rows(self, field: Related, rows):
+        nested = field.serializer_class
+        grouped = defaultdict(list)
+        compiled = nested.compile(tuple(nested.fields))
+        queryset = (
+            field.model.objects.filter(
+                **{f"{field.related}__in": [row["id"] for row in rows]}
+            )
+            .order_by("id")
+            .values(field.related, *compiled.columns)
+        )
+        for related_row in queryset:
+            grouped[related_row[field.related]].append(
+                {name: getter(related_row) for name, getter in compiled.getters}
+            )
+        return grouped
+
+    @property
+    def data(self):
+        rows = list(self.instance)
+        compiled = self.compile(self.field_names)
+        related = {
+            name: self.related_rows(field, rows) if rows else {}
+            for name, field in compiled.related
+        }
+        getters = compiled.getters
+        data = []
+        for row in rows:
+            item = {name: getter(row) for name, getter in getters}
+            if related:
+                for name, grouped in related.items():
+                    item[name] = grouped.get(row["id"], [])
+                # back in declared order
+                item = {name: item[name] for name in self.field_names}
+            data.append(item)
+        return data
+
+
+class ValuesListMixin:
+    """
+    Render the list action of a viewset with its `values_serializer_class`
+    over a values() queryset, honouring `?fields=`.
+    """
+
+    values_serializer_class = None
+    fields_query_param = "fields"
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.values_serializer_class
+        fields = serializer_class.parse_fields(
+            request.query_params.get(self.fields_query_param)
+        )
+        columns = serializer_class.columns(fields)
+        # the paginator needs the id to build the cursor
+        if "id" not in columns:
+            columns = ["id", *columns]
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .select_related(None)
+            .prefetch_related(None)
+            .values(*columns)
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                serializer_class(page, fields=fields).data
+            )
+        return Response(serializer_class(queryset, fields=fields).data)
@@ -1,6 +1,9 @@
 from django.contrib import admin
 
-from payments.models import Payment
+from payments.models import CheckoutSession, FineAccrual, Payment, StripeEvent
 
 
+admin.site.register(CheckoutSession)
 admin.site.register(Payment)
+admin.site.register(StripeEvent)
+admin.site.register(FineAccrual)
@@ -0,0 +1,126 @@
+"""
+Set-based computation of the fines accrued by open overdue borrowings.
+
+The fine is daily_fee * FINE_MULTIPLIER * overdue days, the same amount
+`calculate_money_to_pay` charges when the book is returned that day.
+"""
+
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db.models import (
+    DateField,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+)
+from django.utils import timezone
+
+from borrowing.models import Borrowing
+from payments.models import FineAccrual
+
+ACCRUAL_BATCH_SIZE = 5000
+AMOUNT_FIELD = DecimalField(max_digits=9, decimal_places=2)
+
+
+class DaysBetween(Func):
+    """Number of days from the second date expression to the first one."""
+
+    function = "DATEDIFF"
+    arity = 2
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="CAST(julianday(%(expressions)s) AS INTEGER)",
+            arg_joiner=") - julianday(",
+            **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # subtracting two dates gives an integer number of days
+        return self.as_sql(
+            compiler,
+            connection,
+            template="(%(expressions)s)",
+            arg_joiner=" - ",
+            **extra_context,
+        )
+
+
+def overdue_borrowings(today: date):
+    """Open overdue borrowings annotated with their overdue days and fine."""
+    days = DaysBetween(Value(today, DateField()), F("expected_return_date"))
+    return (
+        Borrowing.objects.filter(
+            actual_return_date__isnull=True, expected_return_date__lt=today
+        )
+        .annotate(overdue_days=days)
+        .annotate(
+            fine=ExpressionWrapper(
+                F("overdue_days") * F("book__daily_fee") * settings.FINE_MULTIPLIER,
+                output_field=AMOUNT_FIELD,
+            )
+        )
+    )
+
+
+def refresh_fine_accruals(today: date = None) -> dict:
+    """
+    Bring the FineAccrual table up to date in three set-based steps:
+
+    - drop the rows of borrowings which were returned (or extended),
+    - update the rows whose day count or fee changed since the last run,
+    - insert the rows of borrowings which became overdue, in batches.
+    """
+    today = today or datetime.today().date()
+    now = timezone.now()
+    overdue = overdue_borrowings(today)
+
+    deleted, _ = FineAccrual.objects.filter(
+        Q(borrowing__actual_return_date__isnull=False)
+        | Q(borrowing__expected_return_date__gte=today)
+    ).delete()
+
+    current = overdue.filter(pk=OuterRef("borrowing"))
+    updated = (
+        FineAccrual.objects.annotate(
+            current_days=Subquery(current.values("overdue_days")),
+            current_fine=Subquery(current.values("fine"), output_field=AMOUNT_FIELD),
+        )
+        .exclude(overdue_days=F("current_days"), amount=F("current_fine"))
+        .update(
+            overdue_days=Subquery(current.values("overdue_days")),
+            amount=Subquery(current.values("fine"), output_field=AMOUNT_FIELD),
+            updated_at=now,
+        )
+    )
+
+    missing = overdue.filter(fine_accrual__isnull=True).order_by("pk")
+    created = 0
+    while True:
+        rows = list(
+            missing.values_list("pk", "overdue_days", "fine")[:ACCRUAL_BATCH_SIZE]
+        )
+        if not rows:
+            break
+        FineAccrual.objects.bulk_create(
+            FineAccrual(
+                borrowing_id=borrowing_id,
+                overdue_days=overdue_days,
+                amount=fine,
+                updated_at=now,
+            )
+            for borrowing_id, overdue_days, fine in rows
+        )
+        created += len(rows)
+
+    return {"created": created, "updated": updated, "deleted": deleted}
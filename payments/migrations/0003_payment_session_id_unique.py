@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+def empty_session_id_to_null(apps, schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    Payment.objects.using(schema_editor.connection.alias).filter(session_id="").update(
+        session_id=None
+    )
+
+
+def null_session_id_to_empty(apps, schema_editor):
+    Payment = apps.get_model("payments", "Payment")
+    Payment.objects.using(schema_editor.connection.alias).filter(
+        session_id=None
+    ).update(session_id="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0002_borrowing_open_indexes"),
+        ("payments", "0002_payment_session_blank"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="session_id",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(empty_session_id_to_null, null_session_id_to_empty),
+        migrations.AddConstraint(
+            model_name="payment",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("session_id__isnull", False)),
+                fields=("session_id",),
+                name="payment_session_id_unique",
+            ),
+        ),
+    ]
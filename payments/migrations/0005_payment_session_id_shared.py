@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0002_borrowing_open_indexes"),
+        ("payments", "0004_stripe_event"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="payment",
+            name="payment_session_id_unique",
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("session_id__isnull", False)),
+                fields=["session_id"],
+                name="payment_session_id_idx",
+            ),
+        ),
+    ]
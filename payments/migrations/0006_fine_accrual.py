@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0002_borrowing_open_indexes"),
+        ("payments", "0005_payment_session_id_shared"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FineAccrual",
+            fields=[
+                (
+                    "borrowing",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="fine_accrual",
+                        serialize=False,
+                        to="borrowing.borrowing",
+                    ),
+                ),
+                ("overdue_days", models.PositiveIntegerField()),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=9)),
+                ("updated_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0003_hold"),
+        ("payments", "0006_fine_accrual"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="created_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "pending"),
+                    ("PAID", "paid"),
+                    ("EXPIRED", "expired"),
+                ],
+                max_length=7,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["created_at"],
+                name="payment_pending_created_idx",
+            ),
+        ),
+    ]
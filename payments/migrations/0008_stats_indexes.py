@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("borrowing", "0004_stats_indexes"),
+        ("payments", "0007_payment_expiry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["type_pay", "status", "money_to_pay"],
+                name="payment_revenue_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,84 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def sessions_to_rows(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    CheckoutSession = apps.get_model("payments", "CheckoutSession")
+    Payment = apps.get_model("payments", "Payment")
+    session_urls = dict(
+        Payment.objects.using(db_alias)
+        .filter(session_id__isnull=False)
+        .exclude(session_id="")
+        .order_by("session_id", "id")
+        .values_list("session_id", "session_url")
+    )
+    CheckoutSession.objects.using(db_alias).bulk_create(
+        CheckoutSession(session_id=session_id, session_url=session_url)
+        for session_id, session_url in session_urls.items()
+    )
+    for session in CheckoutSession.objects.using(db_alias).iterator():
+        Payment.objects.using(db_alias).filter(session_id=session.session_id).update(
+            checkout_session=session
+        )
+
+
+def rows_to_sessions(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    CheckoutSession = apps.get_model("payments", "CheckoutSession")
+    Payment = apps.get_model("payments", "Payment")
+    for session in CheckoutSession.objects.using(db_alias).iterator():
+        Payment.objects.using(db_alias).filter(checkout_session=session).update(
+            session_id=session.session_id, session_url=session.session_url
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0008_stats_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CheckoutSession",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("session_id", models.CharField(max_length=100, unique=True)),
+                ("session_url", models.URLField(max_length=500)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="checkout_session",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="payments",
+                to="payments.checkoutsession",
+            ),
+        ),
+        migrations.RunPython(sessions_to_rows, rows_to_sessions),
+        migrations.RemoveIndex(
+            model_name="payment",
+            name="payment_session_id_idx",
+        ),
+        migrations.RemoveField(
+            model_name="payment",
+            name="session_id",
+        ),
+        migrations.RemoveField(
+            model_name="payment",
+            name="session_url",
+        ),
+    ]
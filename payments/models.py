@@ -3,10 +3,26 @@ from django.db import models
 from borrowing.models import Borrowing
 
 
+class CheckoutSession(models.Model):
+    """
+    A Stripe checkout session. A bulk checkout pays all of its
+    borrowings with one session, so several payments can point to it.
+    """
+
+    session_id = models.CharField(max_length=100, unique=True)
+    session_url = models.URLField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.session_id
+
+
 class Payment(models.Model):
     STATUS_CHOICES = (
         ("PENDING", "pending"),
         ("PAID", "paid"),
+        # the checkout session expired unpaid
+        ("EXPIRED", "expired"),
     )
     TYPE_CHOICES = (
         ("PAYMENT", "payment"),
@@ -17,12 +33,84 @@ class Payment(models.Model):
     borrowing = models.ForeignKey(
         Borrowing, on_delete=models.CASCADE, related_name="payments"
     )
-    session_url = models.URLField()
-    session_id = models.CharField(max_length=100)
+    # empty until the Stripe checkout session has been created
+    checkout_session = models.ForeignKey(
+        CheckoutSession,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="payments",
+    )
     money_to_pay = models.DecimalField(decimal_places=2, max_digits=7)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # stale payments for `expire_pending_payments`
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(status="PENDING"),
+                name="payment_pending_created_idx",
+            ),
+            # admin stats: revenue by type and status, read from the index
+            models.Index(
+                fields=["type_pay", "status", "money_to_pay"],
+                name="payment_revenue_idx",
+            ),
+        ]
 
     def __str__(self):
         return (
             f"Borrowing id: {self.borrowing.id}, amount: {self.money_to_pay}, "
             f"{self.type_pay}/{self.status}"
         )
+
+
+class StripeEvent(models.Model):
+    """
+    A Stripe webhook event waiting to be applied to the payments.
+
+    The unique event_id makes redelivered events no-ops, and rows with
+    no processed_at form the queue drained by `apply_stripe_events`.
+    """
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    session_id = models.CharField(max_length=100, blank=True)
+    payment_status = models.CharField(max_length=20, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="stripe_event_unprocessed_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
+
+
+class FineAccrual(models.Model):
+    """
+    The fine accrued so far by an open overdue borrowing.
+
+    Refreshed by the `accrue_fines` task; the row goes away once the
+    borrowing is returned and its fine becomes a Payment.
+    """
+
+    borrowing = models.OneToOneField(
+        Borrowing,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="fine_accrual",
+    )
+    overdue_days = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=9, decimal_places=2)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Borrowing id: {self.borrowing_id}, accrued fine: {self.amount}"
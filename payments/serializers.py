@@ -1,10 +1,41 @@
 from rest_framework import serializers
 
-from borrowing.serializers import BorrowingSerializer, BorrowingInPaymentRetrieveSerializer
+from books.serializers import BookSerializer
+from borrowing.models import Borrowing
+from library_service.values_serializers import Column, ValuesSerializer, decimal_string
 from payments.models import Payment
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class BorrowingInPaymentRetrieveSerializer(serializers.ModelSerializer):
+    book = BookSerializer(read_only=True)
+
+    class Meta:
+        model = Borrowing
+        fields = (
+            "id",
+            "borrow_date",
+            "expected_return_date",
+            "actual_return_date",
+            "book",
+            "user",
+        )
+
+
+def or_blank(value):
+    return value or ""
+
+
+class CheckoutSessionFieldsMixin(serializers.Serializer):
+    # blank / null until the Stripe checkout session has been created
+    session_url = serializers.CharField(
+        source="checkout_session.session_url", read_only=True, default=""
+    )
+    session_id = serializers.CharField(
+        source="checkout_session.session_id", read_only=True, allow_null=True
+    )
+
+
+class PaymentSerializer(CheckoutSessionFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = (
@@ -18,6 +49,20 @@ class PaymentSerializer(serializers.ModelSerializer):
         )
 
 
+class PaymentListSerializer(ValuesSerializer):
+    """PaymentSerializer over values() rows, for the list endpoint."""
+
+    fields = {
+        "id": Column("id"),
+        "status": Column("status"),
+        "type_pay": Column("type_pay"),
+        "borrowing": Column("borrowing_id"),
+        "session_url": Column("checkout_session__session_url", or_blank),
+        "session_id": Column("checkout_session__session_id"),
+        "money_to_pay": Column("money_to_pay", decimal_string(2)),
+    }
+
+
 class PaymentRetrieveSerializer(PaymentSerializer):
     borrowing = BorrowingInPaymentRetrieveSerializer(read_only=True)
 
@@ -31,7 +76,9 @@ class PaymentInBorrowingListSerializer(serializers.ModelSerializer):
         )
 
 
-class PaymentInBorrowingRetrieveSerializer(serializers.ModelSerializer):
+class PaymentInBorrowingRetrieveSerializer(
+    CheckoutSessionFieldsMixin, serializers.ModelSerializer
+):
     class Meta:
         model = Payment
         fields = (
@@ -42,3 +89,10 @@ class PaymentInBorrowingRetrieveSerializer(serializers.ModelSerializer):
             "session_id",
             "money_to_pay",
         )
+
+
+class PaymentInBorrowingListValuesSerializer(ValuesSerializer):
+    fields = {
+        "id": Column("id"),
+        "status": Column("status"),
+    }
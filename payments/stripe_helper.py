@@ -1,45 +1,262 @@
+import logging
+from collections import Counter
+from decimal import Decimal
+from functools import partial
+
 import stripe
+from django.conf import settings
+from django.db import transaction
 from django.urls import reverse
+from stripe import InvalidRequestError, StripeError
 
-from library_service import settings
+from library_service.metrics import external_call
+from payments.models import CheckoutSession, Payment
+from user.summary import record_payments
 
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+logger = logging.getLogger(__name__)
+
+STRIPE_MAX_LINE_ITEMS = 100
+STRIPE_LIST_LIMIT = 100
+
+
+def construct_webhook_event(payload: bytes, signature: str):
+    """Parse a webhook payload, checking its Stripe-Signature header."""
+    return stripe.Webhook.construct_event(
+        payload, signature, settings.STRIPE_WEBHOOK_SECRET
+    )
 
-def create_stripe_payment_session(request, borrowing, fine_multiplier: int = None):
-    success_url = request.build_absolute_uri(reverse("payment_success"))
-    cancel_url = request.build_absolute_uri(reverse("payment_cancel"))
 
+def calculate_money_to_pay(borrowing, fine_multiplier: int = None) -> int:
+    """Return the amount to charge for the borrowing, in cents."""
     if fine_multiplier:
         overdue_days = (
             borrowing.actual_return_date - borrowing.expected_return_date
         ).days
-        money_to_pay = int(
-            borrowing.book.daily_fee * fine_multiplier * overdue_days * 100
-        )
-    else:
-        using_days = (borrowing.expected_return_date - borrowing.borrow_date).days
-        money_to_pay = int(borrowing.book.daily_fee * using_days * 100)
+        return int(borrowing.book.daily_fee * fine_multiplier * overdue_days * 100)
+    using_days = (borrowing.expected_return_date - borrowing.borrow_date).days
+    return int(borrowing.book.daily_fee * using_days * 100)
 
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
+
+def stripe_line_items(payments) -> list:
+    """
+    One line item per payment. Checkout sessions take at most
+    STRIPE_MAX_LINE_ITEMS of them, so larger checkouts are grouped
+    into one line item per amount instead.
+    """
+    if len(payments) <= STRIPE_MAX_LINE_ITEMS:
+        return [
             {
                 "price_data": {
                     "currency": "usd",
                     "product_data": {
-                        "name": f"Borrowing book: '{borrowing.book.title}'",
+                        "name": f"Borrowing book: '{payment.borrowing.book.title}'",
                     },
-                    "unit_amount": money_to_pay,  # in cents
+                    "unit_amount": int(payment.money_to_pay * 100),  # in cents
                 },
                 "quantity": 1,
             }
-        ],
-        mode="payment",
-        success_url=success_url + "?session_id={CHECKOUT_SESSION_ID}",
-        cancel_url=cancel_url,
-        metadata={"borrowing_id": borrowing.id},
+            for payment in payments
+        ]
+    quantities = Counter(int(payment.money_to_pay * 100) for payment in payments)
+    return [
+        {
+            "price_data": {
+                "currency": "usd",
+                "product_data": {"name": f"Borrowing {quantity} book(s)"},
+                "unit_amount": unit_amount,
+            },
+            "quantity": quantity,
+        }
+        for unit_amount, quantity in sorted(quantities.items())
+    ]
+
+
+def checkout_session_params(payments, success_url: str, cancel_url: str) -> dict:
+    return {
+        "payment_method_types": ["card"],
+        "line_items": stripe_line_items(payments),
+        "mode": "payment",
+        "success_url": success_url + "?session_id={CHECKOUT_SESSION_ID}",
+        "cancel_url": cancel_url,
+        "metadata": {
+            "borrowing_id": payments[0].borrowing_id,
+            "borrowing_count": len(payments),
+        },
+    }
+
+
+def create_stripe_payment_session(payments, success_url: str, cancel_url: str):
+    """Create one Stripe checkout session covering all the payments."""
+    with external_call("stripe"):
+        session = stripe.checkout.Session.create(
+            **checkout_session_params(payments, success_url, cancel_url)
+        )
+
+    return session.id, session.url
+
+
+async def create_stripe_payment_session_async(
+    payments, success_url: str, cancel_url: str
+):
+    """`create_stripe_payment_session` on Stripe's async (httpx) client."""
+    with external_call("stripe"):
+        session = await stripe.checkout.Session.create_async(
+            **checkout_session_params(payments, success_url, cancel_url)
+        )
+
+    return session.id, session.url
+
+
+def checkout_session_statuses(session_ids, created_from, created_to) -> dict:
+    """
+    The (status, payment_status) of the checkout sessions, by id.
+
+    Stripe cannot list sessions by id, so the sessions created between
+    the two datetimes are paged through with the list API, STRIPE_LIST_LIMIT
+    at a time, until all the wanted ones have been seen. The ones created
+    outside the window (before a payment was recorded, or by a late retry)
+    are then retrieved one by one; sessions Stripe does not know are left
+    out.
+    """
+    wanted = set(session_ids)
+    statuses = {}
+    if not wanted:
+        return statuses
+    with external_call("stripe"):
+        sessions = stripe.checkout.Session.list(
+            created={
+                "gte": int(created_from.timestamp()),
+                "lte": int(created_to.timestamp()),
+            },
+            limit=STRIPE_LIST_LIMIT,
+        )
+        for session in sessions.auto_paging_iter():
+            if session.id in wanted:
+                statuses[session.id] = (session.status, session.payment_status)
+                if len(statuses) == len(wanted):
+                    break
+        for session_id in wanted - statuses.keys():
+            try:
+                session = stripe.checkout.Session.retrieve(session_id)
+            except InvalidRequestError:
+                logger.warning("Stripe has no checkout session %s", session_id)
+                continue
+            statuses[session_id] = (session.status, session.payment_status)
+    return statuses
+
+
+def attach_stripe_payment_session(
+    payment_ids: list, success_url: str, cancel_url: str
+) -> None:
+    """
+    Create the Stripe checkout session for PENDING payment placeholders.
+
+    Runs after the borrowing transaction has committed, so the network
+    round-trip to Stripe never holds database locks. If Stripe fails,
+    the placeholders stay PENDING without a session.
+    """
+    payments = list(
+        Payment.objects.select_related("borrowing__book")
+        .filter(pk__in=payment_ids)
+        .order_by("id")
+    )
+    try:
+        session_id, session_url = create_stripe_payment_session(
+            payments, success_url, cancel_url
+        )
+    except StripeError:
+        logger.exception("Cannot create Stripe session for payments %s", payment_ids)
+        return
+    session = CheckoutSession.objects.create(
+        session_id=session_id, session_url=session_url
+    )
+    Payment.objects.filter(pk__in=payment_ids).update(checkout_session=session)
+
+
+async def attach_stripe_payment_session_async(
+    payment_ids: list, success_url: str, cancel_url: str
+) -> None:
+    """`attach_stripe_payment_session` for the async views."""
+    payments = [
+        payment
+        async for payment in Payment.objects.select_related("borrowing__book")
+        .filter(pk__in=payment_ids)
+        .order_by("id")
+    ]
+    try:
+        session_id, session_url = await create_stripe_payment_session_async(
+            payments, success_url, cancel_url
+        )
+    except StripeError:
+        logger.exception("Cannot create Stripe session for payments %s", payment_ids)
+        return
+    session = await CheckoutSession.objects.acreate(
+        session_id=session_id, session_url=session_url
+    )
+    await Payment.objects.filter(pk__in=payment_ids).aupdate(checkout_session=session)
+
+
+def payment_urls(request) -> tuple:
+    return (
+        request.build_absolute_uri(reverse("payment_success")),
+        request.build_absolute_uri(reverse("payment_cancel")),
+    )
+
+
+def attach_session_on_commit(request, payment_ids: list) -> None:
+    transaction.on_commit(
+        partial(attach_stripe_payment_session, payment_ids, *payment_urls(request))
+    )
+
+
+def record_pending_payment(
+    borrowing, type_pay: str, fine_multiplier: int = None
+) -> Payment:
+    """Record a PENDING payment without a checkout session for the borrowing."""
+    money_to_pay = calculate_money_to_pay(borrowing, fine_multiplier)
+    payment = Payment.objects.create(
+        status="PENDING",
+        type_pay=type_pay,
+        borrowing=borrowing,
+        money_to_pay=Decimal(money_to_pay) / 100,
     )
+    record_payments([(borrowing.user_id, type_pay, payment.money_to_pay)])
+    return payment
+
 
-    return session.id, session.url, money_to_pay / 100
+def create_pending_payment(
+    request, borrowing, type_pay: str, fine_multiplier: int = None
+) -> Payment:
+    """
+    Record a PENDING payment for the borrowing inside the current transaction
+    and create its Stripe checkout session once the transaction commits.
+    """
+    payment = record_pending_payment(borrowing, type_pay, fine_multiplier)
+    attach_session_on_commit(request, [payment.id])
+    return payment
+
+
+def create_pending_payments(request, borrowings, type_pay: str) -> list:
+    """
+    Record a PENDING payment for each of the borrowings with one INSERT
+    and create a single Stripe checkout session for all of them once the
+    transaction commits.
+    """
+    payments = Payment.objects.bulk_create(
+        Payment(
+            status="PENDING",
+            type_pay=type_pay,
+            borrowing=borrowing,
+            money_to_pay=Decimal(calculate_money_to_pay(borrowing)) / 100,
+        )
+        for borrowing in borrowings
+    )
+    record_payments(
+        (payment.borrowing.user_id, type_pay, payment.money_to_pay)
+        for payment in payments
+    )
+    attach_session_on_commit(request, [payment.id for payment in payments])
+    return payments
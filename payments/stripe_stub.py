@@ -0,0 +1,98 @@
+"""
+In-process stand-in for the `stripe` module.
+
+Used by the tests (and anything else that must not talk to Stripe) through
+`mock.patch("payments.stripe_helper.stripe", StubStripe())`.
+"""
+
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+import stripe
+from django.db import connection
+
+
+class StubCheckoutSession:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **kwargs):
+        self.client.calls.append(
+            {"kwargs": kwargs, "in_atomic_block": connection.in_atomic_block}
+        )
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        return self.session()
+
+    async def create_async(self, **kwargs):
+        self.client.calls.append({"kwargs": kwargs, "in_atomic_block": False})
+        if self.client.latency:
+            await asyncio.sleep(self.client.latency)
+        return self.session()
+
+    def session(self):
+        session_id = f"cs_test_{next(self.client.counter)}"
+        session = SimpleNamespace(
+            id=session_id,
+            url=f"https://checkout.stripe.test/pay/{session_id}",
+            created=int(time.time()),
+            status="open",
+            payment_status="unpaid",
+        )
+        self.client.sessions[session_id] = session
+        return session
+
+    def list(self, created=None, limit=10, **kwargs):
+        """The sessions created in the `created` range, newest first."""
+        self.client.list_calls.append({"created": created, "limit": limit})
+        created = created or {}
+        sessions = sorted(
+            (
+                session
+                for session in self.client.sessions.values()
+                if session.created >= created.get("gte", 0)
+                and session.created <= created.get("lte", float("inf"))
+            ),
+            key=lambda session: session.created,
+            reverse=True,
+        )
+        return StubListObject(sessions, limit)
+
+    def retrieve(self, session_id):
+        self.client.retrieve_calls.append(session_id)
+        try:
+            return self.client.sessions[session_id]
+        except KeyError:
+            raise stripe.InvalidRequestError(
+                f"No such checkout.session: '{session_id}'", param="id"
+            )
+
+
+class StubListObject:
+    """A page of a Stripe list, paged through `limit` sessions at a time."""
+
+    def __init__(self, items, limit):
+        self.items = items
+        self.limit = limit
+        self.data = items[:limit]
+        self.pages = 1
+
+    def auto_paging_iter(self):
+        for start in range(0, len(self.items), self.limit):
+            self.pages = start // self.limit + 1
+            yield from self.items[start : start + self.limit]
+
+
+class StubStripe:
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls = []
+        self.list_calls = []
+        self.retrieve_calls = []
+        self.sessions = {}
+        self.counter = itertools.count(1)
+        self.checkout = SimpleNamespace(Session=StubCheckoutSession(self))
+        # signatures are checked locally, the real implementation will do
+        self.Webhook = stripe.Webhook
@@ -0,0 +1,238 @@
+import logging
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from stripe import StripeError
+
+from borrowing.models import Borrowing
+from borrowing.services import return_borrowing
+from payments.fines import refresh_fine_accruals
+from payments.models import Payment, StripeEvent
+from payments.stripe_helper import STRIPE_LIST_LIMIT, checkout_session_statuses
+from user.summary import record_paid, record_payments
+
+logger = logging.getLogger(__name__)
+
+STRIPE_EVENT_BATCH_SIZE = 1000
+# a checkout session is created right after its payments are committed
+SESSION_CREATED_SLACK = timedelta(hours=1)
+APPLY_SCHEDULED_KEY = "payments:apply-stripe-events-scheduled"
+PAID_EVENT_TYPES = {
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+}
+
+
+def schedule_stripe_event_processing() -> None:
+    """
+    Make sure `apply_stripe_events` runs shortly.
+
+    Only one run is queued per STRIPE_WEBHOOK_BATCH_DELAY window, so a burst
+    of webhook calls is applied by a handful of batched runs.
+    """
+    delay = settings.STRIPE_WEBHOOK_BATCH_DELAY
+    if cache.add(APPLY_SCHEDULED_KEY, True, timeout=delay * 10):
+        apply_stripe_events.apply_async(countdown=delay)
+
+
+def new_payment_status(event: StripeEvent) -> str | None:
+    if event.type in PAID_EVENT_TYPES and event.payment_status == "paid":
+        return "PAID"
+    return None
+
+
+@shared_task(ignore_result=True)
+def apply_stripe_events():
+    """Apply the queued webhook events to their payments in batches."""
+    cache.delete(APPLY_SCHEDULED_KEY)
+    events_count = payments_count = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                StripeEvent.objects.filter(processed_at__isnull=True).order_by("id")[
+                    :STRIPE_EVENT_BATCH_SIZE
+                ]
+            )
+            if not events:
+                break
+            statuses = {
+                event.session_id: status
+                for event in events
+                if (status := new_payment_status(event))
+            }
+            payments = list(
+                Payment.objects.filter(
+                    checkout_session__session_id__in=statuses, status="PENDING"
+                )
+                .select_related("borrowing", "checkout_session")
+                .select_for_update(of=("self",))
+                .only(
+                    "id",
+                    "status",
+                    "type_pay",
+                    "money_to_pay",
+                    "borrowing__user",
+                    "checkout_session__session_id",
+                )
+            )
+            for payment in payments:
+                payment.status = statuses[payment.checkout_session.session_id]
+            Payment.objects.bulk_update(payments, ["status"])
+            record_paid(
+                (payment.borrowing.user_id, payment.type_pay, payment.money_to_pay)
+                for payment in payments
+                if payment.status == "PAID"
+            )
+            StripeEvent.objects.filter(pk__in=[event.id for event in events]).update(
+                processed_at=timezone.now()
+            )
+        events_count += len(events)
+        payments_count += len(payments)
+
+    logger.info("Applied %s Stripe events to %s payments", events_count, payments_count)
+
+
+@shared_task(ignore_result=True)
+def accrue_fines():
+    """Refresh the fines accrued by the open overdue borrowings."""
+    with transaction.atomic():
+        counts = refresh_fine_accruals()
+    logger.info("Fine accruals refreshed: %s", counts)
+
+
+def stale_payment_status(session_id, session) -> str | None:
+    """
+    The status of a stale PENDING payment given the (status,
+    payment_status) of its checkout session, None to leave it PENDING.
+
+    Only a session Stripe reports as expired, or none ever created,
+    expires the payment; one Stripe could not tell about is kept PENDING.
+    """
+    if session_id is None:
+        return "EXPIRED"
+    if session is None:
+        return None
+    status, payment_status = session
+    if payment_status in ("paid", "no_payment_required"):
+        return "PAID"
+    if status == "expired":
+        return "EXPIRED"
+    return None
+
+
+def settle_stale_payments(batch) -> dict:
+    """
+    Check the checkout sessions of a batch of stale payments with Stripe
+    and mark the payments PAID or EXPIRED in one transaction.
+    """
+    sessions = checkout_session_statuses(
+        {
+            payment["checkout_session__session_id"]
+            for payment in batch
+            if payment["checkout_session__session_id"]
+        },
+        min(payment["created_at"] for payment in batch),
+        max(payment["created_at"] for payment in batch) + SESSION_CREATED_SLACK,
+    )
+    counts = {"paid": 0, "expired": 0, "released": 0}
+    with transaction.atomic():
+        # payments settled by a webhook meanwhile are left alone
+        payments = list(
+            Payment.objects.filter(
+                pk__in=[payment["id"] for payment in batch], status="PENDING"
+            )
+            .select_related("borrowing", "checkout_session")
+            .select_for_update(of=("self",))
+            .only(
+                "id",
+                "status",
+                "type_pay",
+                "money_to_pay",
+                "borrowing__user",
+                "checkout_session__session_id",
+            )
+        )
+        settled = []
+        for payment in payments:
+            session_id = (
+                payment.checkout_session and payment.checkout_session.session_id
+            )
+            status = stale_payment_status(session_id, sessions.get(session_id))
+            if status:
+                payment.status = status
+                settled.append(payment)
+                counts[status.lower()] += 1
+        Payment.objects.bulk_update(settled, ["status"])
+        record_payments(
+            (
+                (payment.borrowing.user_id, payment.type_pay, payment.money_to_pay)
+                for payment in settled
+            ),
+            sign=-1,
+        )
+        if settings.EXPIRED_PAYMENT_RELEASES_BOOK:
+            counts["released"] = release_unpaid_borrowings(
+                payment.borrowing_id
+                for payment in settled
+                if payment.status == "EXPIRED" and payment.type_pay == "PAYMENT"
+            )
+    return counts
+
+
+def release_unpaid_borrowings(borrowing_ids) -> int:
+    """
+    Close the open borrowings nothing was paid for, putting their copies
+    back on the shelf (or aside for a hold). Returns their number.
+    """
+    borrowings = (
+        Borrowing.objects.filter(
+            pk__in=list(borrowing_ids), actual_return_date__isnull=True
+        )
+        .exclude(payments__status="PAID")
+        .only("id", "book_id", "user_id", "expected_return_date")
+    )
+    released = 0
+    for borrowing in borrowings:
+        return_borrowing(borrowing)
+        released += 1
+    return released
+
+
+@shared_task
+def expire_pending_payments():
+    """
+    Settle the PENDING payments older than PENDING_PAYMENT_EXPIRY_HOURS,
+    whose checkout sessions have expired or been paid by now.
+
+    The stale payments are read with one range query on the partial
+    PENDING index and checked with Stripe STRIPE_LIST_LIMIT at a time.
+    A batch Stripe cannot be reached for stays PENDING until the next run.
+    Returns the counts and the duration.
+    """
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(hours=settings.PENDING_PAYMENT_EXPIRY_HOURS)
+    stale = list(
+        Payment.objects.filter(status="PENDING", created_at__lt=cutoff)
+        .order_by("created_at")
+        .values("id", "checkout_session__session_id", "created_at")
+    )
+    counts = {"stale": len(stale), "paid": 0, "expired": 0, "released": 0, "failed": 0}
+    for start in range(0, len(stale), STRIPE_LIST_LIMIT):
+        batch = stale[start : start + STRIPE_LIST_LIMIT]
+        try:
+            batch_counts = settle_stale_payments(batch)
+        except StripeError:
+            logger.exception("Cannot check %s stale payments with Stripe", len(batch))
+            counts["failed"] += len(batch)
+            continue
+        for name, count in batch_counts.items():
+            counts[name] += count
+
+    counts["seconds"] = round(time.monotonic() - started, 3)
+    logger.info("Stale pending payments settled: %s", counts)
+    return counts
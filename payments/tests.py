@@ -1,17 +1,41 @@
+import hashlib
+import hmac
+import json
+import time
 from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
 from django.contrib.auth import get_user_model
-
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 
 from books.models import Book
 from borrowing.models import Borrowing
-from payments.models import Payment
+from payments.fines import refresh_fine_accruals
+from payments.models import CheckoutSession, FineAccrual, Payment, StripeEvent
+from payments.serializers import PaymentSerializer
+from payments.stripe_helper import record_pending_payment
+from payments.stripe_stub import StubStripe
+from payments.tasks import apply_stripe_events, expire_pending_payments
+from user.models import UserSummary
 
 PAYMENTS_URL = reverse("payments:payment-list")
+WEBHOOK_URL = reverse("payments:stripe-webhook")
+WEBHOOK_SECRET = "whsec_test"
+
+
+def sign_payload(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
 
 
 class UnAuthenticatedPaymentApiTest(TestCase):
@@ -47,11 +71,24 @@ class AuthenticatedPaymentApiTest(TestCase):
             status="PAID",
             type_pay="PAYMENT",
             borrowing=self.borrowing,
-            session_url="https://example.com",
-            session_id="TEST123session_id",
+            checkout_session=CheckoutSession.objects.create(
+                session_id="TEST123session_id", session_url="https://example.com"
+            ),
             money_to_pay=3.00,
         )
 
+    def test_list_renders_the_same_bytes_as_the_model_serializer(self):
+        response = self.client.get(PAYMENTS_URL)
+        self.assertEqual(
+            JSONRenderer().render(response.data["results"]),
+            JSONRenderer().render(PaymentSerializer([self.payment], many=True).data),
+        )
+
+        response = self.client.get(PAYMENTS_URL, {"fields": "status,money_to_pay"})
+        self.assertEqual(
+            response.data["results"], [{"status": "PAID", "money_to_pay": "3.00"}]
+        )
+
     def test_list_and_detail_payment_only_own(self):
         other_client = APIClient()
         other_user = get_user_model().objects.create_user(
@@ -69,8 +106,10 @@ class AuthenticatedPaymentApiTest(TestCase):
             status="PAID",
             type_pay="PAYMENT",
             borrowing=other_borrowing,
-            session_url="https://other_example.com",
-            session_id="other_TEST123session_id",
+            checkout_session=CheckoutSession.objects.create(
+                session_id="other_TEST123session_id",
+                session_url="https://other_example.com",
+            ),
             money_to_pay=2.00,
         )
 
@@ -78,8 +117,8 @@ class AuthenticatedPaymentApiTest(TestCase):
 
         response = self.client.get(PAYMENTS_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]["id"], self.payment.id)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertEqual(response.data["results"][0]["id"], self.payment.id)
 
         url = f"{PAYMENTS_URL}{other_payment.id}/"
         response = self.client.get(url)
@@ -124,8 +163,9 @@ class AdminBorrowingApiTest(TestCase):
             status="PAID",
             type_pay="PAYMENT",
             borrowing=self.borrowing,
-            session_url="https://example.com",
-            session_id="TEST123session_id",
+            checkout_session=CheckoutSession.objects.create(
+                session_id="TEST123session_id", session_url="https://example.com"
+            ),
             money_to_pay=3.00,
         )
 
@@ -146,8 +186,10 @@ class AdminBorrowingApiTest(TestCase):
             status="PAID",
             type_pay="PAYMENT",
             borrowing=other_borrowing,
-            session_url="https://other_example.com",
-            session_id="other_TEST123session_id",
+            checkout_session=CheckoutSession.objects.create(
+                session_id="other_TEST123session_id",
+                session_url="https://other_example.com",
+            ),
             money_to_pay=2.00,
         )
 
@@ -155,8 +197,338 @@ class AdminBorrowingApiTest(TestCase):
 
         response = self.client.get(PAYMENTS_URL)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
         url = f"{PAYMENTS_URL}{other_payment.id}/"
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+@mock.patch("payments.tasks.apply_stripe_events.apply_async")
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        user = get_user_model().objects.create_user(email="test@test.com")
+        book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=2,
+            daily_fee=1.00,
+        )
+        self.borrowing = Borrowing.objects.create(
+            borrow_date=datetime.today().date(),
+            expected_return_date=datetime.today().date() + timedelta(days=5),
+            book=book,
+            user=user,
+        )
+        self.payments = [
+            Payment.objects.create(
+                status="PENDING",
+                type_pay="PAYMENT",
+                borrowing=self.borrowing,
+                checkout_session=CheckoutSession.objects.create(
+                    session_id=f"cs_test_{i}", session_url="https://example.com"
+                ),
+                money_to_pay=5.00,
+            )
+            for i in range(3)
+        ]
+
+    def post_event(self, event_id, session_id, event_type="checkout.session.completed"):
+        payload = json.dumps(
+            {
+                "id": event_id,
+                "object": "event",
+                "type": event_type,
+                "data": {
+                    "object": {
+                        "id": session_id,
+                        "object": "checkout.session",
+                        "payment_status": "paid",
+                    }
+                },
+            }
+        )
+        return self.client.generic(
+            "POST",
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload),
+        )
+
+    def test_invalid_signature_is_rejected(self, apply_async):
+        response = self.client.generic(
+            "POST",
+            WEBHOOK_URL,
+            json.dumps({"id": "evt_1"}),
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE="t=1,v1=invalid",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+        apply_async.assert_not_called()
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=None)
+    def test_missing_secret_is_unavailable(self, apply_async):
+        with self.assertLogs("payments.views", "ERROR"):
+            response = self.post_event("evt_1", "cs_test_0")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_are_deduplicated_and_applied_in_batch(self, apply_async):
+        for i, payment in enumerate(self.payments[:2]):
+            response = self.post_event(f"evt_{i}", payment.checkout_session.session_id)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.post_event("evt_0", self.payments[0].checkout_session.session_id)
+        self.post_event("evt_unknown", "cs_unknown")
+        self.post_event(
+            "evt_expired",
+            self.payments[2].checkout_session.session_id,
+            "checkout.session.expired",
+        )
+
+        self.assertEqual(StripeEvent.objects.count(), 4)
+        apply_async.assert_called_once()
+        self.assertFalse(Payment.objects.filter(status="PAID").exists())
+
+        apply_stripe_events()
+
+        self.assertEqual(
+            list(Payment.objects.order_by("id").values_list("status", flat=True)),
+            ["PAID", "PAID", "PENDING"],
+        )
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+
+class PaymentSuccessTest(TestCase):
+    def test_unknown_session_is_not_found(self):
+        response = self.client.get(reverse("payment_success"), {"session_id": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_success_page_does_not_settle_the_payment(self):
+        user = get_user_model().objects.create_user(email="test@test.com")
+        book = Book.objects.create(
+            title="Test Book Title", author="Test Author", inventory=1, daily_fee=1
+        )
+        payment = Payment.objects.create(
+            status="PENDING",
+            type_pay="PAYMENT",
+            borrowing=Borrowing.objects.create(
+                borrow_date=datetime.today().date(),
+                expected_return_date=datetime.today().date() + timedelta(days=5),
+                book=book,
+                user=user,
+            ),
+            checkout_session=CheckoutSession.objects.create(
+                session_id="cs_test_0", session_url="https://example.com"
+            ),
+            money_to_pay=5.00,
+        )
+
+        response = self.client.get(
+            reverse("payment_success"), {"session_id": "cs_test_0"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, "PENDING")
+
+
+class FineAccrualTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="reader@test.com", password="test12345"
+        )
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=2,
+            daily_fee=1.50,
+        )
+        self.today = datetime.today().date()
+
+    def borrow(self, due_in_days):
+        return Borrowing.objects.create(
+            borrow_date=self.today - timedelta(days=30),
+            expected_return_date=self.today + timedelta(days=due_in_days),
+            book=self.book,
+            user=self.user,
+        )
+
+    def test_accruals_are_refreshed_incrementally(self):
+        overdue = self.borrow(-3)
+        self.borrow(2)
+
+        self.assertEqual(
+            refresh_fine_accruals(self.today),
+            {"created": 1, "updated": 0, "deleted": 0},
+        )
+        accrual = FineAccrual.objects.get()
+        self.assertEqual(accrual.borrowing, overdue)
+        self.assertEqual(accrual.overdue_days, 3)
+        # 3 days * 1.50 daily fee * fine multiplier 2
+        self.assertEqual(accrual.amount, Decimal("9.00"))
+
+        self.assertEqual(
+            refresh_fine_accruals(self.today),
+            {"created": 0, "updated": 0, "deleted": 0},
+        )
+        self.assertEqual(
+            refresh_fine_accruals(self.today + timedelta(days=1)),
+            {"created": 0, "updated": 1, "deleted": 0},
+        )
+        self.assertEqual(FineAccrual.objects.get().amount, Decimal("12.00"))
+
+        overdue.actual_return_date = self.today
+        overdue.save()
+        self.assertEqual(refresh_fine_accruals(self.today)["deleted"], 1)
+
+    def test_borrowing_list_shows_accrued_fine(self):
+        overdue = self.borrow(-2)
+        refresh_fine_accruals(self.today)
+        self.borrow(2)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("borrowing:borrowing-list"))
+        fines = {row["id"]: row["accrued_fine"] for row in response.data["results"]}
+        self.assertEqual(fines.pop(overdue.id), "6.00")
+        self.assertEqual(list(fines.values()), [None])
+
+
+class ExpirePendingPaymentsTest(TestCase):
+    def setUp(self):
+        self.stripe = StubStripe()
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", self.stripe)
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            email="reader@test.com", password="test12345"
+        )
+        self.book = Book.objects.create(
+            title="Test Book Title", author="Test Author", inventory=0, daily_fee=1
+        )
+        self.today = datetime.today().date()
+
+    def pending_payment(self, age_hours, session_status=None, payment_status="unpaid"):
+        borrowing = Borrowing.objects.create(
+            borrow_date=self.today,
+            expected_return_date=self.today + timedelta(days=5),
+            book=self.book,
+            user=self.user,
+        )
+        payment = record_pending_payment(borrowing, "PAYMENT")
+        created_at = timezone.now() - timedelta(hours=age_hours)
+        if session_status:
+            session = self.stripe.checkout.Session.create()
+            session.created = int(created_at.timestamp()) + 5
+            session.status = session_status
+            session.payment_status = payment_status
+            payment.checkout_session = CheckoutSession.objects.create(
+                session_id=session.id, session_url=session.url
+            )
+        payment.created_at = created_at
+        payment.save()
+        return payment
+
+    def test_stale_payments_are_settled_with_stripe(self):
+        expired = self.pending_payment(30, "expired")
+        paid = self.pending_payment(26, "complete", "paid")
+        without_session = self.pending_payment(40)
+        fresh = self.pending_payment(1, "open")
+
+        counts = expire_pending_payments()
+
+        self.assertEqual(
+            {name: count for name, count in counts.items() if name != "seconds"},
+            {"stale": 3, "paid": 1, "expired": 2, "released": 0, "failed": 0},
+        )
+        statuses = dict(Payment.objects.values_list("id", "status"))
+        self.assertEqual(statuses[expired.id], "EXPIRED")
+        self.assertEqual(statuses[paid.id], "PAID")
+        self.assertEqual(statuses[without_session.id], "EXPIRED")
+        self.assertEqual(statuses[fresh.id], "PENDING")
+        self.assertEqual(len(self.stripe.list_calls), 1)
+        summary = UserSummary.objects.get(user=self.user)
+        self.assertEqual(summary.pending_payments, fresh.money_to_pay)
+        # nothing released by default
+        self.assertEqual(
+            Borrowing.objects.filter(actual_return_date__isnull=True).count(), 4
+        )
+
+    def test_sessions_outside_the_window_are_retrieved(self):
+        # created before the payment's created_at, as for the payments
+        # that got theirs from the migration
+        legacy = self.pending_payment(30, "complete", "paid")
+        self.stripe.sessions[legacy.checkout_session.session_id].created -= 86400
+        unknown = self.pending_payment(30)
+        unknown.checkout_session = CheckoutSession.objects.create(
+            session_id="cs_unknown", session_url="https://checkout.stripe.test/"
+        )
+        unknown.save()
+
+        counts = expire_pending_payments()
+
+        self.assertEqual((counts["paid"], counts["expired"]), (1, 0))
+        self.assertEqual(
+            set(self.stripe.retrieve_calls),
+            {"cs_unknown", legacy.checkout_session.session_id},
+        )
+        statuses = dict(Payment.objects.values_list("id", "status"))
+        self.assertEqual(statuses[legacy.id], "PAID")
+        self.assertEqual(statuses[unknown.id], "PENDING")
+
+    @override_settings(EXPIRED_PAYMENT_RELEASES_BOOK=True)
+    def test_expired_payment_releases_the_book(self):
+        expired = self.pending_payment(30, "expired")
+        self.pending_payment(30, "complete", "paid")
+
+        counts = expire_pending_payments()
+
+        self.assertEqual(counts["released"], 1)
+        expired.borrowing.refresh_from_db()
+        self.assertEqual(expired.borrowing.actual_return_date, self.today)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 1)
+
+
+class PaymentExportApiTest(TestCase):
+    def test_export_payments_of_one_user(self):
+        admin = get_user_model().objects.create_user(
+            "admin@admin.com", "testpass", is_staff=True
+        )
+        reader = get_user_model().objects.create_user("reader@test.com", "testpass")
+        book = Book.objects.create(
+            title="Test Book Title", author="Test Author", inventory=2, daily_fee=1
+        )
+        for user in (admin, reader):
+            borrowing = Borrowing.objects.create(
+                borrow_date=datetime.today().date(),
+                expected_return_date=datetime.today().date() + timedelta(days=3),
+                book=book,
+                user=user,
+            )
+            Payment.objects.create(
+                status="PENDING",
+                type_pay="PAYMENT",
+                borrowing=borrowing,
+                money_to_pay=3,
+            )
+
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.get(
+            PAYMENTS_URL + "export/", {"user_id": reader.id, "file_format": "ndjson"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["borrowing__user__email"], "reader@test.com")
+        self.assertEqual(rows[0]["money_to_pay"], "3.00")
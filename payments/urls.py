@@ -3,6 +3,7 @@ from rest_framework import routers
 
 from payments.views import (
     PaymentView,
+    stripe_webhook,
 )
 
 router = routers.DefaultRouter()
@@ -11,6 +12,7 @@ router.register("", PaymentView)
 
 
 urlpatterns = [
+    path("webhook/", stripe_webhook, name="stripe-webhook"),
     path("", include(router.urls)),
 ]
 
@@ -1,22 +1,55 @@
+import logging
+
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse
-from rest_framework import mixins, viewsets
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from stripe import SignatureVerificationError
 
-from payments.models import Payment
+from library_service.db_router import ReplicaReadMixin
+from library_service.exports import ExportParamsSerializer, export_response
+from library_service.values_serializers import ValuesListMixin
+from payments.models import CheckoutSession, Payment, StripeEvent
 from payments.permissions import IsAdminOrIfAuthenticatedReadOnly
 from payments.serializers import (
     PaymentSerializer,
+    PaymentListSerializer,
     PaymentRetrieveSerializer,
 )
+from payments.stripe_helper import construct_webhook_event
+from payments.tasks import schedule_stripe_event_processing
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = (
+    "id",
+    "status",
+    "type_pay",
+    "money_to_pay",
+    "checkout_session__session_id",
+    "borrowing_id",
+    "borrowing__borrow_date",
+    "borrowing__user_id",
+    "borrowing__user__email",
+    "borrowing__book__title",
+)
 
 
 class PaymentView(
+    ReplicaReadMixin,
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet,
 ):
-    queryset = Payment.objects.select_related("borrowing")
+    queryset = Payment.objects.select_related("borrowing__book", "checkout_session")
     serializer_class = PaymentSerializer
+    values_serializer_class = PaymentListSerializer
     permission_classes = (IsAdminOrIfAuthenticatedReadOnly,)
 
     def get_serializer_class(self):
@@ -32,15 +65,118 @@ class PaymentView(
         if user.is_authenticated and not user.is_staff:
             return self.queryset.filter(borrowing__user=user)
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "fields",
+                type={"type": "string"},
+                description="Return only these fields (ex. /?fields=id,status)",
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        """
+        Get list of payments
+        """
+        return super().list(request, *args, **kwargs)
+
+    @extend_schema(
+        parameters=[
+            ExportParamsSerializer,
+            OpenApiParameter(
+                "user_id",
+                type={"type": "int"},
+                description="Export the payments of one user (ex. /?user_id=1)",
+            ),
+            OpenApiParameter(
+                "is_active",
+                type={"type": "bool"},
+                description="Export only the payments of borrowings not returned",
+            ),
+        ],
+        responses={(200, "text/csv"): bytes, (200, "application/x-ndjson"): bytes},
+    )
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        """
+        Stream the payments as CSV or NDJSON (?file_format=ndjson), filtered
+        by the borrow date of their borrowing with ?date_from= and ?date_to=.
+        """
+        params = ExportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = Payment.objects.all()
+        user_id = request.query_params.get("user_id")
+        if user_id:
+            queryset = queryset.filter(borrowing__user_id=user_id)
+        is_active = request.query_params.get("is_active")
+        if is_active and is_active.lower() == "true":
+            queryset = queryset.filter(borrowing__actual_return_date__isnull=True)
+        if "date_from" in params.validated_data:
+            queryset = queryset.filter(
+                borrowing__borrow_date__gte=params.validated_data["date_from"]
+            )
+        if "date_to" in params.validated_data:
+            queryset = queryset.filter(
+                borrowing__borrow_date__lte=params.validated_data["date_to"]
+            )
+        return export_response(
+            queryset.order_by("id"),
+            EXPORT_COLUMNS,
+            params.validated_data["file_format"],
+            "payments",
+        )
+
 
 def payment_success(request):
+    """
+    The page Stripe redirects to after a checkout. It only shows the
+    result: the payments are marked PAID by the verified webhook events,
+    as anyone can open this URL with any session id.
+    """
     session_id = request.GET.get("session_id")
-    if session_id:
-        payment = Payment.objects.get(session_id=session_id)
-        payment.status = "PAID"
-        payment.save()
+    if session_id and CheckoutSession.objects.filter(session_id=session_id).exists():
         return render(request, "success.html")
-    return HttpResponse("Payment session not found.")
+    return HttpResponse("Payment session not found.", status=status.HTTP_404_NOT_FOUND)
+
 
 def payment_cancel(request):
     return render(request, "cancel.html")
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Receive Stripe events.
+
+    Events are verified, stored once per event id and applied to the
+    payments in batches by a Celery task, so the endpoint itself
+    only costs one INSERT. Without STRIPE_WEBHOOK_SECRET nothing can be
+    verified and every event is answered with a 503.
+    """
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        # Stripe retries the event once the secret is configured
+        logger.error("STRIPE_WEBHOOK_SECRET is not set, cannot verify Stripe events")
+        return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    try:
+        event = construct_webhook_event(
+            request.body, request.headers.get("Stripe-Signature", "")
+        )
+    except (ValueError, SignatureVerificationError):
+        return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+
+    data = event["data"]["object"]
+    is_checkout_session = data.get("object") == "checkout.session"
+    StripeEvent.objects.bulk_create(
+        [
+            StripeEvent(
+                event_id=event["id"],
+                type=event["type"],
+                session_id=data.get("id", "") if is_checkout_session else "",
+                payment_status=data.get("payment_status") or "",
+            )
+        ],
+        ignore_conflicts=True,
+    )
+    schedule_stripe_event_processing()
+    return HttpResponse(status=status.HTTP_200_OK)
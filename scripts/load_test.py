@@ -0,0 +1,117 @@
+"""
+Load test of a running Library Service instance.
+
+Measures requests per second and latency of the book list and of
+borrowing create (each created borrowing is returned again, so that
+the run does not exhaust the inventory).
+
+    python scripts/load_test.py --base-url http://localhost:8000 \
+        --email admin@admin.com --password secret --book-ids 1,2,3,4
+
+The account must be staff. Every worker borrows its own book from
+--book-ids, so pass at least --concurrency ids of books in stock.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import date, timedelta
+
+import httpx
+
+
+async def obtain_token(client, email, password):
+    response = await client.post(
+        "/api/users/token/", json={"email": email, "password": password}
+    )
+    response.raise_for_status()
+    return response.json()["access"]
+
+
+async def run_scenario(name, request, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker(worker_id):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            ok = await request(worker_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+        "p95_ms": (
+            round(latencies[int(len(latencies) * 0.95) - 1], 1) if latencies else None
+        ),
+    }
+
+
+async def main(options):
+    limits = httpx.Limits(max_connections=options.concurrency)
+    async with httpx.AsyncClient(
+        base_url=options.base_url, limits=limits, timeout=30
+    ) as client:
+        token = await obtain_token(client, options.email, options.password)
+        headers = {"Authorize": f"Bearer {token}"}
+        me = (await client.get("/api/users/me/", headers=headers)).json()
+        book_ids = [int(book_id) for book_id in options.book_ids.split(",")]
+        if len(book_ids) < options.concurrency:
+            raise SystemExit("Pass at least --concurrency book ids")
+
+        async def list_books(worker_id):
+            response = await client.get("/api/books/")
+            return response.status_code == 200
+
+        async def borrow(worker_id):
+            response = await client.post(
+                "/api/borrowings/",
+                headers=headers,
+                json={
+                    "user": me["id"],
+                    "book": book_ids[worker_id],
+                    "expected_return_date": str(date.today() + timedelta(days=7)),
+                },
+            )
+            if response.status_code != 201:
+                return False
+            await client.post(
+                f"/api/borrowings/{response.json()['id']}/return/", headers=headers
+            )
+            return True
+
+        results = [
+            await run_scenario(
+                "book list", list_books, options.concurrency, options.duration
+            ),
+            await run_scenario(
+                "borrowing create (+ return)",
+                borrow,
+                options.concurrency,
+                options.duration,
+            ),
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--book-ids", required=True)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from user.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    """Django command to recompute every user summary from the borrowings and payments."""
+
+    help = "Rebuild the per-user borrowing and payment summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user", type=int, action="append", dest="user_ids", help="user id"
+        )
+
+    def handle(self, *args, **options):
+        written = rebuild_summaries(options["user_ids"])
+        self.stdout.write(self.style.SUCCESS(f"{written} user summaries rebuilt"))
@@ -2,6 +2,7 @@ from django.contrib.auth.models import (
     AbstractUser,
     BaseUserManager,
 )
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext as _
 
@@ -48,3 +49,27 @@ class User(AbstractUser):
     REQUIRED_FIELDS = []
 
     objects = UserManager()
+
+
+class UserSummary(models.Model):
+    """
+    Running totals of a user's borrowings and payments.
+
+    Kept up to date by the borrow, return and payment code paths (see
+    `user.summary`) and rebuilt from scratch by `rebuild_user_summaries`.
+    """
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary",
+    )
+    active_borrowings = models.IntegerField(default=0)
+    overdue_borrowings = models.IntegerField(default=0)
+    pending_payments = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    pending_fines = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of user {self.user_id}"
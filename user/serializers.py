@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
+from user.models import UserSummary
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,3 +30,28 @@ class UserSerializer(serializers.ModelSerializer):
             user.save()
 
         return user
+
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    total_owed = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UserSummary
+        fields = (
+            "active_borrowings",
+            "overdue_borrowings",
+            "pending_payments",
+            "pending_fines",
+            "total_owed",
+            "updated_at",
+        )
+
+    def get_total_owed(self, summary) -> str:
+        return str(summary.pending_payments + summary.pending_fines)
+
+
+class ManageUserSerializer(UserSerializer):
+    summary = UserSummarySerializer(read_only=True)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ("summary",)
@@ -0,0 +1,182 @@
+"""
+Maintenance of the per-user `UserSummary` rows.
+
+The borrow, return and payment code paths call `adjust_summary` inside
+their own transaction, so the counters change together with the rows
+they describe. `rebuild_summaries` recomputes them from the borrowings
+and payments with a handful of set-based queries.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from borrowing.models import Borrowing
+from payments.models import Payment
+from user.models import UserSummary
+
+REBUILD_BATCH_SIZE = 1000
+SUMMARY_FIELDS = (
+    "active_borrowings",
+    "overdue_borrowings",
+    "pending_payments",
+    "pending_fines",
+)
+
+
+def pending_field(type_pay: str) -> str:
+    return "pending_fines" if type_pay == "FINE" else "pending_payments"
+
+
+def adjust_summary(user_id, **deltas) -> None:
+    """
+    Add the deltas to the user's counters with one UPDATE.
+
+    A user without a summary row yet gets it rebuilt from the current
+    (already changed) borrowings and payments instead.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = UserSummary.objects.filter(user_id=user_id).update(
+        updated_at=timezone.now(),
+        **{field: F(field) + delta for field, delta in deltas.items()},
+    )
+    if not updated:
+        rebuild_summaries([user_id])
+
+
+def record_payments(payments, sign: int = 1) -> None:
+    """
+    Add the (user_id, type_pay, money_to_pay) payments to their users'
+    pending amounts, or take them off with sign=-1.
+    """
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    for user_id, type_pay, money_to_pay in payments:
+        deltas[user_id][pending_field(type_pay)] += sign * money_to_pay
+    for user_id, user_deltas in deltas.items():
+        adjust_summary(user_id, **user_deltas)
+
+
+def record_paid(payments) -> None:
+    """Take payments which just became PAID off their users' pending amounts."""
+    record_payments(payments, sign=-1)
+
+
+def counted(queryset, outer_ref: str = "pk"):
+    return Coalesce(
+        Subquery(
+            queryset.filter(user=OuterRef(outer_ref))
+            .order_by()
+            .values("user")
+            .annotate(total=Count("id"))
+            .values("total"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def pending_sum(type_pay: str):
+    return Coalesce(
+        Subquery(
+            Payment.objects.filter(
+                borrowing__user=OuterRef("pk"), status="PENDING", type_pay=type_pay
+            )
+            .order_by()
+            .values("borrowing__user")
+            .annotate(total=Sum("money_to_pay"))
+            .values("total"),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+        Value(Decimal(0)),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def summary_values(users, today: date = None):
+    """Annotate the users queryset with freshly computed summary values."""
+    today = today or datetime.today().date()
+    active = Borrowing.objects.filter(actual_return_date__isnull=True)
+    return users.annotate(
+        active_borrowings=counted(active),
+        overdue_borrowings=counted(active.filter(expected_return_date__lt=today)),
+        pending_payments=pending_sum("PAYMENT"),
+        pending_fines=pending_sum("FINE"),
+    ).values_list("pk", *SUMMARY_FIELDS)
+
+
+def rebuild_summaries(user_ids=None) -> int:
+    """
+    Recompute the summaries of the given users (of everybody by default)
+    and upsert them in batches. Returns the number of rows written.
+    """
+    users = get_user_model().objects.order_by("pk")
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    now = timezone.now()
+    written = 0
+    batch = []
+    for user_id, *values in summary_values(users).iterator(
+        chunk_size=REBUILD_BATCH_SIZE
+    ):
+        batch.append(
+            UserSummary(
+                user_id=user_id, updated_at=now, **dict(zip(SUMMARY_FIELDS, values))
+            )
+        )
+        if len(batch) == REBUILD_BATCH_SIZE:
+            written += upsert(batch)
+            batch = []
+    if batch:
+        written += upsert(batch)
+    return written
+
+
+def upsert(summaries) -> int:
+    UserSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=[*SUMMARY_FIELDS, "updated_at"],
+    )
+    return len(summaries)
+
+
+def refresh_overdue(today: date = None) -> int:
+    """
+    Recount the overdue borrowings of every summary with one UPDATE.
+
+    Borrowings become overdue by the passing of time rather than by a
+    write, so this runs once a day.
+    """
+    today = today or datetime.today().date()
+    overdue = Borrowing.objects.filter(
+        actual_return_date__isnull=True, expected_return_date__lt=today
+    )
+    return UserSummary.objects.update(
+        overdue_borrowings=counted(overdue, outer_ref="user"),
+        updated_at=timezone.now(),
+    )
+
+
+def get_summary(user) -> UserSummary:
+    summary = UserSummary.objects.filter(user=user).first()
+    if summary is None:
+        rebuild_summaries([user.pk])
+        summary = UserSummary.objects.get(user=user)
+    return summary
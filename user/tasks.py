@@ -0,0 +1,14 @@
+import logging
+
+from celery import shared_task
+
+from user.summary import refresh_overdue
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def refresh_overdue_summaries():
+    """Recount the overdue borrowings of the user summaries for the new day."""
+    updated = refresh_overdue()
+    logger.info("Overdue borrowings recounted for %s users", updated)
@@ -1,3 +1,119 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+
+from books.models import Book
+from borrowing.models import Borrowing
+from payments.models import Payment, StripeEvent
+from payments.stripe_stub import StubStripe
+from payments.tasks import apply_stripe_events
+from user.models import UserSummary
+from user.summary import refresh_overdue
+
+ME_URL = reverse("user:manage")
+BORROWING_URL = reverse("borrowing:borrowing-list")
+
+
+def summary_of(user):
+    return UserSummary.objects.values(
+        "active_borrowings", "overdue_borrowings", "pending_payments", "pending_fines"
+    ).get(user=user)
+
+
+class UserSummaryTest(TestCase):
+    def setUp(self):
+        stripe_patcher = mock.patch("payments.stripe_helper.stripe", StubStripe())
+        stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+        self.user = get_user_model().objects.create_user(
+            email="reader@test.com", password="test12345"
+        )
+        self.admin = APIClient()
+        self.admin.force_authenticate(
+            get_user_model().objects.create_user(
+                "admin@admin.com", "testpass", is_staff=True
+            )
+        )
+        self.book = Book.objects.create(
+            title="Test Book Title",
+            author="Test Author",
+            inventory=5,
+            daily_fee=2.00,
+        )
+        self.today = datetime.today().date()
+
+    def test_me_shows_summary(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["summary"]["active_borrowings"], 0)
+        self.assertEqual(response.data["summary"]["total_owed"], "0.00")
+
+    def test_borrow_return_and_pay_update_summary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.admin.post(
+                BORROWING_URL,
+                {
+                    "user": self.user.id,
+                    "book": self.book.id,
+                    "expected_return_date": self.today + timedelta(days=3),
+                },
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            summary_of(self.user),
+            {
+                "active_borrowings": 1,
+                "overdue_borrowings": 0,
+                "pending_payments": Decimal("6.00"),
+                "pending_fines": Decimal("0.00"),
+            },
+        )
+
+        overdue = Borrowing.objects.create(
+            borrow_date=self.today - timedelta(days=10),
+            expected_return_date=self.today - timedelta(days=2),
+            book=self.book,
+            user=self.user,
+        )
+        refresh_overdue()
+        self.assertEqual(summary_of(self.user)["overdue_borrowings"], 1)
+
+        response = self.admin.post(f"{BORROWING_URL}{overdue.id}/return/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = summary_of(self.user)
+        self.assertEqual(summary["overdue_borrowings"], 0)
+        # 2 days overdue * 2.00 daily fee * fine multiplier 2
+        self.assertEqual(summary["pending_fines"], Decimal("8.00"))
+
+        payment = Payment.objects.get(type_pay="PAYMENT")
+        StripeEvent.objects.create(
+            event_id="evt_paid",
+            type="checkout.session.completed",
+            session_id=payment.checkout_session.session_id,
+            payment_status="paid",
+        )
+        apply_stripe_events()
+        self.assertEqual(summary_of(self.user)["pending_payments"], Decimal("0.00"))
+
+    def test_rebuild_command_matches_source_rows(self):
+        Borrowing.objects.create(
+            borrow_date=self.today,
+            expected_return_date=self.today + timedelta(days=3),
+            book=self.book,
+            user=self.user,
+        )
+        UserSummary.objects.create(user=self.user, active_borrowings=42)
 
-# Create your tests here.
+        call_command("rebuild_user_summaries", stdout=mock.Mock())
+        self.assertEqual(summary_of(self.user)["active_borrowings"], 1)
+        self.assertEqual(UserSummary.objects.count(), 2)
@@ -3,7 +3,8 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
-from user.serializers import UserSerializer
+from user.serializers import UserSerializer, ManageUserSerializer
+from user.summary import get_summary
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -11,9 +12,11 @@ class CreateUserView(generics.CreateAPIView):
 
 
 class ManageUserView(generics.RetrieveUpdateAPIView):
-    serializer_class = UserSerializer
+    serializer_class = ManageUserSerializer
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        user.summary = get_summary(user)
+        return user